@@ -27,6 +27,7 @@ const optionsSchema = z.object({
 
 const MAX_RETRIES = 3;
 const RETRY_DELAYS = [1000, 2000, 4000]; // exponential backoff
+const MAX_RETRY_AFTER_MS = 30_000; // cap for the service's Retry-After hint
 
 async function callServiceWithRetry(
   body: Record<string, unknown>,
@@ -46,6 +47,18 @@ async function callServiceWithRetry(
 
       clearTimeout(timeout);
 
+      // Service is saturated: wait as long as it asks instead of piling on
+      if (response.status === 429) {
+        const retryAfter = Number(response.headers.get("Retry-After")) || 0;
+        if (attempt === retries - 1) {
+          throw new Error("Stencil service is busy, please try again shortly");
+        }
+        const delay = Math.min(Math.max(retryAfter * 1000, RETRY_DELAYS[attempt] || 4000), MAX_RETRY_AFTER_MS);
+        console.log(`[Retry] Service busy, retrying in ${delay}ms...`);
+        await new Promise((resolve) => setTimeout(resolve, delay));
+        continue;
+      }
+
       if (!response.ok) {
         throw new Error(`Service returned HTTP ${response.status}`);
       }
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Admission control for the Stencil Processing Service.
+
+Bounds how many requests may run and wait at once. Requests beyond the
+queue limit are rejected immediately with a suggested retry delay instead
+of piling up in the socket backlog until the caller times out.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Optional
+
+
+class ServiceBusyError(Exception):
+    """Raised when the admission queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Service saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded admission queue in front of stencil generation.
+
+    At most `max_concurrency` requests run at once and at most `max_queue`
+    wait behind them. Service time is tracked as an exponential moving
+    average to estimate queueing delay.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 1,
+                 max_queue: int = 16,
+                 initial_estimate: float = 5.0,
+                 smoothing: float = 0.2):
+        """
+        Args:
+            max_concurrency: Requests processed at the same time
+            max_queue: Requests allowed to wait for a free slot
+            initial_estimate: Service time guess (seconds) before any request finished
+            smoothing: EWMA weight of the most recent service time
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.smoothing = smoothing
+
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.avg_service_time = initial_estimate
+        self.completed = 0
+        self.rejected = 0
+
+    def _estimated_wait(self) -> float:
+        """Seconds a newly admitted request would wait (caller holds lock)."""
+        if self.in_flight < self.max_concurrency:
+            return 0.0
+        # Jobs ahead run in waves of max_concurrency; the running wave is
+        # on average half done
+        waves = self.queued / self.max_concurrency + 0.5
+        return waves * self.avg_service_time
+
+    @contextmanager
+    def admit(self, bounded: bool = True, abort: Optional[Callable[[], None]] = None):
+        """
+        Context manager that holds a processing slot for its duration.
+
+        Args:
+            bounded: Reject when the queue is full. Callers that bound their
+                own backlog (e.g. the job manager) pass False to always wait.
+            abort: Optional check run while waiting for a slot (again on
+                every wake(), under the queue lock, so it must not block);
+                raising from it leaves the queue
+
+        Raises:
+            ServiceBusyError: If the queue is full
+        """
+        with self._cond:
+            if bounded and self.in_flight >= self.max_concurrency and self.queued >= self.max_queue:
+                self.rejected += 1
+                retry_after = max(1, math.ceil(self._estimated_wait()))
+                raise ServiceBusyError(retry_after)
+
+            self.queued += 1
+            try:
+                while self.in_flight >= self.max_concurrency:
+                    if abort is not None:
+                        abort()
+                    self._cond.wait()
+            except BaseException:
+                # Pass on a freed slot this waiter may have been woken for
+                self._cond.notify()
+                raise
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self.in_flight -= 1
+                self.completed += 1
+                self.avg_service_time += self.smoothing * (elapsed - self.avg_service_time)
+                self._cond.notify()
+
+    def wake(self):
+        """Wake all waiting requests so they re-run their abort checks."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue status for the health endpoint."""
+        with self._cond:
+            return {
+                'queueDepth': self.queued,
+                'queueLimit': self.max_queue,
+                'inFlight': self.in_flight,
+                'concurrency': self.max_concurrency,
+                'estimatedWait': round(self._estimated_wait(), 2),
+                'avgServiceTime': round(self.avg_service_time, 2),
+                'saturated': (self.in_flight >= self.max_concurrency
+                              and self.queued >= self.max_queue),
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
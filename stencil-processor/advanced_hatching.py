@@ -6,7 +6,11 @@ Implements vector field-based hatching with density mapping.
 import cv2
 import numpy as np
 from typing import Tuple, Optional
-import math
+
+from hatch import HatchLayer, hatch
+from posterize import Posterization
+from streamlines import draw_streamlines, evenly_spaced_streamlines, grid_seeds
+from pyramid import ImagePyramid, reduced_gaussian
 
 
 class AdvancedHatching:
@@ -23,6 +27,9 @@ class AdvancedHatching:
         self.max_spacing = 15
         self.line_length_base = 15
         self.line_length_var = 10
+        # 'even': evenly spaced streamlines, spacing set by tone;
+        # 'grid': strokes seeded on a fixed grid in up to four passes
+        self.placement = "even"
         
     def generate(
         self,
@@ -30,7 +37,8 @@ class AdvancedHatching:
         direction: str = "auto",
         density_mode: str = "gradient",
         thickness: int = 1,
-        angle: float = 45
+        angle: float = 45,
+        pyramid: Optional[ImagePyramid] = None
     ) -> np.ndarray:
         """
         Generate hatching pattern.
@@ -41,12 +49,14 @@ class AdvancedHatching:
             density_mode: 'gradient' (based on darkness), 'uniform'
             thickness: Line thickness
             angle: Angle for fixed directions
+            pyramid: The request's ImagePyramid of gray, if one exists
             
         Returns:
             Hatching pattern (white background, black lines)
         """
         h, w = gray.shape
         result = np.ones((h, w), dtype=np.uint8) * 255
+        pyramid = pyramid or ImagePyramid(gray)
         
         # Compute density map
         if density_mode == "gradient":
@@ -57,7 +67,7 @@ class AdvancedHatching:
         # Generate based on direction mode
         if direction == "auto":
             # Vector field-based hatching
-            result = self._auto_hatching(gray, density, thickness)
+            result = self._auto_hatching(gray, density, thickness, pyramid)
         elif direction == "cross":
             # Cross-hatching (two passes)
             result = self._cross_hatching(gray, density, thickness)
@@ -87,30 +97,32 @@ class AdvancedHatching:
         
         return density
     
-    def _compute_gradient_field(self, gray: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    def _compute_gradient_field(
+        self,
+        gray: np.ndarray,
+        pyramid: Optional[ImagePyramid] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Compute gradient vector field.
         Returns unit vectors perpendicular to gradient (for line direction).
+        
+        The wide smoothing runs at a coarse level of the pyramid (when
+        given), where the field is a quarter of the pixels.
         """
         # Compute gradients
-        grad_x = cv2.Sobel(gray.astype(np.float64), cv2.CV_64F, 1, 0, ksize=3)
-        grad_y = cv2.Sobel(gray.astype(np.float64), cv2.CV_64F, 0, 1, ksize=3)
+        grad_x = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+        grad_y = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
         
-        # Perpendicular direction (rotate 90°)
-        vec_x = -grad_y
-        vec_y = grad_x
+        # Perpendicular direction (rotate 90°), normalized
+        magnitude = cv2.magnitude(grad_x, grad_y) + 1e-8
+        field = cv2.merge([-grad_y / magnitude, grad_x / magnitude])
         
-        # Normalize
-        magnitude = np.sqrt(vec_x**2 + vec_y**2) + 1e-8
-        vec_x_norm = vec_x / magnitude
-        vec_y_norm = vec_y / magnitude
-        
-        # Smooth the field for coherent lines
-        vec_x_smooth = cv2.GaussianBlur(vec_x_norm, (21, 21), 5)
-        vec_y_smooth = cv2.GaussianBlur(vec_y_norm, (21, 21), 5)
+        # Smooth the field for coherent lines (at a coarse pyramid level)
+        field = reduced_gaussian(pyramid, field, 21, 5)
         
         # Renormalize after smoothing
-        mag_smooth = np.sqrt(vec_x_smooth**2 + vec_y_smooth**2) + 1e-8
+        vec_x_smooth, vec_y_smooth = cv2.split(field)
+        mag_smooth = cv2.magnitude(vec_x_smooth, vec_y_smooth) + 1e-8
         vec_x_final = vec_x_smooth / mag_smooth
         vec_y_final = vec_y_smooth / mag_smooth
         
@@ -120,7 +132,8 @@ class AdvancedHatching:
         self,
         gray: np.ndarray,
         density: np.ndarray,
-        thickness: int
+        thickness: int,
+        pyramid: Optional[ImagePyramid] = None
     ) -> np.ndarray:
         """
         Generate hatching following the form (auto direction).
@@ -129,76 +142,43 @@ class AdvancedHatching:
         result = np.ones((h, w), dtype=np.uint8) * 255
         
         # Get vector field
-        vec_x, vec_y = self._compute_gradient_field(gray)
-        
-        # Multi-pass generation with different spacing
+        vec_x, vec_y = self._compute_gradient_field(gray, pyramid)
+        
+        if self.placement == "even":
+            # Line spacing from tone, no lines in the lightest areas
+            spacing = self.max_spacing - (self.max_spacing - self.min_spacing) * density
+            spacing = np.maximum(spacing, thickness + 2)
+            separation = np.where(density >= 0.2, spacing, np.inf)
+            strokes = evenly_spaced_streamlines(
+                (vec_x, vec_y), separation,
+                max_steps=self.line_length_base + self.line_length_var
+            )
+            cv2.polylines(result, strokes, False, 0, thickness)
+            return result
+        
+        # Multi-pass generation with different spacing; every pass's
+        # strokes are traced in one batch
+        seeds, lengths = [], []
         for pass_idx in range(4):
             spacing = self.base_spacing - pass_idx * 2
             spacing = max(self.min_spacing, spacing)
             
             offset = spacing // 2 * pass_idx
             
-            for y in range(offset, h, spacing):
-                for x in range(offset, w, spacing):
-                    # Check local density
-                    local_density = density[y, x]
-                    
-                    # Threshold for this pass
-                    threshold = 0.2 + pass_idx * 0.15
-                    if local_density < threshold:
-                        continue
-                    
-                    # Draw flow line
-                    line_length = int(self.line_length_base + local_density * self.line_length_var)
-                    self._draw_flow_line(
-                        result, x, y, vec_x, vec_y, 
-                        line_length, thickness, local_density
-                    )
+            # Threshold for this pass
+            threshold = 0.2 + pass_idx * 0.15
+            pass_seeds, local_density = grid_seeds(density, spacing, offset, threshold)
+            seeds.append(pass_seeds)
+            line_length = (self.line_length_base + local_density * self.line_length_var).astype(np.int32)
+            lengths.append(line_length // 2)
+        
+        # Flow lines through each seed, traced both ways
+        draw_streamlines(result, (vec_x, vec_y), np.concatenate(seeds),
+                         np.concatenate(lengths), thickness, step_size=2.0,
+                         bidirectional=True)
         
         return result
     
-    def _draw_flow_line(
-        self,
-        canvas: np.ndarray,
-        start_x: int,
-        start_y: int,
-        vec_x: np.ndarray,
-        vec_y: np.ndarray,
-        max_length: int,
-        thickness: int,
-        intensity: float
-    ) -> None:
-        """
-        Draw a line following the vector field from starting point.
-        """
-        h, w = canvas.shape
-        points = []
-        
-        # Trace line in both directions
-        for direction in [1, -1]:
-            x, y = float(start_x), float(start_y)
-            
-            for _ in range(max_length // 2):
-                ix, iy = int(x), int(y)
-                
-                if not (0 <= ix < w and 0 <= iy < h):
-                    break
-                
-                points.append((int(x), int(y)))
-                
-                # Get local direction
-                dx = vec_x[iy, ix] * direction
-                dy = vec_y[iy, ix] * direction
-                
-                # Step
-                x += dx * 2
-                y += dy * 2
-        
-        # Draw if enough points
-        if len(points) > 1:
-            pts = np.array(points, dtype=np.int32)
-            cv2.polylines(canvas, [pts], False, 0, thickness)
-    
     def _cross_hatching(
         self,
         gray: np.ndarray,
@@ -208,16 +188,7 @@ class AdvancedHatching:
         """
         Generate cross-hatching (45° and 135° lines).
         """
-        # First pass: 45°
-        result1 = self._fixed_hatching(gray, density, thickness, "diagonal", 45)
-        
-        # Second pass: 135°
-        result2 = self._fixed_hatching(gray, density, thickness, "diagonal", 135)
-        
-        # Combine
-        result = cv2.bitwise_and(result1, result2)
-        
-        return result
+        return self._stripe_hatching(density, thickness, (-45.0, -135.0))
     
     def _fixed_hatching(
         self,
@@ -229,65 +200,40 @@ class AdvancedHatching:
     ) -> np.ndarray:
         """
         Generate hatching with fixed direction.
-        """
-        h, w = gray.shape
-        result = np.ones((h, w), dtype=np.uint8) * 255
-        
-        # Convert angle to direction
-        angle_rad = math.radians(angle)
-        dx = math.cos(angle_rad)
-        dy = math.sin(angle_rad)
         
-        # Multi-pass with varying spacing
-        for pass_idx in range(3):
-            spacing = self.base_spacing - pass_idx * 2
-            spacing = max(self.min_spacing, spacing)
-            
-            # Offset for this pass
-            offset = spacing * pass_idx // 3
-            
-            # Generate starting points
-            if direction == "horizontal":
-                for y in range(offset, h, spacing):
-                    for x in range(0, w, spacing):
-                        if density[y, x] > 0.3 + pass_idx * 0.2:
-                            self._draw_straight_line(result, x, y, 1, 0, thickness)
-            elif direction == "vertical":
-                for x in range(offset, w, spacing):
-                    for y in range(0, h, spacing):
-                        if density[y, x] > 0.3 + pass_idx * 0.2:
-                            self._draw_straight_line(result, x, y, 0, 1, thickness)
-            else:  # diagonal
-                # Draw lines at angle
-                for start_y in range(-w, h + w, spacing):
-                    for start_x in range(0, w, spacing):
-                        sy = start_y + start_x * dy
-                        sx = start_x
-                        if 0 <= int(sy) < h and 0 <= sx < w:
-                            if density[int(sy), sx] > 0.3 + pass_idx * 0.2:
-                                self._draw_straight_line(result, sx, int(sy), dx, dy, thickness)
-        
-        return result
+        `angle` is measured in image coordinates (y down), as cos/sin of
+        it were used as the line's step.
+        """
+        if direction == "horizontal":
+            screen_angle = 0.0
+        elif direction == "vertical":
+            screen_angle = 90.0
+        else:  # diagonal
+            screen_angle = -angle
+        return self._stripe_hatching(density, thickness, (screen_angle,))
     
-    def _draw_straight_line(
+    def _stripe_hatching(
         self,
-        canvas: np.ndarray,
-        start_x: int,
-        start_y: int,
-        dx: float,
-        dy: float,
-        thickness: int
-    ) -> None:
-        """
-        Draw a straight line from starting point.
+        density: np.ndarray,
+        thickness: int,
+        angles: Tuple[float, ...]
+    ) -> np.ndarray:
         """
-        h, w = canvas.shape
-        length = min(w, h) // 4
+        Multi-pass straight hatching at the given screen angles.
         
-        end_x = int(start_x + dx * length)
-        end_y = int(start_y + dy * length)
+        Each pass is tighter and only shows where density exceeds its
+        threshold (0.3, 0.5, 0.7), so darker areas get more lines.
+        """
+        layers = []
+        for pass_idx in range(3):
+            spacing = max(self.min_spacing, self.base_spacing - pass_idx * 2)
+            offset = spacing * pass_idx // 3
+            threshold = 0.3 + pass_idx * 0.2
+            layers += [HatchLayer(angle, spacing, threshold, max(1, thickness), offset)
+                       for angle in angles]
         
-        cv2.line(canvas, (start_x, start_y), (end_x, end_y), 0, thickness)
+        lines = hatch(density.shape, layers, density)
+        return 255 - lines
 
 
 class SolidRegionGenerator:
@@ -307,29 +253,16 @@ class SolidRegionGenerator:
         """
         Generate solid posterized stencil.
         """
-        h, w = gray.shape
-        result = np.ones((h, w), dtype=np.uint8) * 255
-        
-        # Posterize
+        # Posterize, all levels in one quantization pass
         step = 256 // self.levels
-        posterized = (gray // step) * step
+        posterization = Posterization(gray, [level * step for level in range(1, self.levels)])
         
-        # Process each level
-        for level in range(self.levels - 1, 0, -1):
-            threshold = level * step
-            
-            # Create binary mask
-            _, mask = cv2.threshold(gray, threshold - 1, 255, cv2.THRESH_BINARY_INV)
-            
-            # Find contours
-            cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            # Fill with grayscale
-            fill_value = max(0, 255 - level * 70)
-            cv2.drawContours(result, cnts, -1, fill_value, -1)
-            
-            # Draw outline
-            cv2.drawContours(result, cnts, -1, 0, thickness)
+        # Fill with grayscale: darker bands darker, the lightest left white
+        tones = [max(0, 255 - (self.levels - 1 - band) * 70) for band in range(self.levels - 1)]
+        result = posterization.fill(tones + [255])
+        
+        # Draw outlines of every level
+        result[posterization.outlines(thickness) > 0] = 0
         
         # Add main contours
         result = cv2.subtract(result, contours)
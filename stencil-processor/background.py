@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Background removal engines for the Tattoo Stencil Generator.
+
+- 'local': built-in, no model downloads. Colors seen along the image
+  border seed a GrabCut segmentation run at a coarse pyramid level
+  (~320 px), and the coarse mask is brought back to full size with a fast
+  guided filter so its outline snaps to the image's edges.
+- 'rembg': the rembg model. Its session is created once per process (each
+  pool worker keeps its own) instead of once per image.
+- 'threshold': makes near-white pixels transparent.
+
+Masks are cached per process by image digest, so re-rendering the same
+picture in another style doesn't segment it again.
+"""
+
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from cache import ByteBudgetLRU
+from pyramid import ImagePyramid
+
+BACKGROUND_ENGINES = ('local', 'rembg', 'threshold')
+DEFAULT_BACKGROUND_ENGINE = 'local'
+
+# Longest side GrabCut runs at; cost grows with the pixel count (~60 ms here)
+SEGMENTATION_SIDE = 320
+
+# Alpha masks by (image digest, shape, engine); a 4K mask is ~16 MB
+BACKGROUND_CACHE_BYTES = 64 * 1024 * 1024
+_mask_cache = ByteBudgetLRU(BACKGROUND_CACHE_BYTES, name='background')
+
+_rembg_session = None
+_rembg_lock = threading.Lock()
+
+
+def validate_background_engine(engine: Optional[str]) -> str:
+    """Normalize a background engine name (None = default)."""
+    engine = (engine or DEFAULT_BACKGROUND_ENGINE).lower()
+    if engine not in BACKGROUND_ENGINES:
+        raise ValueError(f"Unknown background engine: {engine}. "
+                         f"Choose from: {', '.join(BACKGROUND_ENGINES)}")
+    return engine
+
+
+def _border_seeds(lab: np.ndarray, width: int, clusters: int = 4) -> np.ndarray:
+    """
+    Distance of every pixel to the nearest dominant border color.
+
+    Args:
+        lab: Coarse Lab image (float32)
+        width: Border strip width in pixels
+        clusters: Number of border colors (k-means)
+    """
+    border = np.concatenate([
+        lab[:width].reshape(-1, 3), lab[-width:].reshape(-1, 3),
+        lab[:, :width].reshape(-1, 3), lab[:, -width:].reshape(-1, 3),
+    ])
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    _, _, centers = cv2.kmeans(border, clusters, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+
+    pixels = lab.reshape(-1, 1, 3)
+    distance = np.sqrt(((pixels - centers[None]) ** 2).sum(axis=2)).min(axis=1)
+    return distance.reshape(lab.shape[:2])
+
+
+def local_foreground_mask(image: np.ndarray, iterations: int = 3) -> np.ndarray:
+    """
+    Foreground alpha from coarse GrabCut and guided upsampling.
+
+    Args:
+        image: BGR (or grayscale) image
+        iterations: GrabCut iterations
+
+    Returns:
+        uint8 alpha mask of the image's size (255 = foreground)
+    """
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    pyramid = ImagePyramid(image, max_level=8, min_side=16)
+    level = 0
+    while level < pyramid.max_level and max(pyramid.level_shape(level)) > SEGMENTATION_SIDE:
+        level += 1
+    small = np.ascontiguousarray(pyramid.level(level))
+    h, w = small.shape[:2]
+
+    # Seed: the border is background, whatever differs clearly from every
+    # border color is probably foreground, the rest probably background
+    width = max(2, min(h, w) // 25)
+    lab = cv2.cvtColor(small, cv2.COLOR_BGR2LAB).astype(np.float32)
+    distance = _border_seeds(lab, width)
+    seeds = np.where(distance > max(20.0, float(np.percentile(distance, 50))),
+                     cv2.GC_PR_FGD, cv2.GC_PR_BGD).astype(np.uint8)
+    seeds[:width] = seeds[-width:] = cv2.GC_BGD
+    seeds[:, :width] = seeds[:, -width:] = cv2.GC_BGD
+
+    if not (seeds == cv2.GC_PR_FGD).any():
+        # Nothing stands out from the border: assume a centered subject
+        seeds[width:-width, width:-width] = cv2.GC_PR_FGD
+
+    bgd_model = np.zeros((1, 65), np.float64)
+    fgd_model = np.zeros((1, 65), np.float64)
+    cv2.grabCut(small, seeds, None, bgd_model, fgd_model, iterations, cv2.GC_INIT_WITH_MASK)
+    foreground = np.where((seeds == cv2.GC_FGD) | (seeds == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+
+    # Drop specks and fill pinholes at the coarse scale
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    foreground = cv2.morphologyEx(foreground, cv2.MORPH_OPEN, kernel)
+    foreground = cv2.morphologyEx(foreground, cv2.MORPH_CLOSE, kernel)
+
+    alpha = pyramid.expand(foreground.astype(np.float32), level, mode='guided',
+                           radius=2, eps=400.0)
+    return np.clip(alpha, 0, 255).astype(np.uint8)
+
+
+def _rembg_foreground_mask(image: np.ndarray) -> Optional[np.ndarray]:
+    """Foreground alpha from rembg, or None if rembg isn't installed."""
+    global _rembg_session
+    try:
+        import rembg
+    except ImportError:
+        return None
+
+    with _rembg_lock:
+        if _rembg_session is None:
+            print("[Background] Loading rembg session (once per process)")
+            _rembg_session = rembg.new_session()
+
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    output = rembg.remove(rgb, session=_rembg_session)
+    return np.ascontiguousarray(output[:, :, 3])
+
+
+def threshold_foreground_mask(image: np.ndarray, threshold: int = 240) -> np.ndarray:
+    """Alpha mask making pixels brighter than `threshold` background."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    _, alpha = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY_INV)
+
+    kernel = np.ones((3, 3), np.uint8)
+    alpha = cv2.morphologyEx(alpha, cv2.MORPH_CLOSE, kernel)
+    return cv2.morphologyEx(alpha, cv2.MORPH_OPEN, kernel)
+
+
+def foreground_mask(image: np.ndarray, engine: Optional[str] = None,
+                    key: Optional[str] = None) -> np.ndarray:
+    """
+    Foreground alpha mask of an image, cached per process.
+
+    Args:
+        image: BGR (or grayscale) image
+        engine: One of BACKGROUND_ENGINES (None = default)
+        key: image_digest() of the image the caller already has (the
+            image's shape is added to it); computed if omitted
+
+    Returns:
+        Read-only uint8 alpha mask (255 = foreground)
+    """
+    engine = validate_background_engine(engine)
+    if key is None:
+        from utils import image_digest
+        key = image_digest(image)
+    cache_key = (key, image.shape[:2], engine)
+
+    alpha = _mask_cache.get(cache_key)
+    if alpha is not None:
+        print(f"[Background] Mask cache hit")
+        return alpha
+
+    if engine == 'rembg':
+        alpha = _rembg_foreground_mask(image)
+        if alpha is None:
+            print("[Warning] 'rembg' not installed. Using local background removal.")
+            engine = 'local'
+    if engine == 'local':
+        alpha = local_foreground_mask(image)
+    elif engine == 'threshold':
+        alpha = threshold_foreground_mask(image)
+
+    alpha.setflags(write=False)
+    _mask_cache.put(cache_key, alpha)
+    return alpha
+
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Tattoo Stencil Generator pipeline stages.
+
+Usage:
+    python benchmark.py smoothing [image.jpg] [--sizes 1024 2048 4096] [--repeat 3]
+    python benchmark.py edges [image.jpg] [--sizes 1024 2048 4096] [--repeat 3]
+"""
+
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from edges import EdgeMaps
+from preprocessing import bilateral_grid, to_grayscale
+from tiles import TileExecutor
+from utils import load_image
+
+
+def synthetic_image(side: int = 1024, seed: int = 0) -> np.ndarray:
+    """Shapes, gradients and sensor-like noise: edges and flat areas to smooth."""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(60, 200, side, dtype=np.float32)
+    image = np.tile(ramp, (side, 1))
+    for _ in range(40):
+        center = tuple(int(c) for c in rng.integers(0, side, 2))
+        radius = int(rng.integers(side // 40, side // 6))
+        cv2.circle(image, center, radius, float(rng.integers(0, 255)), -1, cv2.LINE_AA)
+    for _ in range(60):
+        p1 = tuple(int(c) for c in rng.integers(0, side, 2))
+        p2 = tuple(int(c) for c in rng.integers(0, side, 2))
+        cv2.line(image, p1, p2, float(rng.integers(0, 255)), int(rng.integers(1, 6)), cv2.LINE_AA)
+    image += rng.normal(0, 6, image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def _best_time(func, repeat: int) -> tuple:
+    """(best seconds, last result) over `repeat` runs."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _edge_agreement(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """F1 score of candidate Canny edges against reference edges (1 px tolerance)."""
+    ref = cv2.Canny(reference, 30, 90) > 0
+    cand = cv2.Canny(candidate, 30, 90) > 0
+    kernel = np.ones((3, 3), np.uint8)
+    ref_near = cv2.dilate(ref.astype(np.uint8), kernel) > 0
+    cand_near = cv2.dilate(cand.astype(np.uint8), kernel) > 0
+    precision = (cand & ref_near).sum() / max(1, cand.sum())
+    recall = (ref & cand_near).sum() / max(1, ref.sum())
+    return float(2 * precision * recall / max(1e-9, precision + recall))
+
+
+def bench_smoothing(gray: np.ndarray, sizes, repeat: int = 3):
+    """
+    Compare bilateral_grid against cv2.bilateralFilter at the diameter the
+    styles use at full size (11 px; working-resolution scaling only shrinks it).
+    """
+    d = 11
+    print(f"{'size':>6} {'d':>4} {'bilateral ms':>13} {'grid ms':>9} {'speedup':>8} "
+          f"{'PSNR dB':>8} {'edge F1':>8}")
+    for side in sizes:
+        factor = side / max(gray.shape)
+        image = cv2.resize(gray, (max(1, int(gray.shape[1] * factor)),
+                                  max(1, int(gray.shape[0] * factor))),
+                           interpolation=cv2.INTER_CUBIC)
+        
+        t_ref, reference = _best_time(
+            lambda: cv2.bilateralFilter(image, d, 75, 75), repeat)
+        t_grid, candidate = _best_time(
+            lambda: bilateral_grid(image, d, 75, 75), repeat)
+        
+        print(f"{side:>6} {d:>4} {t_ref * 1000:>13.0f} {t_grid * 1000:>9.0f} "
+              f"{t_ref / t_grid:>7.1f}x {cv2.PSNR(reference, candidate):>8.2f} "
+              f"{_edge_agreement(reference, candidate):>8.3f}")
+
+
+def bench_edges(gray: np.ndarray, sizes, repeat: int = 3) -> bool:
+    """
+    Check EdgeMaps against cv2.Canny, untiled and tiled, at the threshold
+    pairs the styles use. The image's outermost row and column are made to
+    alternate between black and white, so edges run into the border, where
+    Sobel and Canny border handling must agree.
+
+    Returns:
+        True if every edge map matched cv2.Canny exactly
+    """
+    pairs = [(30, 90), (50, 150), (30, 100), (20, 60)]
+    tiles = TileExecutor(workers=2, tile_size=512, min_pixels=0)
+    print(f"{'size':>6} {'canny ms':>9} {'shared ms':>10} {'tiled ms':>9} {'diff px':>8}")
+    exact = True
+    for side in sizes:
+        factor = side / max(gray.shape)
+        image = cv2.resize(gray, (max(1, int(gray.shape[1] * factor)),
+                                  max(1, int(gray.shape[0] * factor))),
+                           interpolation=cv2.INTER_CUBIC)
+        # Edges running into the border: a step in the last row and column
+        image[-1, ::2] = image[:-1:2, -1] = 0
+        image[-1, 1::2] = image[1:-1:2, -1] = 255
+        
+        t_ref, reference = _best_time(
+            lambda: [cv2.Canny(image, low, high) for low, high in pairs], repeat)
+        t_shared, shared = _best_time(lambda: EdgeMaps(image).edges(pairs), repeat)
+        t_tiled, tiled = _best_time(lambda: EdgeMaps(image, tiles).edges(pairs), repeat)
+        
+        diff = sum(int(np.count_nonzero(ref != cand))
+                   for ref, candidates in zip(reference, zip(shared, tiled))
+                   for cand in candidates)
+        exact &= diff == 0
+        print(f"{side:>6} {t_ref * 1000:>9.0f} {t_shared * 1000:>10.0f} "
+              f"{t_tiled * 1000:>9.0f} {diff:>8}")
+    return exact
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stencil pipeline benchmarks')
+    parser.add_argument('benchmark', choices=['smoothing', 'edges'])
+    parser.add_argument('input', nargs='?', help='Input image (default: synthetic)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048, 4096],
+                        help='Longest sides to benchmark at')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (best is kept)')
+    args = parser.parse_args()
+    
+    gray = (to_grayscale(load_image(args.input)) if args.input
+            else synthetic_image(max(args.sizes)))
+    
+    if args.benchmark == 'smoothing':
+        bench_smoothing(gray, args.sizes, args.repeat)
+    elif args.benchmark == 'edges':
+        if not bench_edges(gray, args.sizes, args.repeat):
+            sys.exit('EdgeMaps differs from cv2.Canny')
+
+
+if __name__ == '__main__':
+    main()
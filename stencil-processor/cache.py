@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Byte-budget LRU cache for the Stencil Processing Service.
+
+Entries are evicted least-recently-used first whenever the total size of
+the cached values exceeds a configurable number of bytes, so a handful of
+4K intermediates and thousands of small PNGs are bounded the same way.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import numpy as np
+
+
+def value_nbytes(value: Any) -> int:
+    """
+    Approximate memory footprint of a cached value.
+
+    Handles bytes, numpy arrays and (nested) tuples/lists/dicts of them.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(value_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(value_nbytes(v) for v in value.values())
+    return 64
+
+
+class ByteBudgetLRU:
+    """
+    Thread-safe LRU cache bounded by total value size in bytes.
+    """
+
+    def __init__(self,
+                 max_bytes: int,
+                 name: str = 'cache',
+                 sizeof: Callable[[Any], int] = value_nbytes):
+        """
+        Args:
+            max_bytes: Byte budget (0 disables the cache)
+            name: Label used in log messages
+            sizeof: Function returning a value's size in bytes
+        """
+        self.max_bytes = max(0, int(max_bytes))
+        self.name = name
+        self.sizeof = sizeof
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value (marking it recently used) or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        """
+        Store a value, evicting least-recently-used entries as needed.
+
+        Returns:
+            False if the value alone exceeds the budget (not cached)
+        """
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._sizes[key]
+                del self._entries[key]
+
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                self.current_bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters for the health endpoint."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
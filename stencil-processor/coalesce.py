@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+In-flight request coalescing for the Stencil Processing Service.
+
+Identical requests (same decoded image, same normalized parameters) that
+arrive while one of them is still being generated wait for that run's
+result instead of starting their own pipeline.
+"""
+
+import threading
+from typing import Callable, Dict, Any, Hashable, Optional
+
+
+class RequestAbortedError(Exception):
+    """
+    Raised when a caller abandons its own request (e.g. a cancelled job).
+
+    When the leading run of a coalesced group aborts this way, the waiting
+    requests are not failed; one of them takes over and runs the pipeline.
+    """
+    pass
+
+
+class _InFlight:
+    """Result slot shared by all requests coalesced onto one run."""
+
+    def __init__(self):
+        self.finished = False
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.aborted = False
+        self.waiters = 0
+
+
+class RequestCoalescer:
+    """
+    Deduplicates concurrent calls that share a key.
+
+    The first caller for a key (the leader) runs the work; callers arriving
+    before it finishes block and receive the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Notified when a run finishes, and by wake()
+        self._changed = threading.Condition(self._lock)
+        self._in_flight: Dict[Hashable, _InFlight] = {}
+        self.leaders = 0
+        self.hits = 0
+        self.takeovers = 0
+
+    def run(self,
+            key: Hashable,
+            fn: Callable[[], Any],
+            on_join: Optional[Callable[[], None]] = None,
+            abort: Optional[Callable[[], None]] = None) -> Any:
+        """
+        Run fn() once per key among concurrent callers.
+
+        Args:
+            key: Request identity (image hash + normalized parameters)
+            fn: Work to perform if no identical request is running
+            on_join: Called when this caller waits on another caller's run
+            abort: Optional check run while waiting on another caller's run
+                (again on every wake(), under the coalescer's lock, so it
+                must not block); raising from it detaches this caller, and
+                the run goes on for the others
+
+        Returns:
+            fn()'s result (possibly computed by another caller)
+        """
+        while True:
+            with self._lock:
+                entry = self._in_flight.get(key)
+                if entry is None:
+                    entry = _InFlight()
+                    self._in_flight[key] = entry
+                    self.leaders += 1
+                    leader = True
+                else:
+                    entry.waiters += 1
+                    self.hits += 1
+                    leader = False
+
+            if leader:
+                return self._lead(key, entry, fn)
+
+            try:
+                if on_join is not None:
+                    on_join()
+                with self._lock:
+                    while not entry.finished:
+                        if abort is not None:
+                            abort()
+                        self._changed.wait()
+            finally:
+                # 'waiting' counts current waiters, not joins
+                with self._lock:
+                    entry.waiters -= 1
+
+            if entry.aborted:
+                # Leader gave up on its own request - take over the work
+                with self._lock:
+                    self.hits -= 1
+                    self.takeovers += 1
+                continue
+            if entry.error is not None:
+                raise entry.error
+            return entry.result
+
+    def _lead(self, key: Hashable, entry: _InFlight, fn: Callable[[], Any]) -> Any:
+        """Run the work for a key and publish the outcome to waiters."""
+        try:
+            entry.result = fn()
+            return entry.result
+        except RequestAbortedError:
+            entry.aborted = True
+            raise
+        except BaseException as e:
+            entry.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                entry.finished = True
+                self._changed.notify_all()
+
+    def wake(self) -> None:
+        """Wake all waiting callers so they re-run their abort checks."""
+        with self._lock:
+            self._changed.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """Coalescing counters for the health endpoint."""
+        with self._lock:
+            total = self.leaders + self.hits
+            return {
+                'inFlight': len(self._in_flight),
+                'waiting': sum(e.waiters for e in self._in_flight.values()),
+                'runs': self.leaders,
+                'hits': self.hits,
+                'takeovers': self.takeovers,
+                'hitRate': round(self.hits / total, 3) if total else 0.0,
+            }
@@ -3,24 +3,51 @@
 Stencil Processing Service
 HTTP server for tattoo stencil generation.
 Provides REST API for stencil generation with multiple styles.
+Endpoints and STENCIL_* settings are documented in README.md.
 """
 
 import sys
 import os
 import json
 import base64
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Import the new modular generator
 from stencil_generator import StencilService
+from admission import ServiceBusyError
+from jobs import JobManager
+from styles import STYLE_FUNCTIONS
+from utils import (
+    validate_output_format, validate_denoise_tier, validate_color, mime_type_for,
+    base64_to_bytes, bytes_to_base64, ImageTooLargeError
+)
 
 PORT = 3005
+WORKERS = int(os.environ.get('STENCIL_WORKERS', '0'))
+MAX_QUEUE = int(os.environ.get('STENCIL_MAX_QUEUE', '16'))
+RESULT_CACHE_MB = float(os.environ.get('STENCIL_RESULT_CACHE_MB', '256'))
+GRAY_CACHE_MB = float(os.environ.get('STENCIL_GRAY_CACHE_MB', '256'))
+MASK_CACHE_MB = float(os.environ.get('STENCIL_MASK_CACHE_MB', '128'))
+GEOMETRY_CACHE_MB = float(os.environ.get('STENCIL_GEOMETRY_CACHE_MB', '64'))
+JOB_TTL = float(os.environ.get('STENCIL_JOB_TTL', '600'))
+MAX_PENDING_JOBS = int(os.environ.get('STENCIL_MAX_PENDING_JOBS', '64'))
+MAX_BATCH = int(os.environ.get('STENCIL_MAX_BATCH', '10'))
+DENOISE_TIER = os.environ.get('STENCIL_DENOISE_TIER', 'print')
+WORKING_SIZE = int(os.environ.get('STENCIL_WORKING_SIZE', '0'))
+MAX_PIXELS = int(float(os.environ.get('STENCIL_MAX_MEGAPIXELS', '100')) * 1_000_000)
+MAX_STREAMED_PIXELS = int(float(os.environ.get('STENCIL_MAX_STREAMED_MEGAPIXELS', '1000')) * 1_000_000)
+SMOOTHING = os.environ.get('STENCIL_SMOOTHING', 'bilateral')
+TILE_WORKERS = int(os.environ.get('STENCIL_TILE_WORKERS',
+                                  str(max(1, (os.cpu_count() or 1) // max(1, WORKERS)))))
 
-# Initialize the service
-stencil_service = StencilService()
+# Initialized in main() so worker processes importing this module don't
+# start their own pools
+stencil_service = None
+job_manager = None
 
 
 class StencilHandler(BaseHTTPRequestHandler):
@@ -34,8 +61,12 @@ class StencilHandler(BaseHTTPRequestHandler):
     def send_cors_headers(self):
         """Send CORS headers."""
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'POST, GET, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Stencil-Style, X-Stencil-Line-Thickness, '
+                         'X-Stencil-Contrast, X-Stencil-Inverted, X-Stencil-Line-Color, X-Stencil-Transparent-Bg, '
+                         'X-Stencil-Flip-H, X-Stencil-Flip-V, X-Stencil-Denoise, X-Stencil-Format, '
+                         'X-Stencil-Callback-Url')
+        self.send_header('Access-Control-Expose-Headers', 'Retry-After, Location, X-Stencil-Style, Server-Timing')
     
     def do_OPTIONS(self):
         """Handle CORS preflight."""
@@ -44,28 +75,63 @@ class StencilHandler(BaseHTTPRequestHandler):
         self.end_headers()
     
     def do_GET(self):
-        """Health check."""
+        """Health check and job status/result."""
         if self.path == '/health':
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.send_cors_headers()
             self.end_headers()
-            response = json.dumps({
-                'status': 'healthy',
+            admission = stencil_service.admission.stats()
+            health = {
+                'status': 'saturated' if admission['saturated'] else 'healthy',
                 'service': 'stencil-processor',
                 'version': '4.0',
-                'styles': ['outline', 'simple', 'detailed', 'hatching', 'solid']
-            })
+                'styles': ['outline', 'simple', 'detailed', 'hatching', 'solid'],
+                'admission': admission
+            }
+            if stencil_service.pool is not None:
+                health['pool'] = stencil_service.pool.stats()
+            health['jobs'] = job_manager.stats()
+            health['coalescing'] = stencil_service.coalescer.stats()
+            health['resultCache'] = stencil_service.result_cache.stats()
+            if stencil_service.gray_cache is not None:
+                health['preprocessCache'] = stencil_service.gray_cache.stats()
+            if stencil_service.geometry_cache is not None:
+                health['geometryCache'] = stencil_service.geometry_cache.stats()
+            health['maskCache'] = stencil_service.mask_cache.stats()
+            response = json.dumps(health)
             self.wfile.write(response.encode())
+            return
+        
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if parts[0] == 'jobs' and len(parts) == 2:
+            self._get_job(parts[1], want_result=False)
+        elif parts[0] == 'jobs' and len(parts) == 3 and parts[2] == 'result':
+            self._get_job(parts[1], want_result=True)
         else:
             self.send_error(404)
     
     def do_POST(self):
         """Process stencil generation request."""
-        if self.path != '/generate':
+        url = urlsplit(self.path)
+        content_type = self.headers.get('Content-Type', 'application/json')
+        
+        if url.path.rstrip('/') == '/jobs':
+            self._submit_job(content_type, parse_qs(url.query))
+            return
+        
+        if url.path.rstrip('/') == '/batch':
+            self._handle_batch(content_type, parse_qs(url.query))
+            return
+        
+        if url.path != '/generate':
             self.send_error(404)
             return
         
+        if not content_type.startswith('application/json'):
+            self._handle_binary(content_type, parse_qs(url.query))
+            return
+        
         try:
             # Read request
             content_length = int(self.headers.get('Content-Length', 0))
@@ -78,8 +144,15 @@ class StencilHandler(BaseHTTPRequestHandler):
             line_thickness = int(data.get('lineThickness', 3))
             contrast = int(data.get('contrast', 50))
             inverted = bool(data.get('inverted', False))
-            line_color = data.get('lineColor', '#000000')  # Hex color
             transparent_bg = bool(data.get('transparentBg', False))
+            flip_h = bool(data.get('flipH', False))
+            flip_v = bool(data.get('flipV', False))
+            try:
+                line_color = validate_color(data.get('lineColor', '#000000'))  # Hex color
+                denoise_tier = validate_denoise_tier(data.get('denoise', DENOISE_TIER))
+            except ValueError as e:
+                self._send_error(400, str(e))
+                return
             
             if not image_base64:
                 self._send_error(400, 'No image provided')
@@ -88,6 +161,7 @@ class StencilHandler(BaseHTTPRequestHandler):
             print(f"[Stencil Service] Processing: style={style}, thickness={line_thickness}, contrast={contrast}, color={line_color}, transparent={transparent_bg}")
             
             # Generate stencil using the new service
+            timings = {}
             stencil_base64 = stencil_service.process(
                 image_base64=image_base64,
                 style=style,
@@ -95,7 +169,11 @@ class StencilHandler(BaseHTTPRequestHandler):
                 contrast=contrast,
                 inverted=inverted,
                 line_color=line_color,
-                transparent_bg=transparent_bg
+                transparent_bg=transparent_bg,
+                timings=timings,
+                flip_h=flip_h,
+                flip_v=flip_v,
+                denoise_tier=denoise_tier
             )
             
             print(f"[Stencil Service] ✅ Success!")
@@ -103,49 +181,477 @@ class StencilHandler(BaseHTTPRequestHandler):
             # Send success response
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
+            self.send_header('Server-Timing', _server_timing(timings))
             self.send_cors_headers()
             self.end_headers()
             
             response = json.dumps({
                 'success': True,
                 'stencilImage': stencil_base64,
-                'style': style
+                'style': style,
+                'timings': timings
             })
             self.wfile.write(response.encode())
             
+        except ServiceBusyError as e:
+            print(f"[Stencil Service] ⏳ Busy, rejecting (retry after {e.retry_after}s)")
+            self._send_error(429, str(e), headers={'Retry-After': str(e.retry_after)})
+            
+        except ImageTooLargeError as e:
+            print(f"[Stencil Service] ❌ Rejected: {e}")
+            self._send_error(413, str(e))
+            
         except Exception as e:
             print(f"[Stencil Service] ❌ Error: {str(e)}")
             import traceback
             traceback.print_exc()
             self._send_error(500, str(e))
     
-    def _send_error(self, code: int, message: str):
-        """Send error response."""
+    def _handle_binary(self, content_type: str, query: dict):
+        """
+        Process a raw image upload and reply with the encoded stencil bytes.
+        """
+        try:
+            body, params = self._parse_binary_request(content_type, query)
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        
+        try:
+            print(f"[Stencil Service] Processing binary: {_describe(params)}")
+            
+            timings = {}
+            result = stencil_service.process_image(body, timings=timings, **params)
+            
+            print(f"[Stencil Service] ✅ Success!")
+            
+            self._send_image(result, params['output_format'], headers={
+                'X-Stencil-Style': params['style'],
+                'Server-Timing': _server_timing(timings)
+            })
+            
+        except ServiceBusyError as e:
+            print(f"[Stencil Service] ⏳ Busy, rejecting (retry after {e.retry_after}s)")
+            self._send_error(429, str(e), headers={'Retry-After': str(e.retry_after)})
+            
+        except ImageTooLargeError as e:
+            print(f"[Stencil Service] ❌ Rejected: {e}")
+            self._send_error(413, str(e))
+            
+        except Exception as e:
+            print(f"[Stencil Service] ❌ Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            self._send_error(500, str(e))
+    
+    def _handle_batch(self, content_type: str, query: dict):
+        """
+        POST /batch - several stencils from one image, sharing decoding and
+        preprocessing.
+        
+        JSON bodies take the /generate fields as defaults plus either
+        'variants' (list of per-variant overrides, e.g. {"style": "solid",
+        "lineThickness": 2}) or 'styles' (list of style names). Binary
+        uploads take ?styles=outline,solid. Without either, every style is
+        generated. The reply is JSON with one base64 stencil per variant.
+        """
+        try:
+            if content_type.startswith('application/json'):
+                body, params, data = self._parse_json_request()
+                variants = data.get('variants')
+                styles = data.get('styles')
+            else:
+                body, params = self._parse_binary_request(content_type, query)
+                variants = None
+                styles = [s for s in query.get('styles', [''])[0].split(',') if s]
+            
+            if variants:
+                batch = [_json_params(variant, params) for variant in variants]
+            else:
+                batch = [dict(params, style=style) for style in (styles or STYLE_FUNCTIONS)]
+            if len(batch) > MAX_BATCH:
+                raise ValueError(f'At most {MAX_BATCH} variants per batch')
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_error(400, str(e))
+            return
+        
+        try:
+            print(f"[Stencil Service] Processing batch of {len(batch)}: "
+                  f"{', '.join(params['style'] for params in batch)}")
+            
+            timings = {}
+            results = stencil_service.process_batch(body, batch, timings=timings)
+            
+            print(f"[Stencil Service] ✅ Success!")
+            
+            self._send_json(200, {
+                'success': True,
+                'results': [
+                    {
+                        'style': params['style'],
+                        'stencilImage': bytes_to_base64(result, mime_type_for(params['output_format'])),
+                    }
+                    for params, result in zip(batch, results)
+                ],
+                'timings': timings
+            }, headers={'Server-Timing': _server_timing(timings)})
+            
+        except ServiceBusyError as e:
+            print(f"[Stencil Service] ⏳ Busy, rejecting (retry after {e.retry_after}s)")
+            self._send_error(429, str(e), headers={'Retry-After': str(e.retry_after)})
+            
+        except ImageTooLargeError as e:
+            print(f"[Stencil Service] ❌ Rejected: {e}")
+            self._send_error(413, str(e))
+            
+        except Exception as e:
+            print(f"[Stencil Service] ❌ Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            self._send_error(500, str(e))
+    
+    def _parse_binary_request(self, content_type: str, query: dict):
+        """
+        Read a raw or multipart image upload and its parameters.
+        
+        Parameters come from the query string (lineThickness=3), multipart
+        form fields, or headers (X-Stencil-Line-Thickness: 3), in that order
+        of precedence.
+        
+        Returns:
+            (image_buffer, params) with params ready for process_image
+        """
+        def param(name: str, header: str, default: str) -> str:
+            if name in query:
+                return query[name][0]
+            return self.headers.get(f'X-Stencil-{header}', default)
+        
+        def flag(name: str, header: str) -> bool:
+            return param(name, header, 'false').lower() in ('1', 'true', 'yes')
+        
+        body = self._read_body()
+        if content_type.startswith('multipart/form-data'):
+            body, fields = _parse_multipart(body, content_type)
+            # Form fields act like query parameters
+            for name, value in fields.items():
+                query.setdefault(name, [value])
+        
+        if not body:
+            raise ValueError('No image provided')
+        
+        requested = param('format', 'Format', '')
+        if not requested:
+            accept = self.headers.get('Accept', '')
+            requested = next(
+                (t.split(';')[0].strip() for t in accept.split(',')
+                 if t.strip().startswith('image/') and '*' not in t),
+                'png'
+            )
+        
+        params = {
+            'style': param('style', 'Style', 'outline'),
+            'thickness': float(param('lineThickness', 'Line-Thickness', '3')),
+            'contrast': float(param('contrast', 'Contrast', '50')),
+            'inverted': flag('inverted', 'Inverted'),
+            'line_color': validate_color(param('lineColor', 'Line-Color', '#000000')),
+            'transparent_bg': flag('transparentBg', 'Transparent-Bg'),
+            'flip_h': flag('flipH', 'Flip-H'),
+            'flip_v': flag('flipV', 'Flip-V'),
+            'denoise_tier': validate_denoise_tier(param('denoise', 'Denoise', DENOISE_TIER)),
+            'output_format': validate_output_format(requested),
+        }
+        return body, params
+    
+    def _parse_json_request(self):
+        """
+        Read a JSON/base64 request body (same fields as POST /generate).
+        
+        Returns:
+            (image_bytes, params, data) with params ready for process_image
+            and data the raw JSON object
+        """
+        content_length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(content_length))
+        
+        image_base64 = data.get('image', '')
+        if not image_base64:
+            raise ValueError('No image provided')
+        
+        return base64_to_bytes(image_base64), _json_params(data), data
+    
+    # -------------------------------------------------------------------------
+    # Asynchronous jobs
+    # -------------------------------------------------------------------------
+    
+    def _submit_job(self, content_type: str, query: dict):
+        """POST /jobs - queue a stencil job and return its id (202)."""
+        try:
+            if content_type.startswith('application/json'):
+                body, params, data = self._parse_json_request()
+                callback_url = data.get('callbackUrl')
+            else:
+                body, params = self._parse_binary_request(content_type, query)
+                callback_url = (query.get('callbackUrl', [None])[0]
+                                or self.headers.get('X-Stencil-Callback-Url'))
+            
+            job = job_manager.submit(body, callback_url=callback_url, **params)
+            
+        except ServiceBusyError as e:
+            print(f"[Stencil Service] ⏳ Busy, rejecting job (retry after {e.retry_after}s)")
+            self._send_error(429, str(e), headers={'Retry-After': str(e.retry_after)})
+            return
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        
+        self._send_json(202, dict(job.to_dict(), success=True),
+                        headers={'Location': f'/jobs/{job.id}'})
+    
+    def _get_job(self, job_id: str, want_result: bool):
+        """GET /jobs/<id> (status) and GET /jobs/<id>/result (image)."""
+        job = job_manager.get(job_id)
+        if job is None:
+            self._send_error(404, 'Unknown or expired job')
+            return
+        
+        if not want_result:
+            self._send_json(200, dict(job.to_dict(), success=True))
+            return
+        
+        if job.status != 'completed':
+            code = 409 if job.finished else 202
+            self._send_json(code, dict(job.to_dict(), success=False))
+            return
+        
+        output_format = job.params['output_format']
+        if 'application/json' in self.headers.get('Accept', ''):
+            self._send_json(200, {
+                'success': True,
+                'stencilImage': bytes_to_base64(job.result, mime_type_for(output_format)),
+                'style': job.params['style'],
+                'timings': job.timings
+            })
+        else:
+            self._send_image(job.result, output_format, headers={
+                'X-Stencil-Style': job.params['style'],
+                'Server-Timing': _server_timing(job.timings)
+            })
+    
+    def do_DELETE(self):
+        """DELETE /jobs/<id> - cancel a job."""
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self.send_error(404)
+            return
+        
+        job = job_manager.cancel(parts[1])
+        if job is None:
+            self._send_error(404, 'Unknown or expired job')
+            return
+        self._send_json(200, dict(job.to_dict(), success=True))
+    
+    # -------------------------------------------------------------------------
+    # Response helpers
+    # -------------------------------------------------------------------------
+    
+    def _send_json(self, code: int, payload: dict, headers: dict = None):
+        """Send a JSON response."""
         self.send_response(code)
         self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_cors_headers()
         self.end_headers()
-        self.wfile.write(json.dumps({
+        self.wfile.write(json.dumps(payload).encode())
+    
+    def _send_image(self, data: bytes, output_format: str, headers: dict = None):
+        """Send encoded image bytes."""
+        self.send_response(200)
+        self.send_header('Content-Type', mime_type_for(output_format))
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_cors_headers()
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _read_body(self) -> memoryview:
+        """Read the request body into one preallocated buffer."""
+        content_length = int(self.headers.get('Content-Length', 0))
+        buffer = bytearray(content_length)
+        view = memoryview(buffer)
+        received = 0
+        while received < content_length:
+            n = self.rfile.readinto(view[received:])
+            if not n:
+                raise ValueError('Incomplete request body')
+            received += n
+        return view
+    
+    def _send_error(self, code: int, message: str, headers: dict = None):
+        """Send error response."""
+        self._send_json(code, {
             'success': False,
             'error': message
-        }).encode())
+        }, headers=headers)
+
+
+def _json_params(data: dict, defaults: dict = None) -> dict:
+    """
+    process_image parameters from JSON request fields.
+    
+    Fields missing from data fall back to defaults (already converted
+    params, e.g. the top level of a batch request) or the usual defaults.
+    """
+    defaults = defaults or {}
+    
+    def field(name: str, key: str, default):
+        return data.get(name, defaults.get(key, default))
+    
+    return {
+        'style': field('style', 'style', 'outline'),
+        'thickness': float(field('lineThickness', 'thickness', 3)),
+        'contrast': float(field('contrast', 'contrast', 50)),
+        'inverted': bool(field('inverted', 'inverted', False)),
+        'line_color': validate_color(field('lineColor', 'line_color', '#000000')),
+        'transparent_bg': bool(field('transparentBg', 'transparent_bg', False)),
+        'flip_h': bool(field('flipH', 'flip_h', False)),
+        'flip_v': bool(field('flipV', 'flip_v', False)),
+        'denoise_tier': validate_denoise_tier(field('denoise', 'denoise_tier', DENOISE_TIER)),
+        'output_format': validate_output_format(field('format', 'output_format', None)),
+    }
+
+
+def _describe(params: dict) -> str:
+    """One-line summary of request parameters for the log."""
+    return (f"style={params['style']}, thickness={params['thickness']}, contrast={params['contrast']}, "
+            f"color={params['line_color']}, transparent={params['transparent_bg']}, "
+            f"format={params['output_format']}")
+
+
+def _server_timing(timings: dict) -> str:
+    """
+    Format pipeline timings as a Server-Timing header value.
+    
+    Stage durations become 'stage;dur=<ms>'; cache outcomes become
+    'preprocessCache;desc=hit' style entries.
+    """
+    entries = []
+    for name, value in timings.items():
+        if isinstance(value, bool):
+            entries.append(f'{name};desc={str(value).lower()}')
+        elif isinstance(value, (int, float)):
+            entries.append(f'{name};dur={value * 1000:.1f}')
+        else:
+            entries.append(f'{name};desc={value}')
+    return ', '.join(entries)
+
+
+def _parse_multipart(body: memoryview, content_type: str):
+    """
+    Split a multipart/form-data body without copying the file part.
+    
+    Args:
+        body: Request body
+        content_type: Content-Type header (carries the boundary)
+        
+    Returns:
+        (image_view, fields): memoryview of the first file part (or of a
+        part named 'image') and a dict of the remaining text fields
+    """
+    boundary = None
+    for item in content_type.split(';')[1:]:
+        key, _, value = item.strip().partition('=')
+        if key.lower() == 'boundary':
+            boundary = value.strip('"')
+    if not boundary:
+        raise ValueError('Multipart body without boundary')
+    
+    raw = body.obj if isinstance(body, memoryview) else body
+    delimiter = b'--' + boundary.encode()
+    image, fields = None, {}
+    
+    pos = raw.find(delimiter)
+    while pos != -1:
+        start = pos + len(delimiter)
+        if raw[start:start + 2] == b'--':
+            break  # closing delimiter
+        header_end = raw.find(b'\r\n\r\n', start)
+        if header_end == -1:
+            break
+        headers = bytes(raw[start:header_end]).decode('utf-8', 'replace')
+        data_start = header_end + 4
+        next_pos = raw.find(b'\r\n' + delimiter, data_start)
+        data_end = next_pos if next_pos != -1 else len(raw)
+        
+        disposition = {}
+        for line in headers.split('\r\n'):
+            if line.lower().startswith('content-disposition:'):
+                for item in line.split(';')[1:]:
+                    key, _, value = item.strip().partition('=')
+                    disposition[key.lower()] = value.strip('"')
+        
+        name = disposition.get('name', '')
+        if 'filename' in disposition or name == 'image':
+            if image is None:
+                image = body[data_start:data_end]
+        elif name:
+            fields[name] = bytes(raw[data_start:data_end]).decode('utf-8', 'replace')
+        
+        pos = next_pos + 2 if next_pos != -1 else -1
+    
+    if image is None:
+        raise ValueError('No image part in multipart body')
+    return image, fields
 
 
 def main():
+    global stencil_service, job_manager
+    
     print(f"🎨 Stencil Processing Service v4.0 starting on port {PORT}...")
+    
+    pool = None
+    if WORKERS > 0:
+        from worker_pool import StencilWorkerPool
+        pool = StencilWorkerPool(
+            size=WORKERS,
+            gray_cache_bytes=int(GRAY_CACHE_MB * 1024 * 1024 / WORKERS),
+            geometry_cache_bytes=int(GEOMETRY_CACHE_MB * 1024 * 1024 / WORKERS),
+            tile_workers=TILE_WORKERS
+        )
+    stencil_service = StencilService(
+        pool=pool,
+        max_queue=MAX_QUEUE,
+        result_cache_bytes=int(RESULT_CACHE_MB * 1024 * 1024),
+        gray_cache_bytes=int(GRAY_CACHE_MB * 1024 * 1024),
+        mask_cache_bytes=int(MASK_CACHE_MB * 1024 * 1024),
+        geometry_cache_bytes=int(GEOMETRY_CACHE_MB * 1024 * 1024),
+        working_size=WORKING_SIZE,
+        max_pixels=MAX_PIXELS,
+        max_streamed_pixels=MAX_STREAMED_PIXELS,
+        smoothing=SMOOTHING,
+        tile_workers=TILE_WORKERS
+    )
+    job_manager = JobManager(stencil_service, ttl=JOB_TTL, max_pending=MAX_PENDING_JOBS)
+    
     print(f"✅ Ready at http://localhost:{PORT}")
-    print(f"   POST /generate - Generate stencil from uploaded image")
+    print(f"   POST /generate - Generate stencil from uploaded image (JSON or binary)")
+    print(f"   POST /batch    - Generate several styles from one image")
+    print(f"   POST /jobs     - Submit asynchronous stencil job")
+    print(f"   GET  /jobs/<id>[/result], DELETE /jobs/<id> - Poll, fetch, cancel")
     print(f"   GET  /health   - Health check")
     print(f"")
     print(f"   Styles: outline, simple, detailed, hatching, solid")
     
-    server = HTTPServer(('0.0.0.0', PORT), StencilHandler)
+    server = ThreadingHTTPServer(('0.0.0.0', PORT), StencilHandler)
     
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n👋 Shutting down...")
         server.shutdown()
+    finally:
+        stencil_service.close()
 
 
 if __name__ == "__main__":
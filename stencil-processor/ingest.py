@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Band-streamed ingestion of very large TIFF and PNG scans.
+
+A 300 MP flatbed scan is ~900 MB as a BGR array, yet the pipeline only
+ever works at a bounded working resolution. The readers here decode the
+(memory-mapped) file a band of rows at a time and area-reduce each band
+by an integer factor as it arrives, so only one band is ever held at full
+resolution:
+
+- TIFF (tifffile): strips or tiles are decoded segment by segment;
+  uncompressed pages are read as a zero-copy view of the mapped file and
+  pyramidal files start from the smallest sufficient level.
+- PNG (OpenCV + zlib): the IDAT stream is inflated incrementally and every
+  band is decoded as a small standalone PNG whose first row is the
+  previous band's last row, so row filters stay exact across bands.
+
+Layouts the readers don't handle (palettes, planar TIFFs, interlaced or
+low-bit-depth PNGs, ...) return None and callers fall back to a one-shot
+decode.
+"""
+
+import io
+import mmap
+import struct
+import zlib
+from typing import Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Formats read in bands by read_reduced()
+STREAMED_FORMATS = ('png', 'tiff')
+
+# Below this many pixels a one-shot decode is faster and small enough
+STREAM_MIN_PIXELS = 16_000_000
+
+# Pixel limit for streamed inputs, which never need full-resolution memory
+MAX_STREAMED_PIXELS = 1_000_000_000
+
+# Target size of one full-resolution band
+BAND_BYTES = 16 * 1024 * 1024
+
+
+def reduction_factor(width: int, height: int, max_side: int) -> int:
+    """Largest integer factor keeping at least max_side pixels on the longest side."""
+    if not max_side:
+        return 1
+    return max(1, max(width, height) // max_side)
+
+
+class BandReducer:
+    """
+    Area-downsamples an image that arrives as full-width bands of rows.
+
+    Bands may have any height; rows are carried over until a multiple of
+    the factor is available, so the result is the same as one INTER_AREA
+    resize of the whole image by that factor.
+    """
+
+    def __init__(self, width: int, height: int, factor: int, grayscale: bool):
+        """
+        Args:
+            width, height: Full-resolution size
+            factor: Integer reduction factor
+            grayscale: Reduce to one channel (otherwise BGR)
+        """
+        self.factor = factor
+        self.grayscale = grayscale
+        self.out_width = max(1, round(width / factor))
+        channels = () if grayscale else (3,)
+        self.output = np.empty((max(1, height // factor), self.out_width) + channels, np.uint8)
+        self.rows = 0
+        self._pending = None
+
+    def feed(self, band: np.ndarray, order: str = 'rgb'):
+        """
+        Add the next rows.
+
+        Args:
+            band: (rows, width[, channels]) uint8/uint16/bool samples;
+                a fourth channel (alpha) or second channel of
+                gray+alpha is dropped, as cv2.imdecode does
+            order: Channel order of 3/4-channel bands, 'rgb' or 'bgr'
+        """
+        band = _to_uint8(band)
+        if band.ndim == 3:
+            if band.shape[2] <= 2:
+                band = band[:, :, 0]
+            elif band.shape[2] >= 3:
+                band = band[:, :, :3]
+                if self.grayscale:
+                    code = cv2.COLOR_RGB2GRAY if order == 'rgb' else cv2.COLOR_BGR2GRAY
+                    band = cv2.cvtColor(np.ascontiguousarray(band), code)
+                elif order == 'rgb':
+                    band = band[:, :, ::-1]
+        if band.ndim == 2 and not self.grayscale:
+            band = cv2.cvtColor(band, cv2.COLOR_GRAY2BGR)
+
+        if self._pending is not None:
+            band = np.concatenate([self._pending, band])
+        usable = min(len(band) // self.factor, len(self.output) - self.rows) * self.factor
+        if usable:
+            rows = usable // self.factor
+            self.output[self.rows:self.rows + rows] = cv2.resize(
+                np.ascontiguousarray(band[:usable]), (self.out_width, rows),
+                interpolation=cv2.INTER_AREA)
+            self.rows += rows
+        self._pending = band[usable:].copy() if usable < len(band) else None
+
+    def result(self) -> np.ndarray:
+        """The reduced image (rows of a trailing partial block are dropped)."""
+        return self.output[:self.rows]
+
+
+def _to_uint8(band: np.ndarray) -> np.ndarray:
+    """8-bit samples from 1-bit, 8-bit or 16-bit ones."""
+    if band.dtype == np.uint8:
+        return band
+    if band.dtype == np.bool_:
+        return band.view(np.uint8) * np.uint8(255)
+    if band.dtype == np.uint16:
+        return (band >> 8).astype(np.uint8)
+    raise ValueError(f"Unsupported sample type: {band.dtype}")
+
+
+def _band_rows(width: int, bytes_per_pixel: int, factor: int) -> int:
+    """Rows per band: about BAND_BYTES, a multiple of the factor."""
+    rows = max(1, BAND_BYTES // max(1, width * bytes_per_pixel))
+    return max(factor, rows - rows % factor)
+
+
+def _release(data, start: int, length: int):
+    """Drop already-read pages of a memory-mapped file from the process."""
+    if isinstance(data, mmap.mmap) and hasattr(mmap, 'MADV_DONTNEED'):
+        aligned = start - start % mmap.PAGESIZE
+        data.madvise(mmap.MADV_DONTNEED, aligned, length + start - aligned)
+
+
+# --- TIFF -------------------------------------------------------------------
+
+def _read_tiff(data, max_side: int, grayscale: bool) -> Optional[np.ndarray]:
+    """Band-reduced TIFF (first page, or smallest sufficient pyramid level)."""
+    try:
+        import tifffile
+    except ImportError:
+        print("[Warning] 'tifffile' not installed. Decoding TIFF in one piece.")
+        return None
+
+    source = data if hasattr(data, 'seek') else io.BytesIO(data)
+    with tifffile.TiffFile(source) as tif:
+        series = tif.series[0]
+        page = series.levels[0].keyframe
+        for level in series.levels[1:]:
+            if max(level.keyframe.imagewidth, level.keyframe.imagelength) >= max_side:
+                page = level.keyframe
+
+        photometric = int(page.photometric)
+        if (page.planarconfig != 1 and page.samplesperpixel > 1) or photometric not in (0, 1, 2) \
+                or page.imagedepth > 1 or page.dtype not in (np.uint8, np.uint16, np.bool_):
+            return None
+        if (page.compression not in tifffile.TIFF.DECOMPRESSORS
+                or page.predictor not in tifffile.TIFF.UNPREDICTORS):
+            # Codec needs 'imagecodecs' (e.g. LZW, OpenCV's default): let
+            # cv2.imdecode read it in one piece
+            return None
+        height, width = page.imagelength, page.imagewidth
+        factor = reduction_factor(width, height, max_side)
+        reducer = BandReducer(width, height, factor, grayscale)
+        invert = photometric == 0  # MINISWHITE
+
+        def feed(band):
+            band = _to_uint8(band)
+            reducer.feed(255 - band if invert else band)
+
+        if (page.is_contiguous and page.compression == 1 and page.fillorder == 1
+                and not page.is_tiled and page.bitspersample >= 8):
+            # Uncompressed and contiguous: a view of the mapped file,
+            # paged in band by band
+            dtype = np.dtype(tif.byteorder + page.dtype.char)
+            shape = (height, width) + ((page.samplesperpixel,) if page.samplesperpixel > 1 else ())
+            pixels = np.frombuffer(data, dtype, count=int(np.prod(shape)),
+                                   offset=page.dataoffsets[0]).reshape(shape)
+            row_bytes = width * dtype.itemsize * page.samplesperpixel
+            step = _band_rows(width, dtype.itemsize * page.samplesperpixel, factor)
+            for y in range(0, height, step):
+                feed(pixels[y:y + step])
+                _release(data, page.dataoffsets[0] + y * row_bytes, min(step, height - y) * row_bytes)
+            return reducer.result()
+
+        # Strips or tiles, decoded in file order; tiles of one row are
+        # assembled into a full-width band first
+        band, band_y = None, -1
+        for segment, index, shape in page.segments(sort=True):
+            y, x = index[2], index[3]
+            if y != band_y:
+                if band is not None:
+                    feed(band[:height - band_y])
+                band = np.zeros((shape[1], width, shape[3]), segment.dtype)
+                band_y = y
+            columns = min(shape[2], width - x)
+            band[:, x:x + columns] = segment[0, :, :columns]
+        if band is not None:
+            feed(band[:height - band_y])
+        return reducer.result()
+
+
+# --- PNG --------------------------------------------------------------------
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG color type -> samples per pixel (palette images are not streamed)
+_PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+
+def _png_chunks(view: memoryview) -> Iterator[Tuple[bytes, memoryview]]:
+    """(type, data) of every chunk, as views into the buffer."""
+    pos = len(_PNG_SIGNATURE)
+    while pos + 8 <= len(view):
+        length, kind = struct.unpack('>I4s', view[pos:pos + 8])
+        yield kind, view[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b'IEND':
+            return
+
+
+def _png_chunk(kind: bytes, pieces: list) -> list:
+    """A chunk as a list of buffers (joined once by the caller)."""
+    crc = zlib.crc32(kind)
+    for piece in pieces:
+        crc = zlib.crc32(piece, crc)
+    size = sum(len(piece) for piece in pieces)
+    return [struct.pack('>I4s', size, kind)] + pieces + [struct.pack('>I', crc & 0xFFFFFFFF)]
+
+
+def _stored_zlib(buffers: list) -> list:
+    """
+    zlib stream of the concatenated buffers in stored (uncompressed)
+    deflate blocks, as a list of buffers; no data is copied.
+    """
+    pieces = [b'\x78\x01']
+    adler = 1
+    for i, buffer in enumerate(buffers):
+        adler = zlib.adler32(buffer, adler)
+        for start in range(0, len(buffer), 0xFFFF):
+            block = buffer[start:start + 0xFFFF]
+            final = i == len(buffers) - 1 and start + 0xFFFF >= len(buffer)
+            pieces += [struct.pack('<BHH', final, len(block), len(block) ^ 0xFFFF), block]
+    pieces.append(struct.pack('>I', adler))
+    return pieces
+
+
+def _raw_row(row: np.ndarray, color_type: int, depth: int) -> bytes:
+    """PNG sample bytes of a row decoded by cv2.imdecode(IMREAD_UNCHANGED)."""
+    if color_type == 2:
+        row = row[:, ::-1]
+    elif color_type == 6:
+        row = row[:, [2, 1, 0, 3]]
+    elif color_type == 4:
+        row = row[:, [0, 3]] if row.ndim == 2 and row.shape[1] == 4 else row
+    return row.astype('>u2' if depth == 16 else np.uint8).tobytes()
+
+
+def _read_png(data, max_side: int, grayscale: bool) -> Optional[np.ndarray]:
+    """Band-reduced non-interlaced 8/16-bit PNG."""
+    view = memoryview(data).cast('B')
+    chunks = _png_chunks(view)
+    kind, header = next(chunks, (None, None))
+    if kind != b'IHDR':
+        return None
+    width, height, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', header)
+    if interlace or depth not in (8, 16) or color_type not in _PNG_CHANNELS:
+        return None
+
+    bytes_per_pixel = _PNG_CHANNELS[color_type] * depth // 8
+    stride = 1 + width * bytes_per_pixel
+    factor = reduction_factor(width, height, max_side)
+    reducer = BandReducer(width, height, factor, grayscale)
+    rows_per_band = _band_rows(width, bytes_per_pixel, factor)
+
+    def decode(filtered, rows: int, previous: Optional[bytes]) -> np.ndarray:
+        # Standalone PNG of the band; the previous band's last row,
+        # unfiltered, goes first so Up/Average/Paeth rows decode exactly
+        rows_data = [filtered] if previous is None else [b'\x00' + previous, filtered]
+        rows += previous is not None
+        ihdr = struct.pack('>IIBBBBB', width, rows, depth, color_type, 0, 0, 0)
+        png = b''.join([_PNG_SIGNATURE] + _png_chunk(b'IHDR', [ihdr])
+                       + _png_chunk(b'IDAT', _stored_zlib(rows_data)) + _png_chunk(b'IEND', []))
+        band = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_UNCHANGED)
+        if band is None:
+            raise ValueError("Could not decode PNG band")
+        return band[1:] if previous is not None else band
+
+    inflater = zlib.decompressobj()
+    pending = bytearray()
+    previous = None
+    decoded_rows = 0
+
+    def flush(rows: int):
+        nonlocal previous, decoded_rows
+        with memoryview(pending) as filtered:
+            band = decode(filtered[:rows * stride], rows, previous)
+        del pending[:rows * stride]
+        previous = _raw_row(band[-1], color_type, depth)
+        reducer.feed(band, order='bgr')
+        decoded_rows += rows
+
+    for kind, payload in chunks:
+        if kind != b'IDAT':
+            continue
+        # Inflate at most a band at a time: a highly compressible scan can
+        # expand a single IDAT chunk to hundreds of megabytes
+        while payload:
+            pending += inflater.decompress(payload, rows_per_band * stride)
+            payload = inflater.unconsumed_tail
+            while len(pending) >= rows_per_band * stride:
+                flush(rows_per_band)
+    pending += inflater.flush()
+    remaining = min(height - decoded_rows, len(pending) // stride)
+    if remaining > 0:
+        flush(remaining)
+    return reducer.result()
+
+
+def read_reduced(data, fmt: str, max_side: int, grayscale: bool = False) -> Optional[np.ndarray]:
+    """
+    Decode a large TIFF or PNG a band at a time, reduced by the largest
+    integer factor that keeps at least max_side pixels on the longest side.
+
+    Args:
+        data: Encoded image (bytes, memoryview or mmap of the file)
+        fmt: Format as reported by utils.probe_image_size ('tiff' or 'png')
+        max_side: Longest side the caller works at
+        grayscale: Return one channel instead of BGR
+
+    Returns:
+        The reduced uint8 image, or None if this layout isn't streamed
+    """
+    if fmt == 'tiff':
+        return _read_tiff(data, max_side, grayscale)
+    if fmt == 'png':
+        return _read_png(data, max_side, grayscale)
+    return None
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Asynchronous job API for the Stencil Processing Service.
+
+Lets callers submit a stencil request, get a job id back immediately and
+poll for progress instead of holding an HTTP connection open for the whole
+generation. Finished results are kept for a bounded time so retries fetch
+the same result rather than starting the job again.
+"""
+
+import json
+import math
+import threading
+import time
+import uuid
+import urllib.request
+from typing import Optional, Dict, Any
+
+from admission import ServiceBusyError
+from coalesce import RequestAbortedError
+
+
+class JobCancelledError(RequestAbortedError):
+    """Raised inside a running job when it has been cancelled."""
+    pass
+
+
+class StencilJob:
+    """State of one asynchronous stencil job."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+    def __init__(self, params: Dict[str, Any], callback_url: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.callback_url = callback_url
+        self.status = self.QUEUED
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.result: Optional[bytes] = None
+        self.timings: Dict[str, Any] = {}
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in self.FINISHED
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Public job status (without the result bytes)."""
+        return {
+            'jobId': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'style': self.params.get('style', 'outline'),
+            'error': self.error,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+            'resultBytes': len(self.result) if self.result is not None else None,
+            'timings': self.timings,
+        }
+
+
+class JobManager:
+    """
+    Runs stencil jobs in background threads and retains their results.
+
+    Each job goes through the service's admission queue like a synchronous
+    request; the number of unfinished jobs is bounded separately so a burst
+    of submissions is rejected up front with ServiceBusyError.
+    """
+
+    def __init__(self, service, ttl: float = 600.0, max_pending: int = 64):
+        """
+        Args:
+            service: StencilService that performs the generation
+            ttl: Seconds finished jobs (and their results) are retained
+            max_pending: Maximum queued + running jobs
+        """
+        self.service = service
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._jobs: Dict[str, StencilJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self,
+               image_data,
+               callback_url: Optional[str] = None,
+               **params) -> StencilJob:
+        """
+        Queue a stencil job and return immediately.
+
+        Args:
+            image_data: Encoded image buffer or decoded BGR array
+            callback_url: Optional http(s) URL notified on completion
+            **params: StencilService.process_image parameters
+
+        Returns:
+            The new job
+
+        Raises:
+            ServiceBusyError: If too many jobs are pending
+            ValueError: If the callback URL is not http(s)
+        """
+        if callback_url and not callback_url.startswith(('http://', 'https://')):
+            raise ValueError('callbackUrl must be an http(s) URL')
+
+        self._purge_expired()
+
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                wait = self.service.admission.stats()['estimatedWait']
+                raise ServiceBusyError(max(1, math.ceil(wait)))
+            job = StencilJob(params, callback_url)
+            self._jobs[job.id] = job
+
+        thread = threading.Thread(
+            target=self._run, args=(job, image_data),
+            name=f"stencil-job-{job.id[:8]}", daemon=True
+        )
+        thread.start()
+        print(f"[Jobs] Submitted {job.id} (style={params.get('style', 'outline')})")
+        return job
+
+    def get(self, job_id: str) -> Optional[StencilJob]:
+        """Look up a job; expired jobs are gone."""
+        self._purge_expired()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[StencilJob]:
+        """
+        Cancel a job.
+
+        Queued jobs are cancelled at once and leave the admission queue;
+        jobs waiting on an identical in-flight request detach from it (the
+        run goes on for the other requests); running jobs stop at the next
+        pipeline stage.
+        """
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            with self._lock:
+                job.cancel_requested = True
+                if job.status == StencilJob.QUEUED:
+                    job.status = StencilJob.CANCELLED
+                    job.stage = 'cancelled'
+                    job.finished_at = time.time()
+            # Let the job's thread see the cancel wherever it waits
+            self.service.wake()
+        return job
+
+    def _run(self, job: StencilJob, image_data) -> None:
+        """Worker thread body for one job."""
+        def abort():
+            if job.cancel_requested:
+                raise JobCancelledError()
+
+        def progress(stage: str, fraction: float):
+            # Atomic with cancel(): a job is either cancelled while queued
+            # or seen running
+            with self._lock:
+                if job.cancel_requested and stage != 'coalesced':
+                    raise JobCancelledError()
+                if job.status == StencilJob.QUEUED:
+                    job.status = StencilJob.RUNNING
+                    job.started_at = time.time()
+            job.stage = stage
+            job.progress = fraction
+
+        try:
+            job.result = self.service.process_image(
+                image_data, progress=progress, bounded=False,
+                timings=job.timings, abort=abort, **job.params
+            )
+            job.status = StencilJob.COMPLETED
+            job.stage = 'done'
+            job.progress = 1.0
+        except JobCancelledError:
+            job.status = StencilJob.CANCELLED
+            job.stage = 'cancelled'
+        except Exception as e:
+            print(f"[Jobs] ❌ Job {job.id} failed: {e}")
+            job.status = StencilJob.FAILED
+            job.error = str(e)
+        finally:
+            if job.finished_at is None:
+                job.finished_at = time.time()
+
+        print(f"[Jobs] Job {job.id} {job.status}")
+        if job.callback_url:
+            self._notify(job)
+
+    def _notify(self, job: StencilJob) -> None:
+        """POST the final job status to the callback URL (best effort)."""
+        payload = dict(job.to_dict(), resultUrl=f"/jobs/{job.id}/result")
+        request = urllib.request.Request(
+            job.callback_url,
+            data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+        except Exception as e:
+            print(f"[Jobs] Callback for {job.id} failed: {e}")
+
+    def _purge_expired(self) -> None:
+        """Forget finished jobs older than the retention time."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        """Job counts for the health endpoint."""
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {'retentionSeconds': self.ttl, 'maxPending': self.max_pending, **counts}
@@ -134,6 +134,91 @@ def binary_to_rgba(binary: np.ndarray,
     return rgba
 
 
+def apply_variant(binary: np.ndarray,
+                  inverted: bool = False,
+                  flip_h: bool = False,
+                  flip_v: bool = False) -> np.ndarray:
+    """
+    Apply cheap per-request pixel variations to a finished stencil mask.
+    
+    Args:
+        binary: Binary stencil (255 = lines)
+        inverted: Swap lines and background (light lines on dark ground)
+        flip_h: Mirror horizontally
+        flip_v: Mirror vertically
+        
+    Returns:
+        Transformed binary mask (the input is never modified)
+    """
+    if inverted:
+        binary = cv2.bitwise_not(binary)
+    if flip_h and flip_v:
+        binary = cv2.flip(binary, -1)
+    elif flip_h:
+        binary = cv2.flip(binary, 1)
+    elif flip_v:
+        binary = cv2.flip(binary, 0)
+    return binary
+
+
+def pack_mask(binary: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Bit-pack a binary stencil mask (8x smaller) for caching or transfer.
+    
+    Returns:
+        (packed bits, original shape)
+    """
+    return np.packbits(binary == 255), binary.shape
+
+
+def unpack_mask(packed: Tuple[np.ndarray, Tuple[int, int]]) -> np.ndarray:
+    """Inverse of pack_mask: restore the 0/255 uint8 mask."""
+    bits, shape = packed
+    count = shape[0] * shape[1]
+    return (np.unpackbits(bits, count=count).reshape(shape) * 255).astype(np.uint8)
+
+
+def encode_two_tone_png(binary: np.ndarray,
+                        line_color: Tuple[int, int, int] = (0, 0, 0),
+                        background_color: Tuple[int, int, int] = (255, 255, 255),
+                        transparent_bg: bool = True) -> Optional[bytes]:
+    """
+    Encode a binary stencil as a 2-entry palette PNG.
+    
+    Produces the same pixels as binary_to_rgba + PNG encoding, but the
+    indexed image is a fraction of the size and encodes roughly ten times
+    faster than a 4-channel PNG.
+    
+    Args:
+        binary: Binary image (255 = lines, 0 = background)
+        line_color: BGR color for lines
+        background_color: BGR color for background
+        transparent_bg: Whether background should be transparent
+        
+    Returns:
+        PNG bytes, or None if Pillow is not available
+    """
+    try:
+        from PIL import Image
+        import io
+    except ImportError:
+        return None
+    
+    h, w = binary.shape
+    indices = np.ascontiguousarray((binary == 255).view(np.uint8))
+    image = Image.frombuffer('P', (w, h), indices, 'raw', 'P', 0, 1)
+    bb, bg, br = background_color
+    lb, lg, lr = line_color
+    image.putpalette([br, bg, bb, lr, lg, lb])
+    
+    buffer = io.BytesIO()
+    if transparent_bg:
+        image.save(buffer, format='PNG', compress_level=6, transparency=0)
+    else:
+        image.save(buffer, format='PNG', compress_level=6)
+    return buffer.getvalue()
+
+
 def add_margin(image: np.ndarray, 
                margin: int = 50,
                color: Tuple[int, int, int, int] = (255, 255, 255, 0)) -> np.ndarray:
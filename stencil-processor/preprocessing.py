@@ -6,7 +6,7 @@ Handles image enhancement, denoising, background removal, and upscaling.
 
 import cv2
 import numpy as np
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -15,12 +15,18 @@ def to_grayscale(image: np.ndarray) -> np.ndarray:
     """
     Convert image to grayscale.
     
+    Transparent pixels of BGRA images are composited onto white.
+    
     Args:
-        image: BGR or grayscale image
+        image: BGR, BGRA or grayscale image
         
     Returns:
         Grayscale image
     """
+    if len(image.shape) == 3 and image.shape[2] == 4:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY).astype(np.float32)
+        alpha = image[:, :, 3].astype(np.float32) / 255.0
+        return np.clip(255.0 - (255.0 - gray) * alpha + 0.5, 0, 255).astype(np.uint8)
     if len(image.shape) == 3:
         return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     return image.copy()
@@ -43,6 +49,183 @@ def apply_clahe(gray: np.ndarray, clip_limit: float = 2.0,
     return clahe.apply(gray)
 
 
+# Denoising tiers, fastest first. Costs are single-thread milliseconds per
+# megapixel of the (already upscaled) working image at strength 10; the rest
+# of preprocess_pipeline adds ~40 ms/MP:
+#   draft    - bilateral filter                             ~35 ms/MP
+#   standard - NLMeans at half resolution + guided upsample ~190 ms/MP
+#   print    - full-resolution NLMeans, 21x21 search        ~1350 ms/MP
+DENOISE_TIERS = {
+    'draft': 'bilateral',
+    'standard': 'nlmeans_reduced',
+    'print': 'nlmeans',
+}
+DEFAULT_DENOISE_TIER = 'print'
+
+
+def guided_filter_coefficients(guide: np.ndarray, src: np.ndarray,
+                               radius: int = 4, eps: float = 400.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Box-filtered linear coefficients of the guided filter (He et al.).
+    
+    The filtered image is a * guide + b; since a and b are smooth, they can
+    also be computed at low resolution and upsampled (fast guided filter).
+    
+    Args:
+        guide: Grayscale guidance image
+        src: Image to filter (same size)
+        radius: Box filter radius
+        eps: Regularization in squared intensity units (larger = smoother)
+        
+    Returns:
+        (a, b) float32 coefficient maps
+    """
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    I = guide.astype(np.float32)
+    p = src.astype(np.float32)
+    
+    mean_I = cv2.boxFilter(I, -1, ksize)
+    mean_p = cv2.boxFilter(p, -1, ksize)
+    var_I = cv2.boxFilter(I * I, -1, ksize) - mean_I * mean_I
+    cov_Ip = cv2.boxFilter(I * p, -1, ksize) - mean_I * mean_p
+    
+    a = cov_Ip / (var_I + eps)
+    b = mean_p - a * mean_I
+    
+    return cv2.boxFilter(a, -1, ksize), cv2.boxFilter(b, -1, ksize)
+
+
+def guided_filter(guide: np.ndarray, src: np.ndarray,
+                  radius: int = 4, eps: float = 400.0) -> np.ndarray:
+    """
+    Edge-preserving guided filter (He et al.) built from box filters.
+    
+    Transfers the edges of `guide` onto `src`: flat regions take the local
+    mean of src, strong guide edges are kept.
+    
+    Args:
+        guide: Grayscale guidance image
+        src: Grayscale image to filter (same size)
+        radius: Box filter radius
+        eps: Regularization in squared intensity units (larger = smoother)
+        
+    Returns:
+        Filtered uint8 image
+    """
+    a, b = guided_filter_coefficients(guide, src, radius, eps)
+    q = a * guide.astype(np.float32) + b
+    return np.clip(q, 0, 255).astype(np.uint8)
+
+
+# Edge-preserving smoothing methods for smooth_edges(). 'bilateral' is
+# cv2.bilateralFilter, whose cost grows with the diameter squared (~35 ms/MP
+# at d=9, ~1000 ms/MP at d=45); 'grid' is bilateral_grid(), ~80 ms/MP at any
+# diameter; 'auto' uses the grid from GRID_MIN_DIAMETER up.
+SMOOTHING_METHODS = ('bilateral', 'grid', 'auto')
+DEFAULT_SMOOTHING = 'bilateral'
+GRID_MIN_DIAMETER = 15
+
+
+def _grid_cell(d: int, sigma_space: float) -> int:
+    """Spatial cell size of bilateral_grid()."""
+    # cv2.bilateralFilter cuts its kernel at radius d/2; a disc that size
+    # has a per-axis spread of d/4
+    return max(1, int(round(min(float(sigma_space), d / 4.0))))
+
+
+def bilateral_grid(gray: np.ndarray, d: int, sigma_color: float,
+                   sigma_space: float) -> np.ndarray:
+    """
+    Bilateral filter approximated on a bilateral grid (Paris & Durand).
+    
+    Pixels are splatted into a coarse (y, x, intensity) grid with one cell
+    per spatial/range sigma, the grid is blurred, and the result is read
+    back by trilinear interpolation. Cost depends on the pixel count and
+    the number of intensity levels, not on the filter diameter.
+    
+    Args:
+        gray: Grayscale uint8 image
+        d: Diameter, as for cv2.bilateralFilter (bounds the spatial extent)
+        sigma_color: Range sigma (intensity units)
+        sigma_space: Spatial sigma in pixels
+        
+    Returns:
+        Filtered uint8 image, typically 40-45 dB PSNR from cv2.bilateralFilter
+    """
+    h, w = gray.shape[:2]
+    cell = _grid_cell(d, sigma_space)
+    gh, gw = -(-h // cell), -(-w // cell)
+    levels = int(255.0 / sigma_color) + 2
+    
+    values = np.arange(256, dtype=np.float32)
+    z = values / np.float32(sigma_color)
+    tents = [np.maximum(0.0, 1.0 - np.abs(z - level)).astype(np.float32)
+             for level in range(levels)]
+    
+    # Two channels (weighted intensity, weight) per grid layer; padding to
+    # whole cells keeps area resizing aligned with the cells
+    pair = cv2.merge([gray, gray])
+    padded = cv2.copyMakeBorder(pair, 0, gh * cell - h, 0, gw * cell - w,
+                                cv2.BORDER_REPLICATE)
+    grid = np.zeros((levels + 2, gh, gw, 2), dtype=np.float32)
+    for level, tent in enumerate(tents):
+        lut = np.stack([tent * values, tent], axis=-1).reshape(1, 256, 2)
+        layer = cv2.resize(cv2.LUT(padded, lut), (gw, gh), interpolation=cv2.INTER_AREA)
+        grid[level + 1] = cv2.GaussianBlur(layer, (5, 5), 1.0,
+                                           borderType=cv2.BORDER_REPLICATE)
+    grid = 0.25 * grid[:-2] + 0.5 * grid[1:-1] + 0.25 * grid[2:]
+    
+    # Slice: upsample each layer and blend by each pixel's range weight
+    acc = np.zeros((h, w, 2), dtype=np.float32)
+    for level, tent in enumerate(tents):
+        upsampled = cv2.resize(grid[level], (gw * cell, gh * cell),
+                               interpolation=cv2.INTER_LINEAR)[:h, :w]
+        lut = np.stack([tent, tent], axis=-1).reshape(1, 256, 2)
+        cv2.accumulateProduct(upsampled, cv2.LUT(pair, lut), acc)
+    
+    result = acc[..., 0] / np.maximum(acc[..., 1], 1e-6)
+    return np.clip(result + 0.5, 0, 255).astype(np.uint8)
+
+
+def smoothing_footprint(d: int, sigma_space: float,
+                        method: Optional[str] = None) -> Tuple[int, int]:
+    """
+    (halo, alignment) that make smooth_edges() computed on tiles match the
+    whole-image result (see tiles.TileExecutor.map).
+    
+    The bilateral filter reads d/2 pixels around each pixel, so tiles match
+    exactly. The grid spreads each cell over ~4 cells (area splat, 5x5
+    blur, linear slice) and needs tiles to start on cell boundaries; it
+    then matches up to float rounding (rare +-1 intensity levels).
+    """
+    method = method or DEFAULT_SMOOTHING
+    if method == 'grid' or (method == 'auto' and d >= GRID_MIN_DIAMETER):
+        cell = _grid_cell(d, sigma_space)
+        return 5 * cell, cell
+    return d // 2 + 1, 1
+
+
+def smooth_edges(gray: np.ndarray, d: int, sigma_color: float, sigma_space: float,
+                 method: Optional[str] = None) -> np.ndarray:
+    """
+    Edge-preserving smoothing; drop-in for cv2.bilateralFilter.
+    
+    Args:
+        gray: Grayscale uint8 image
+        d: Filter diameter
+        sigma_color: Range sigma
+        sigma_space: Spatial sigma
+        method: One of SMOOTHING_METHODS (default DEFAULT_SMOOTHING)
+        
+    Returns:
+        Smoothed image
+    """
+    method = method or DEFAULT_SMOOTHING
+    if method == 'grid' or (method == 'auto' and d >= GRID_MIN_DIAMETER):
+        return bilateral_grid(gray, d, sigma_color, sigma_space)
+    return cv2.bilateralFilter(gray, d, sigma_color, sigma_space)
+
+
 def denoise_image(gray: np.ndarray, strength: int = 10, 
                   method: str = 'nlmeans') -> np.ndarray:
     """
@@ -51,7 +234,9 @@ def denoise_image(gray: np.ndarray, strength: int = 10,
     Args:
         gray: Grayscale image
         strength: Denoising strength (h parameter)
-        method: 'nlmeans' for Non-Local Means or 'bilateral' for bilateral filter
+        method: 'nlmeans' for Non-Local Means, 'nlmeans_reduced' for
+            Non-Local Means at half resolution with guided upsampling, or
+            'bilateral' for bilateral filter
         
     Returns:
         Denoised image
@@ -64,6 +249,20 @@ def denoise_image(gray: np.ndarray, strength: int = 10,
             templateWindowSize=7, 
             searchWindowSize=21
         )
+    elif method == 'nlmeans_reduced':
+        # Non-local means on a quarter of the pixels, then restore full
+        # resolution edges from the noisy input with a guided filter
+        h, w = gray.shape[:2]
+        small = cv2.resize(gray, (max(1, w // 2), max(1, h // 2)),
+                           interpolation=cv2.INTER_AREA)
+        small = cv2.fastNlMeansDenoising(
+            small, None,
+            h=strength,
+            templateWindowSize=7,
+            searchWindowSize=11
+        )
+        upsampled = cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+        return guided_filter(gray, upsampled, radius=4, eps=float(strength * strength))
     elif method == 'bilateral':
         # Bilateral filter - faster but less effective
         return cv2.bilateralFilter(gray, 9, 75, 75)
@@ -71,6 +270,75 @@ def denoise_image(gray: np.ndarray, strength: int = 10,
         return gray.copy()
 
 
+def denoise_method_for(tier: Optional[str]) -> str:
+    """Map a denoise tier name (see DENOISE_TIERS) to a denoise_image method."""
+    return DENOISE_TIERS.get(tier or DEFAULT_DENOISE_TIER, DENOISE_TIERS[DEFAULT_DENOISE_TIER])
+
+
+# Adaptive denoising thresholds (estimated noise sigma, 0-255 scale).
+# Below NOISE_SKIP_SIGMA (clean PNGs, studio shots) denoising is skipped;
+# below NOISE_NLMEANS_SIGMA the bilateral filter is enough.
+NOISE_SKIP_SIGMA = 1.0
+NOISE_NLMEANS_SIGMA = 3.0
+
+
+def estimate_noise(gray: np.ndarray, max_side: int = 512) -> float:
+    """
+    Fast estimate of the Gaussian noise sigma of a grayscale image.
+    
+    Immerkaer's method (mean absolute response to a Laplacian-difference
+    kernel) on a decimated copy; decimation keeps per-pixel noise intact,
+    unlike area averaging. The 10% strongest-gradient pixels are ignored
+    so edges and texture don't read as noise. ~5 ms for any input size.
+    
+    Args:
+        gray: Grayscale image
+        max_side: Longest side of the decimated copy
+        
+    Returns:
+        Estimated noise standard deviation (0-255 scale)
+    """
+    h, w = gray.shape[:2]
+    step = max(1, int(np.ceil(max(h, w) / max_side)))
+    small = gray[::step, ::step].astype(np.float32)
+    if min(small.shape) < 3:
+        return 0.0
+    
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    response = np.abs(cv2.filter2D(small, -1, kernel))[1:-1, 1:-1]
+    
+    gradient = (np.abs(cv2.Sobel(small, cv2.CV_32F, 1, 0)) +
+                np.abs(cv2.Sobel(small, cv2.CV_32F, 0, 1)))[1:-1, 1:-1]
+    flat = gradient <= np.percentile(gradient, 90)
+    
+    return float(np.sqrt(np.pi / 2) * response[flat].mean() / 6.0)
+
+
+def choose_denoise(sigma: float, strength: int = 10,
+                   tier: Optional[str] = None) -> Tuple[str, int]:
+    """
+    Pick the denoising method and strength for an estimated noise level.
+    
+    Never more expensive than the tier's method, never stronger than
+    `strength`.
+    
+    Args:
+        sigma: Noise estimate from estimate_noise()
+        strength: Maximum denoising strength (h parameter)
+        tier: Denoise tier (see DENOISE_TIERS)
+        
+    Returns:
+        (method, strength) with method 'none', 'bilateral' or the tier's
+        NLMeans variant
+    """
+    if sigma < NOISE_SKIP_SIGMA:
+        return 'none', 0
+    method = denoise_method_for(tier)
+    if sigma < NOISE_NLMEANS_SIGMA or method == 'bilateral':
+        return 'bilateral', 0
+    return method, int(np.clip(round(1.25 * sigma), 3, strength))
+
+
 def enhance_contrast(gray: np.ndarray, alpha: float = 1.0, beta: int = 0) -> np.ndarray:
     """
     Adjust image contrast and brightness.
@@ -88,16 +356,27 @@ def enhance_contrast(gray: np.ndarray, alpha: float = 1.0, beta: int = 0) -> np.
 
 def preprocess_pipeline(image: np.ndarray, 
                         contrast: int = 50,
-                        denoise: bool = True,
-                        denoise_strength: int = 10) -> np.ndarray:
+                        denoise: Union[bool, str] = True,
+                        denoise_strength: int = 10,
+                        denoise_tier: Optional[str] = None,
+                        info: Optional[dict] = None,
+                        smoothing: Optional[str] = None) -> np.ndarray:
     """
     Full preprocessing pipeline for stencil generation.
     
     Args:
         image: BGR input image
         contrast: Contrast level (0-100, 50 is neutral)
-        denoise: Whether to apply denoising
-        denoise_strength: Denoising strength
+        denoise: Whether to apply denoising, or 'auto' to choose method and
+            strength from estimate_noise() (may skip denoising entirely)
+        denoise_strength: Denoising strength (maximum strength for 'auto')
+        denoise_tier: 'draft', 'standard' or 'print' (see DENOISE_TIERS;
+            default DEFAULT_DENOISE_TIER)
+        info: Optional dict receiving the chosen 'denoise' method and, for
+            'auto', the 'noiseSigma' estimate and 'denoiseStrength' (as
+            strings, ready for timing/diagnostic output)
+        smoothing: Final edge-preserving smoothing method (see
+            SMOOTHING_METHODS)
         
     Returns:
         Preprocessed grayscale image
@@ -106,8 +385,23 @@ def preprocess_pipeline(image: np.ndarray,
     gray = to_grayscale(image)
     
     # Denoise if requested
-    if denoise:
-        gray = denoise_image(gray, strength=denoise_strength)
+    if denoise == 'auto':
+        sigma = estimate_noise(gray)
+        method, strength = choose_denoise(sigma, denoise_strength, denoise_tier)
+        print(f"[Preprocess] Noise sigma {sigma:.2f} -> {method}"
+              + (f" (h={strength})" if strength else ""))
+        if info is not None:
+            info['noiseSigma'] = f'{sigma:.2f}'
+            info['denoise'] = method
+            if strength:
+                info['denoiseStrength'] = str(strength)
+        if method != 'none':
+            gray = denoise_image(gray, strength=strength, method=method)
+    elif denoise:
+        method = denoise_method_for(denoise_tier)
+        if info is not None:
+            info['denoise'] = method
+        gray = denoise_image(gray, strength=denoise_strength, method=method)
     
     # Apply CLAHE for local contrast enhancement
     gray = apply_clahe(gray, clip_limit=2.5)
@@ -117,42 +411,30 @@ def preprocess_pipeline(image: np.ndarray,
     gray = enhance_contrast(gray, alpha=alpha)
     
     # Bilateral filter for smooth gradients while keeping edges
-    gray = cv2.bilateralFilter(gray, 9, 75, 75)
+    gray = smooth_edges(gray, 9, 75, 75, method=smoothing)
     
     return gray
 
 
-def remove_background(image: np.ndarray) -> np.ndarray:
+def remove_background(image: np.ndarray, engine: Optional[str] = None,
+                      key: Optional[str] = None) -> np.ndarray:
     """
-    Remove background using rembg library.
+    Remove the background of an image.
     
     Args:
         image: BGR input image
+        engine: 'local' (built-in, default), 'rembg' or 'threshold';
+            see background.py
+        key: image_digest() of the image, for the per-process mask cache
         
     Returns:
         BGRA image with transparent background
-        
-    Note:
-        Requires 'rembg' package to be installed.
-        Falls back to simple background removal if not available.
     """
-    try:
-        import rembg
-        
-        # Convert BGR to RGB for rembg
-        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Remove background
-        output = rembg.remove(rgb)
-        
-        # Convert back to BGRA
-        bgra = cv2.cvtColor(output, cv2.COLOR_RGBA2BGRA)
-        
-        return bgra
-        
-    except ImportError:
-        print("[Warning] 'rembg' not installed. Using simple background removal.")
-        return simple_background_removal(image)
+    from background import foreground_mask
+    
+    bgra = cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA if image.ndim == 2 else cv2.COLOR_BGR2BGRA)
+    bgra[:, :, 3] = foreground_mask(image, engine, key)
+    return bgra
 
 
 def simple_background_removal(image: np.ndarray, 
@@ -236,6 +518,36 @@ def ensure_minimum_resolution(image: np.ndarray,
     return image
 
 
+def fit_working_resolution(image: np.ndarray,
+                           min_size: int = 1024,
+                           max_size: int = 2048) -> np.ndarray:
+    """
+    Bring an image to a bounded working resolution.
+    
+    Small images are upscaled as in ensure_minimum_resolution; images whose
+    longest side exceeds max_size are downscaled (area interpolation), so
+    processing cost no longer grows with input megapixels.
+    
+    Args:
+        image: Input image
+        min_size: Minimum longest side
+        max_size: Maximum longest side
+        
+    Returns:
+        Image with min(min_size, max_size) <= longest side <= max_size
+    """
+    h, w = image.shape[:2]
+    # The cap wins over the minimum
+    min_size = min(min_size, max_size)
+    
+    if max(h, w) > max_size:
+        scale = max_size / max(h, w)
+        return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                          interpolation=cv2.INTER_AREA)
+    
+    return ensure_minimum_resolution(image, min_size=min_size)
+
+
 def resize_for_output(image: np.ndarray, 
                        target_resolution: Tuple[int, int] = (0, 0),
                        keep_aspect: bool = True) -> np.ndarray:
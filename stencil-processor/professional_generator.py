@@ -17,6 +17,12 @@ from typing import Tuple, Optional, Dict, Any
 from enum import Enum
 import math
 
+from preprocessing import denoise_image, denoise_method_for, DEFAULT_DENOISE_TIER
+from edges import EdgeMaps
+from posterize import Posterization
+from stage_graph import StageGraph
+from streamlines import draw_streamlines, evenly_spaced_streamlines, grid_seeds
+
 
 class StencilStyle(Enum):
     OUTLINE = "outline"
@@ -36,8 +42,13 @@ class ProfessionalStencilGenerator:
         self.hatching_base_spacing = 8
         self.hatching_min_spacing = 3
         self.hatching_max_spacing = 20
+        # 'even': evenly spaced streamlines, spacing set by tone;
+        # 'grid': strokes seeded on a fixed grid in up to three passes
+        self.hatching_placement = "even"
         self.contour_thickness = 2
         self.detail_thickness = 1
+        # Per-stage seconds of the last generate() call
+        self.timings = {}
         
     def generate(
         self,
@@ -48,7 +59,8 @@ class ProfessionalStencilGenerator:
         inverted: bool = False,
         line_color: Tuple[int, int, int] = (0, 0, 0),
         transparent_bg: bool = False,
-        preserve_details: bool = True
+        preserve_details: bool = True,
+        denoise_tier: str = DEFAULT_DENOISE_TIER
     ) -> np.ndarray:
         """
         Generate a professional tattoo stencil.
@@ -61,6 +73,7 @@ class ProfessionalStencilGenerator:
             inverted: Invert colors
             line_color: BGR color for lines
             transparent_bg: Use transparent background
+            denoise_tier: 'draft', 'standard' or 'print' (see DENOISE_TIERS)
             
         Returns:
             Stencil image (BGR or BGRA)
@@ -68,22 +81,32 @@ class ProfessionalStencilGenerator:
         # Convert style string to enum
         style_enum = StencilStyle(style.lower())
         
-        # Preprocessing
-        processed = self._preprocess(image, contrast)
-        
-        # Multi-pass processing
-        contours = self._extract_contours(processed, line_thickness)
-        edges_importance = self._compute_edge_importance(processed)
+        # Declare the multi-pass pipeline; only the stages the chosen
+        # style depends on are computed, each once
+        self.timings = {}
+        graph = StageGraph(self.timings)
+        processed = graph.add('preprocess', self._preprocess, graph.source('image', image),
+                              contrast=contrast, denoise_tier=denoise_tier)
+        gradients = graph.add('gradients', EdgeMaps, processed)
+        contours = graph.add('contours', self._extract_contours, gradients,
+                             thickness=line_thickness)
+        field = graph.add('vectorField', self._compute_vector_field, gradients)
+        density = graph.add('density', self._compute_density_map, processed)
         
         # Generate based on style
         if style_enum == StencilStyle.OUTLINE:
-            stencil = self._generate_outline(contours, edges_importance, line_thickness)
+            output = graph.add('outline', self._generate_outline, contours,
+                               thickness=line_thickness)
         elif style_enum == StencilStyle.HATCHING:
-            stencil = self._generate_hatching(processed, contours, edges_importance, line_thickness)
+            output = graph.add('hatching', self._generate_hatching, processed, contours,
+                               field, density, thickness=line_thickness)
         elif style_enum == StencilStyle.SOLID:
-            stencil = self._generate_solid(processed, contours, line_thickness)
+            output = graph.add('solid', self._generate_solid, processed, contours,
+                               thickness=line_thickness)
         else:  # DETAILED
-            stencil = self._generate_detailed(processed, contours, edges_importance, line_thickness)
+            output = graph.add('detailed', self._generate_detailed, processed, contours,
+                               field, density, thickness=line_thickness)
+        stencil = graph.run(output)
         
         # Apply inversion if needed
         if inverted:
@@ -94,7 +117,8 @@ class ProfessionalStencilGenerator:
         
         return result
     
-    def _preprocess(self, image: np.ndarray, contrast: int) -> np.ndarray:
+    def _preprocess(self, image: np.ndarray, contrast: int,
+                    denoise_tier: str = DEFAULT_DENOISE_TIER) -> np.ndarray:
         """
         Preprocess image: denoise, enhance contrast, normalize.
         """
@@ -105,7 +129,7 @@ class ProfessionalStencilGenerator:
             gray = image.copy()
         
         # Denoise
-        denoised = cv2.fastNlMeansDenoising(gray, None, h=10, searchWindowSize=21, templateWindowSize=7)
+        denoised = denoise_image(gray, strength=10, method=denoise_method_for(denoise_tier))
         
         # Enhance contrast using CLAHE
         clahe = cv2.createCLAHE(clipLimit=2.0 + contrast / 25.0, tileGridSize=(8, 8))
@@ -116,13 +140,12 @@ class ProfessionalStencilGenerator:
         
         return normalized
     
-    def _extract_contours(self, gray: np.ndarray, thickness: int) -> np.ndarray:
+    def _extract_contours(self, gradients: EdgeMaps, thickness: int) -> np.ndarray:
         """
         Extract main contours with varying importance.
         """
-        # Multi-scale edge detection
-        edges_fine = cv2.Canny(gray, 50, 150)
-        edges_coarse = cv2.Canny(gray, 30, 100)
+        # Multi-scale edge detection (one gradient pass, two thresholds)
+        edges_fine, edges_coarse = gradients.edges([(50, 150), (30, 100)])
         
         # Morphological operations for cleaner edges
         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
@@ -137,36 +160,14 @@ class ProfessionalStencilGenerator:
         
         return contours
     
-    def _compute_edge_importance(self, gray: np.ndarray) -> np.ndarray:
-        """
-        Compute edge importance map for variable line thickness.
-        Important edges (face features, strong contrasts) get higher values.
-        """
-        # Gradient magnitude
-        grad_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        grad_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        gradient_magnitude = np.sqrt(grad_x**2 + grad_y**2)
-        
-        # Normalize
-        gradient_normalized = cv2.normalize(gradient_magnitude, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-        
-        # Find strong edges (face features typically have higher contrast)
-        _, strong_edges = cv2.threshold(gradient_normalized, 100, 255, cv2.THRESH_BINARY)
-        
-        # Dilate importance area
-        importance_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        importance = cv2.dilate(strong_edges, importance_kernel, iterations=2)
-        
-        return importance
-    
-    def _compute_vector_field(self, gray: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    def _compute_vector_field(self, gradients: EdgeMaps) -> Tuple[np.ndarray, np.ndarray]:
         """
         Compute vector field for directional hatching.
         Lines should be perpendicular to the gradient (along contours).
         """
-        # Compute gradients
-        grad_x = cv2.Sobel(gray.astype(np.float64), cv2.CV_64F, 1, 0, ksize=3)
-        grad_y = cv2.Sobel(gray.astype(np.float64), cv2.CV_64F, 0, 1, ksize=3)
+        # Shared gradients (exact: Sobel of 8-bit input is integral)
+        grad_x = gradients.dx.astype(np.float64)
+        grad_y = gradients.dy.astype(np.float64)
         
         # Vector field perpendicular to gradient (for hatching direction)
         # Rotate 90 degrees: (-grad_y, grad_x)
@@ -204,7 +205,6 @@ class ProfessionalStencilGenerator:
     def _generate_outline(
         self,
         contours: np.ndarray,
-        importance: np.ndarray,
         thickness: int
     ) -> np.ndarray:
         """
@@ -228,7 +228,8 @@ class ProfessionalStencilGenerator:
         self,
         gray: np.ndarray,
         contours: np.ndarray,
-        importance: np.ndarray,
+        field: Tuple[np.ndarray, np.ndarray],
+        density: np.ndarray,
         thickness: int
     ) -> np.ndarray:
         """
@@ -237,10 +238,7 @@ class ProfessionalStencilGenerator:
         """
         h, w = gray.shape
         result = np.ones((h, w), dtype=np.uint8) * 255
-        
-        # Compute vector field and density
-        vec_x, vec_y = self._compute_vector_field(gray)
-        density = self._compute_density_map(gray)
+        vec_x, vec_y = field
         
         # Draw contours first
         result = cv2.subtract(result, contours)
@@ -269,74 +267,36 @@ class ProfessionalStencilGenerator:
         h, w = shape
         result = np.ones((h, w), dtype=np.uint8) * 255
         
+        if self.hatching_placement == "even":
+            # Line spacing from tone: min spacing at full density, max at
+            # the lightest hatched tone, no lines below it
+            spacing = (self.hatching_max_spacing
+                       - (self.hatching_max_spacing - self.hatching_min_spacing) * density)
+            spacing = np.maximum(spacing, thickness + 2)
+            separation = np.where(density >= 0.3, spacing, np.inf)
+            strokes = evenly_spaced_streamlines((vec_x, vec_y), separation, max_steps=30)
+            cv2.polylines(result, strokes, False, 0, thickness)
+            return result
+        
         # Create starting points grid
         spacing = self.hatching_base_spacing
         
-        # Multiple passes for different densities
+        # Multiple passes for different densities (lighter areas get
+        # fewer lines); every pass's strokes are traced in one batch
+        seeds, lengths = [], []
         for pass_num in range(3):
             offset = pass_num * spacing // 3
-            
-            for y in range(offset, h, spacing):
-                for x in range(offset, w, spacing):
-                    # Check local density
-                    local_density = density[y, x]
-                    
-                    # Skip based on density (lighter areas get fewer lines)
-                    threshold = 0.3 + pass_num * 0.2
-                    if local_density < threshold:
-                        continue
-                    
-                    # Draw a short line segment following the vector field
-                    line_length = int(10 + local_density * 20)
-                    self._draw_flow_line(
-                        result, x, y, vec_x, vec_y, 
-                        line_length, thickness, local_density
-                    )
+            threshold = 0.3 + pass_num * 0.2
+            pass_seeds, local_density = grid_seeds(density, spacing, offset, threshold)
+            seeds.append(pass_seeds)
+            lengths.append((10 + local_density * 20).astype(np.int32))
+        
+        # Short line segments following the vector field
+        draw_streamlines(result, (vec_x, vec_y), np.concatenate(seeds),
+                         np.concatenate(lengths), thickness, step_size=2.0)
         
         return result
     
-    def _draw_flow_line(
-        self,
-        canvas: np.ndarray,
-        start_x: int,
-        start_y: int,
-        vec_x: np.ndarray,
-        vec_y: np.ndarray,
-        length: int,
-        thickness: int,
-        intensity: float
-    ) -> None:
-        """
-        Draw a single line following the vector field.
-        """
-        h, w = canvas.shape
-        points = [(start_x, start_y)]
-        
-        x, y = float(start_x), float(start_y)
-        step_size = 2.0
-        
-        for _ in range(length):
-            # Get local direction
-            ix, iy = int(x), int(y)
-            if 0 <= ix < w and 0 <= iy < h:
-                dx = vec_x[iy, ix] * step_size
-                dy = vec_y[iy, ix] * step_size
-                
-                x += dx
-                y += dy
-                
-                if 0 <= int(x) < w and 0 <= int(y) < h:
-                    points.append((int(x), int(y)))
-                else:
-                    break
-            else:
-                break
-        
-        # Draw the line
-        if len(points) > 1:
-            pts = np.array(points, dtype=np.int32)
-            cv2.polylines(canvas, [pts], False, 0, thickness)
-    
     def _generate_solid(
         self,
         gray: np.ndarray,
@@ -346,31 +306,17 @@ class ProfessionalStencilGenerator:
         """
         Generate solid style with posterization and filled regions.
         """
-        h, w = gray.shape
-        
-        # Posterize to few levels (3-4)
+        # Posterize to few levels (3-4), all in one quantization pass
         levels = 4
-        posterized = (gray // (256 // levels)) * (256 // levels)
+        step = 256 // levels
+        posterization = Posterization(gray, [level * step for level in range(1, levels)])
         
-        # Create result
-        result = np.ones((h, w), dtype=np.uint8) * 255
+        # Fill regions with different densities: darker bands darker
+        tones = [max(0, 255 - (levels - 1 - band) * 60) for band in range(levels - 1)] + [255]
+        result = posterization.fill(tones)
         
-        # Process each level
-        for level in range(levels - 1, 0, -1):
-            threshold = level * (256 // levels)
-            
-            # Create mask for this level
-            mask = (gray < threshold).astype(np.uint8) * 255
-            
-            # Find contours and fill
-            cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            # Fill regions with different patterns/densities
-            fill_value = max(0, 255 - level * 60)
-            cv2.drawContours(result, cnts, -1, fill_value, -1)
-            
-            # Draw outlines
-            cv2.drawContours(result, cnts, -1, 0, thickness)
+        # Draw outlines of every level
+        result[posterization.outlines(thickness) > 0] = 0
         
         # Add main contours
         result = cv2.subtract(result, contours)
@@ -381,7 +327,8 @@ class ProfessionalStencilGenerator:
         self,
         gray: np.ndarray,
         contours: np.ndarray,
-        importance: np.ndarray,
+        field: Tuple[np.ndarray, np.ndarray],
+        density: np.ndarray,
         thickness: int
     ) -> np.ndarray:
         """
@@ -391,7 +338,7 @@ class ProfessionalStencilGenerator:
         h, w = gray.shape
         
         # Start with outline
-        result = self._generate_outline(contours, importance, thickness)
+        result = self._generate_outline(contours, thickness)
         
         # Add fine details via Difference of Gaussians
         blur1 = cv2.GaussianBlur(gray, (5, 5), 1.0)
@@ -402,8 +349,7 @@ class ProfessionalStencilGenerator:
         _, fine_details = cv2.threshold(dog, 10, 255, cv2.THRESH_BINARY)
         
         # Add selective hatching for darker areas
-        density = self._compute_density_map(gray)
-        vec_x, vec_y = self._compute_vector_field(gray)
+        vec_x, vec_y = field
         
         # Only add hatching to darker regions
         dark_mask = (density > 0.5).astype(np.uint8) * 255
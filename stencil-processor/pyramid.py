@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Per-request image pyramid for low-frequency stencil computations.
+
+Masks and fields that only carry coarse information (the hatching subject
+mask, the blurred darkness map, smoothed orientation fields) don't need to
+be computed at full resolution. Stages ask the pyramid for the coarsest
+level at which their kernels still span a few pixels, do the work there
+and get the result back at full size, upsampled edge-aware (guided by the
+full-resolution image) where edges matter.
+"""
+
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from preprocessing import guided_filter_coefficients
+
+
+class ImagePyramid:
+    """
+    Lazily built 2x pyramid of one image.
+
+    Level 0 is the image itself; level k is 2^k times smaller. Levels are
+    built on first use and shared by every stage of the request.
+    """
+
+    def __init__(self, base: np.ndarray, max_level: int = 4, min_side: int = 64):
+        """
+        Args:
+            base: Full-resolution image (typically the smoothed grayscale);
+                also the guide for edge-aware upsampling
+            max_level: Coarsest level handed out
+            min_side: Never go below this many pixels on the shorter side
+        """
+        self.base = base
+        self.shape = base.shape[:2]
+        limit = int(np.log2(max(1, min(self.shape) // min_side))) if min(self.shape) >= min_side else 0
+        self.max_level = max(0, min(max_level, limit))
+        self._levels: Dict[int, np.ndarray] = {0: base}
+        self._guides: Dict[int, np.ndarray] = {}
+
+    def level_shape(self, level: int) -> tuple:
+        """(height, width) of a level."""
+        h, w = self.shape
+        return max(1, -(-h >> level)), max(1, -(-w >> level))
+
+    def level_for(self, radius: float, min_radius: float = 2.0) -> int:
+        """
+        Coarsest level at which a kernel of the given full-resolution
+        radius still spans at least min_radius pixels.
+        """
+        level = 0
+        while level < self.max_level and radius / 2 ** (level + 1) >= min_radius:
+            level += 1
+        return level
+
+    def level(self, level: int) -> np.ndarray:
+        """The base image at a level (area-averaged)."""
+        if level not in self._levels:
+            self._levels[level] = self.reduce(self.base, level)
+        return self._levels[level]
+
+    def reduce(self, array: np.ndarray, level: int, mode: str = 'area') -> np.ndarray:
+        """
+        Bring any full-resolution array down to a level.
+
+        Args:
+            array: Array of the base image's size
+            level: Target level
+            mode: 'area' (averaging) or 'max' (for 0/255 uint8 masks such
+                as edge maps: any set pixel sets the coarse pixel, so thin
+                structures survive)
+        """
+        if level == 0:
+            return array
+        h, w = self.level_shape(level)
+        small = cv2.resize(array, (w, h), interpolation=cv2.INTER_AREA)
+        if mode == 'max':
+            # One 255 pixel averages to >= 1 over up to 16x16 pixels
+            _, small = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY)
+        return small
+
+    def expand(self, array: np.ndarray, level: int, mode: str = 'linear',
+               radius: int = 2, eps: float = 100.0) -> np.ndarray:
+        """
+        Bring a level-sized result back to full resolution.
+
+        Args:
+            array: Result computed at `level`
+            level: Level it was computed at
+            mode: 'linear' (bilinear), 'mask' (bilinear, re-thresholded at
+                half range; for 0/255 masks) or 'guided' (fast guided
+                filter: snaps the result to the base image's edges)
+            radius: Guided-filter radius in level pixels
+            eps: Guided-filter regularization, in squared base intensity
+                units (larger = closer to plain bilinear)
+        """
+        if level == 0:
+            return array
+        h, w = self.shape
+        if mode == 'guided':
+            guide = self._guide(level)
+            a, b = guided_filter_coefficients(guide, array.astype(np.float32), radius, eps)
+            a = cv2.resize(a, (w, h), interpolation=cv2.INTER_LINEAR)
+            b = cv2.resize(b, (w, h), interpolation=cv2.INTER_LINEAR)
+            return (a * self._guide(0) + b).astype(array.dtype, copy=False)
+        upsampled = cv2.resize(array, (w, h), interpolation=cv2.INTER_LINEAR)
+        if mode == 'mask':
+            return np.where(upsampled >= 128, 255, 0).astype(np.uint8)
+        return upsampled
+
+    def _guide(self, level: int) -> np.ndarray:
+        """Single-channel float32 guide image at a level."""
+        if level not in self._guides:
+            guide = self.level(level)
+            if guide.ndim == 3:
+                guide = cv2.cvtColor(guide, cv2.COLOR_BGR2GRAY)
+            self._guides[level] = guide.astype(np.float32)
+        return self._guides[level]
+
+
+def reduced_gaussian(pyramid: Optional[ImagePyramid], array: np.ndarray, ksize: int,
+                     sigma: float, mode: str = 'linear') -> np.ndarray:
+    """
+    GaussianBlur(array, ksize, sigma) computed at the coarsest pyramid level
+    that still resolves sigma, returned at full size.
+    """
+    if pyramid is None:
+        return cv2.GaussianBlur(array, (ksize, ksize), sigma)
+    level = pyramid.level_for(sigma, min_radius=1.5)
+    factor = 2 ** level
+    small_ksize = max(1, int(round(ksize / factor)) | 1)
+    small = cv2.GaussianBlur(pyramid.reduce(array, level), (small_ksize, small_ksize), sigma / factor)
+    return pyramid.expand(small, level, mode=mode)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Memoizing stage-graph executor for the stencil pipeline.
+
+A pipeline is declared as a DAG of named stages, each an op applied to the
+outputs of other stages with fixed keyword parameters. Declaring a stage
+runs nothing; StageGraph.run() computes only the stages the requested
+outputs depend on, once each:
+
+- identical stages (same op, same inputs, same params) are one node, so a
+  Canny pass or smoothing shared by several styles of a batch runs once
+- stages no requested output depends on never run
+- every executed stage is timed by the executor itself
+"""
+
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def freeze(value: Any) -> Hashable:
+    """Hashable form of a stage parameter (lists become tuples)."""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    return value
+
+
+class Stage:
+    """
+    One node of a StageGraph.
+
+    Stage functions receive their inputs' values positionally and the
+    params as keywords. Outputs are shared by every consumer, so stage
+    functions must not modify their inputs in place.
+    """
+
+    __slots__ = ('name', 'func', 'inputs', 'params', 'key')
+
+    def __init__(self, name: str, func: Optional[Callable], inputs: Tuple['Stage', ...],
+                 params: Dict[str, Any], key: Hashable):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.params = params
+        self.key = key
+
+    def __repr__(self):
+        params = ', '.join(f'{k}={v!r}' for k, v in self.params.items())
+        return f"Stage({self.name}{', ' + params if params else ''})"
+
+
+class StageGraph:
+    """
+    Lazily evaluated, memoizing DAG of pipeline stages.
+
+    One graph is meant to live for one request (or one batch), so results
+    of shared stages are reused across everything computed from it.
+    """
+
+    def __init__(self, timings: Optional[dict] = None):
+        """
+        Args:
+            timings: Dict receiving per-stage seconds, summed by stage name
+                (may be replaced between runs, e.g. per batch variant)
+        """
+        self.timings = timings if timings is not None else {}
+        self._stages: Dict[Hashable, Stage] = {}
+        self._results: Dict[Hashable, Any] = {}
+        # (name, params, seconds) of every executed stage, in run order
+        self.log: List[Tuple[str, Dict[str, Any], float]] = []
+        self.executed = 0
+        self.reused = 0
+
+    def source(self, name: str, value: Any, key: Optional[Hashable] = None) -> Stage:
+        """
+        Add an input value as a stage.
+
+        Args:
+            name: Stage name
+            value: The value (e.g. a preprocessed grayscale image)
+            key: Identity of the value; defaults to the object's id, which
+                is stable since the graph keeps a reference to it
+        """
+        key = ('source', name, key if key is not None else id(value))
+        stage = self._stages.get(key)
+        if stage is None:
+            stage = Stage(name, None, (), {}, key)
+            self._stages[key] = stage
+            self._results[key] = value
+        return stage
+
+    def add(self, name: str, func: Callable, *inputs: Stage, **params) -> Stage:
+        """
+        Declare a stage (nothing runs yet).
+
+        Returns the existing node if an identical stage was declared before.
+
+        Args:
+            name: Stage name (timing key)
+            func: Op, called as func(*input_values, **params)
+            *inputs: Stages whose outputs are passed positionally
+            **params: Keyword parameters; part of the stage's identity
+        """
+        key = (func, tuple(stage.key for stage in inputs), freeze(params))
+        stage = self._stages.get(key)
+        if stage is None:
+            stage = Stage(name, func, inputs, params, key)
+            self._stages[key] = stage
+        return stage
+
+    def run(self, *stages: Stage) -> Any:
+        """
+        Compute the given stages and whatever they depend on.
+
+        Returns:
+            The stage's value, or a tuple of values for several stages
+        """
+        values = tuple(self._evaluate(stage) for stage in stages)
+        return values[0] if len(values) == 1 else values
+
+    def computed(self, stage: Stage) -> bool:
+        """Whether a stage's value is already available."""
+        return stage.key in self._results
+
+    def _evaluate(self, stage: Stage) -> Any:
+        """Memoized depth-first evaluation of one stage."""
+        if stage.key in self._results:
+            if stage.func is not None:
+                self.reused += 1
+            return self._results[stage.key]
+
+        args = [self._evaluate(inp) for inp in stage.inputs]
+        start = time.perf_counter()
+        value = stage.func(*args, **stage.params)
+        elapsed = time.perf_counter() - start
+
+        self._results[stage.key] = value
+        self.executed += 1
+        self.log.append((stage.name, stage.params, elapsed))
+        self.timings[stage.name] = round(self.timings.get(stage.name, 0.0) + elapsed, 4)
+        return value
@@ -20,19 +20,54 @@ import numpy as np
 import argparse
 import sys
 import os
-from typing import Tuple, Optional, Union
+from typing import Tuple, Optional, Union, Callable, List
 import warnings
 warnings.filterwarnings('ignore')
 
 # Import local modules
-from preprocessing import preprocess_pipeline, remove_background, ensure_minimum_resolution, resize_for_output
-from styles import generate_stencil, STYLE_FUNCTIONS
-from postprocessing import finalize_stencil, smooth_lines, binary_to_rgba, vectorize_to_svg
+from preprocessing import (
+    preprocess_pipeline, remove_background, ensure_minimum_resolution, resize_for_output,
+    fit_working_resolution,
+    DENOISE_TIERS, DEFAULT_DENOISE_TIER, SMOOTHING_METHODS, DEFAULT_SMOOTHING
+)
+from background import BACKGROUND_ENGINES, DEFAULT_BACKGROUND_ENGINE, validate_background_engine
+from styles import (
+    extract_geometry, rasterize_geometry, resolution_scale, STYLE_FUNCTIONS
+)
+from postprocessing import (
+    smooth_lines, binary_to_rgba, vectorize_to_svg,
+    apply_variant, encode_two_tone_png, pack_mask, unpack_mask
+)
+from admission import AdmissionController
+from coalesce import RequestCoalescer
+from cache import ByteBudgetLRU
+from stage_graph import StageGraph, freeze
+from tiles import TileExecutor
 from utils import (
     load_image, save_image, image_to_bytes, bytes_to_base64, base64_to_bytes,
-    validate_thickness, validate_contrast, validate_resolution,
-    Timer, get_image_info, warn_if_low_resolution
+    validate_thickness, validate_contrast, validate_resolution, validate_output_format,
+    validate_denoise_tier, validate_smoothing, hex_to_bgr,
+    Timer, get_image_info, warn_if_low_resolution, image_digest,
+    MAX_IMAGE_PIXELS
 )
+from ingest import MAX_STREAMED_PIXELS
+
+
+# Preprocessing settings used by generate(); part of the grayscale cache key.
+# Denoising adapts to the estimated noise level, up to strength 10.
+PREPROCESS_SETTINGS = (('denoise', 'auto'), ('denoise_strength', 10))
+
+# Longest side of stencils drawn by the bounded working-resolution pipeline
+MAX_OUTPUT_SIDE = 4096
+
+# process_image defaults applied to each variant of a batch
+BATCH_DEFAULTS = {
+    'style': 'outline', 'thickness': 3, 'contrast': 50, 'inverted': False,
+    'line_color': '#000000', 'transparent_bg': False, 'output_format': '.png',
+}
+
+# Request parameters that only affect render() - not the stencil mask
+RENDER_PARAMS = ('line_color', 'transparent_bg', 'inverted', 'flip_h', 'flip_v', 'output_format')
 
 
 class TattooStencilGenerator:
@@ -48,7 +83,19 @@ class TattooStencilGenerator:
                  remove_bg: bool = False,
                  upscale: str = 'none',
                  line_color: Tuple[int, int, int] = (0, 0, 0),
-                 transparent_bg: bool = False):
+                 transparent_bg: bool = False,
+                 output_format: str = '.png',
+                 progress_callback: Optional[Callable[[str, float], None]] = None,
+                 gray_cache=None,
+                 inverted: bool = False,
+                 flip_h: bool = False,
+                 flip_v: bool = False,
+                 geometry_cache=None,
+                 denoise_tier: str = DEFAULT_DENOISE_TIER,
+                 working_size: int = 0,
+                 smoothing: str = DEFAULT_SMOOTHING,
+                 background_engine: str = DEFAULT_BACKGROUND_ENGINE,
+                 tiles: Optional[TileExecutor] = None):
         """
         Initialize the generator.
         
@@ -59,6 +106,26 @@ class TattooStencilGenerator:
             upscale: Target resolution ('none', '1024', '2048', '4K')
             line_color: BGR color for stencil lines (default: black)
             transparent_bg: Whether background should be transparent (default: False = white bg)
+            output_format: Encoded output format ('.png', '.jpg', '.webp')
+            progress_callback: Called as (stage, fraction) at each pipeline
+                stage; may raise to abort generation
+            gray_cache: Optional ByteBudgetLRU holding preprocessed grayscale
+                images, so style/thickness changes skip denoising
+            inverted: Light lines on dark background
+            flip_h: Mirror the stencil horizontally
+            flip_v: Mirror the stencil vertically
+            geometry_cache: Optional ByteBudgetLRU holding extracted contour
+                geometry per style, so thickness changes only re-rasterize
+            denoise_tier: 'draft', 'standard' or 'print' (see DENOISE_TIERS)
+            working_size: Process at most at this longest side (0 = at the
+                input resolution); style parameters are scaled to the working
+                resolution and only the final stencil is drawn at full size
+            smoothing: Edge-preserving smoothing in preprocessing and styles
+                ('bilateral', 'grid' or 'auto'; see SMOOTHING_METHODS)
+            background_engine: Background removal engine used with
+                remove_bg ('local', 'rembg' or 'threshold'; see background.py)
+            tiles: Optional TileExecutor; large images then run their
+                smoothing and Canny stages tile-parallel on its threads
         """
         self.thickness = validate_thickness(thickness)
         self.contrast = validate_contrast(contrast)
@@ -66,75 +133,367 @@ class TattooStencilGenerator:
         self.target_resolution = validate_resolution(upscale)
         self.line_color = line_color
         self.transparent_bg = transparent_bg
+        self.output_format = validate_output_format(output_format)
+        self.progress_callback = progress_callback
+        self.gray_cache = gray_cache
+        self.geometry_cache = geometry_cache
+        self.denoise_tier = validate_denoise_tier(denoise_tier)
+        self.working_size = max(0, int(working_size))
+        self.smoothing = validate_smoothing(smoothing)
+        self.background_engine = validate_background_engine(background_engine)
+        self.tiles = tiles
+        self.inverted = inverted
+        self.flip_h = flip_h
+        self.flip_v = flip_v
+        # Per-stage seconds (and cache outcomes) of the last generate() call
+        self.timings = {}
+        # Smoothed binary mask produced by the last generate() call
+        self.last_mask = None
+        # Masks produced by the last generate_batch() call, in variant order
+        self.last_masks = []
+    
+    def apply_params(self, params: dict):
+        """
+        Apply normalized request parameters (see StencilService) in place.
+        
+        Keys that are absent keep their current value; 'style' is ignored
+        since it is passed to generate() directly.
+        """
+        if 'thickness' in params:
+            self.thickness = validate_thickness(params['thickness'])
+        if 'contrast' in params:
+            self.contrast = validate_contrast(params['contrast'])
+        if 'line_color' in params:
+            self.line_color = tuple(params['line_color'])
+        if 'output_format' in params:
+            self.output_format = validate_output_format(params['output_format'])
+        if 'denoise_tier' in params:
+            self.denoise_tier = validate_denoise_tier(params['denoise_tier'])
+        if 'working_size' in params:
+            self.working_size = max(0, int(params['working_size']))
+        if 'smoothing' in params:
+            self.smoothing = validate_smoothing(params['smoothing'])
+        if 'background_engine' in params:
+            self.background_engine = validate_background_engine(params['background_engine'])
+        for name in ('transparent_bg', 'inverted', 'flip_h', 'flip_v'):
+            if name in params:
+                setattr(self, name, bool(params[name]))
+    
+    def _report(self, stage: str, fraction: float):
+        """Report pipeline progress to the registered callback."""
+        if self.progress_callback is not None:
+            self.progress_callback(stage, fraction)
     
     def generate(self, 
-                 image_data: Union[str, bytes],
+                 image_data: Union[str, bytes, np.ndarray],
                  style: str = 'outline',
+                 image_key: Optional[str] = None,
+                 source_shape: Optional[Tuple[int, int]] = None,
                  **style_kwargs) -> bytes:
         """
         Generate stencil from image.
         
         Args:
-            image_data: File path (str) or image bytes
+            image_data: File path (str), image bytes or decoded BGR array
             style: Stencil style ('outline', 'simple', 'detailed', 'hatching', 'solid')
+            image_key: Precomputed image_digest() of the decoded image, used
+                for intermediate caches (computed on demand if omitted)
+            source_shape: (height, width) of the image at full resolution,
+                when image_data was decoded at reduced scale; sets the
+                output size with a working size (read from the header of
+                encoded input if omitted)
             **style_kwargs: Additional style parameters
             
         Returns:
-            PNG image bytes
+            Encoded image bytes (PNG unless output_format says otherwise).
+            Per-stage timings are left in self.timings.
         """
-        with Timer("Total Generation"):
+        self.timings = timings = {}
+        
+        with Timer("Total Generation", timings, 'total'):
             # Load image
-            with Timer("Image Loading"):
-                image = load_image(image_data)
+            self._report('loading', 0.0)
+            with Timer("Image Loading", timings, 'load'):
+                # Only background removal needs color
+                source = {}
+                image = load_image(image_data, max_side=self.working_size,
+                                   grayscale=not self.remove_bg, info=source)
                 print(f"[Generator] Loaded image: {image.shape[1]}x{image.shape[0]} pixels")
                 warn_if_low_resolution(image)
+            source_shape = source_shape or source['source_shape']
+            
+            mask = self._stencil_mask(image, image_key, style, style_kwargs, timings,
+                                      source_shape=source_shape)
+            self.last_mask = mask
             
-            # Ensure minimum resolution
-            image = ensure_minimum_resolution(image, min_size=1024)
+            # Color, invert, flip and encode (PNG by default)
+            self._report('encoding', 0.95)
+            with Timer("Encoding", timings, 'encode'):
+                result = self.render(mask)
+            self._report('done', 1.0)
+            
+            print(f"[Generator] ✅ Stencil created: {len(result)} bytes")
+            return result
+    
+    def _stencil_mask(self,
+                      image: np.ndarray,
+                      image_key: Optional[str],
+                      style: str,
+                      style_kwargs: dict,
+                      timings: dict,
+                      grays: Optional[dict] = None,
+                      graphs: Optional[dict] = None,
+                      source_shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Run preprocessing, style and smoothing for the current settings.
+        
+        Args:
+            image: Decoded BGR image
+            image_key: image_digest() of the image, or None
+            style: Stencil style
+            style_kwargs: Additional style parameters
+            timings: Dict receiving per-stage timings and cache outcomes
+            grays: Optional dict shared across calls (e.g. a batch) that
+                memoizes preprocessed grayscale images by their cache key
+            graphs: Optional dict shared across calls that holds one
+                StageGraph per grayscale cache key, so styles of a batch
+                share their common smoothing/Canny/contour stages
+            source_shape: (height, width) of the image at full resolution
+                (default: the decoded image's shape)
+            
+        Returns:
+            Smoothed binary stencil mask (255 = lines)
+        """
+        # Preprocessed grayscale depends only on the image and contrast,
+        # contour geometry additionally on the style - not on thickness
+        gray_key = None
+        geometry_key = None
+        gray = None
+        geometry = None
+        if self.gray_cache is not None or self.geometry_cache is not None or grays is not None:
+            gray_key = (image_key or image_digest(image), self.contrast,
+                        self.remove_bg and self.background_engine,
+                        self.denoise_tier, self.working_size, self.smoothing,
+                        PREPROCESS_SETTINGS)
+        if self.geometry_cache is not None:
+            geometry_key = (gray_key, style, freeze(style_kwargs))
+            geometry = self.geometry_cache.get(geometry_key)
+            timings['geometryCache'] = 'hit' if geometry is not None else 'miss'
+        if geometry is None and grays is not None:
+            gray = grays.get(gray_key)
+        if self.gray_cache is not None and geometry is None and gray is None:
+            gray = self.gray_cache.get(gray_key)
+            timings['preprocessCache'] = 'hit' if gray is not None else 'miss'
+        
+        # With a working size, style parameters are scaled to keep their
+        # size relative to the image the legacy pipeline would process, and
+        # the stencil is drawn at the size it would output (capped),
+        # whatever resolution it was built or decoded at
+        legacy_shape = self._legacy_shape(source_shape or image.shape[:2])
+        output_shape = self._output_shape(legacy_shape) if self.working_size else None
+        
+        if geometry is not None:
+            print(f"[Generator] Contour geometry cache hit")
+        elif gray is None:
+            # Ensure minimum (and, with a working size, maximum) resolution
+            if self.working_size:
+                image = fit_working_resolution(image, min_size=1024,
+                                               max_size=self.working_size)
+            else:
+                image = ensure_minimum_resolution(image, min_size=1024)
             
             # Optional background removal
             if self.remove_bg:
-                with Timer("Background Removal"):
-                    image = remove_background(image)
+                self._report('background', 0.05)
+                with Timer("Background Removal", timings, 'background'):
+                    image = remove_background(image, self.background_engine, image_key)
             
             # Preprocessing
-            with Timer("Preprocessing"):
+            self._report('preprocessing', 0.1)
+            with Timer("Preprocessing", timings, 'preprocess'):
                 gray = preprocess_pipeline(
                     image, 
                     contrast=self.contrast,
-                    denoise=True,
-                    denoise_strength=10
+                    denoise_tier=self.denoise_tier,
+                    info=timings,
+                    smoothing=self.smoothing,
+                    **dict(PREPROCESS_SETTINGS)
                 )
             
-            # Generate stencil
-            with Timer(f"Style: {style}"):
-                stencil = generate_stencil(
+            if gray_key is not None:
+                # Shared between requests: guard against in-place edits
+                gray.setflags(write=False)
+            if self.gray_cache is not None:
+                self.gray_cache.put(gray_key, gray)
+            if grays is not None:
+                grays[gray_key] = gray
+        else:
+            print(f"[Generator] Preprocessing cache hit")
+            timings['preprocess'] = 0.0
+        
+        # Generate stencil: extract contour geometry, then draw it at
+        # the requested thickness
+        self._report('style', 0.5)
+        if geometry is None:
+            graph = graphs.get(gray_key) if graphs is not None else None
+            if graph is None:
+                graph = StageGraph()
+                if graphs is not None:
+                    graphs[gray_key] = graph
+            # Per-stage seconds go into this call's timings
+            graph.timings = timings
+            with Timer(f"Style: {style}", timings, 'style'):
+                geometry = extract_geometry(
                     gray,
                     style=style,
-                    thickness=self.thickness,
                     contrast=self.contrast,
+                    scale=(resolution_scale(gray.shape, legacy_shape)
+                           if self.working_size else 1.0),
+                    smoothing=self.smoothing,
+                    graph=graph,
+                    tiles=self.tiles,
                     **style_kwargs
                 )
+            if geometry_key is not None:
+                self.geometry_cache.put(geometry_key, geometry)
+        with Timer("Rasterize", timings, 'rasterize'):
+            stencil = rasterize_geometry(geometry, self.thickness, shape=output_shape)
+        
+        # Post-processing
+        self._report('postprocessing', 0.85)
+        with Timer("Post-processing", timings, 'postprocess'):
+            return smooth_lines(stencil, method='gaussian', strength=0.3)
+    
+    @staticmethod
+    def _legacy_shape(shape: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Size the legacy pipeline processes an input of the given (height,
+        width) at: upscaled to a 1024 px longest side like
+        ensure_minimum_resolution.
+        """
+        h, w = shape
+        longest = max(h, w)
+        if longest >= 1024:
+            return h, w
+        scale = 1024 / longest
+        return max(1, int(h * scale)), max(1, int(w * scale))
+    
+    @staticmethod
+    def _output_shape(shape: Tuple[int, int]) -> Tuple[int, int]:
+        """Stencil size for a legacy-size image (see _legacy_shape), capped at MAX_OUTPUT_SIDE."""
+        h, w = shape
+        longest = max(h, w)
+        if longest <= MAX_OUTPUT_SIDE:
+            return h, w
+        scale = MAX_OUTPUT_SIDE / longest
+        return max(1, int(h * scale)), max(1, int(w * scale))
+    
+    def generate_batch(self,
+                       image_data: Union[str, bytes, np.ndarray],
+                       variants: List[dict],
+                       image_key: Optional[str] = None,
+                       source_shape: Optional[Tuple[int, int]] = None) -> List[bytes]:
+        """
+        Generate several stencils (e.g. one per style) from one image.
+        
+        The image is decoded once and preprocessed once per distinct
+        contrast; each variant then only pays for its style, rasterizing
+        and encoding.
+        
+        Args:
+            image_data: File path (str), image bytes or decoded BGR array
+            variants: Normalized parameter dicts (see apply_params) with a
+                'style' and optional 'style_kwargs'
+            image_key: Precomputed image_digest() of the decoded image
+            source_shape: (height, width) of the image at full resolution
+                (see generate)
             
-            # Post-processing
-            with Timer("Post-processing"):
-                rgba = finalize_stencil(
-                    stencil,
-                    smooth=True,
-                    line_color=self.line_color,
-                    transparent_bg=self.transparent_bg
-                )
-            
-            # Resize to target resolution if specified
-            if self.target_resolution != (0, 0):
-                rgba = resize_for_output(rgba, self.target_resolution, keep_aspect=True)
+        Returns:
+            Encoded stencils in variant order. Stage timings summed over the
+            variants are left in self.timings, the masks in self.last_masks.
+        """
+        self.timings = timings = {}
+        self.last_masks = []
+        results = []
+        callback = self.progress_callback
+        
+        with Timer(f"Batch Generation ({len(variants)} variants)", timings, 'total'):
+            self._report('loading', 0.0)
+            with Timer("Image Loading", timings, 'load'):
+                # Only background removal needs color
+                source = {}
+                image = load_image(image_data, max_side=self.working_size,
+                                   grayscale=not self.remove_bg, info=source)
+                print(f"[Generator] Loaded image: {image.shape[1]}x{image.shape[0]} pixels")
+                warn_if_low_resolution(image)
+            source_shape = source_shape or source['source_shape']
+            image_key = image_key or image_digest(image)
             
-            # Encode to PNG
-            with Timer("Encoding"):
-                result = image_to_bytes(rgba, format='.png')
+            grays = {}
+            graphs = {}
+            try:
+                for index, params in enumerate(variants):
+                    if callback is not None:
+                        # Spread each variant's stages over its share of the batch
+                        self.progress_callback = (
+                            lambda stage, fraction, index=index:
+                            callback(stage, (index + fraction) / len(variants))
+                        )
+                    self.apply_params(params)
+                    style = params.get('style', 'outline')
+                    
+                    variant_timings = {}
+                    mask = self._stencil_mask(image, image_key, style,
+                                              params.get('style_kwargs', {}),
+                                              variant_timings, grays, graphs,
+                                              source_shape)
+                    with Timer("Encoding", variant_timings, 'encode'):
+                        results.append(self.render(mask))
+                    self.last_masks.append(mask)
+                    
+                    for name, value in variant_timings.items():
+                        if isinstance(value, (int, float)):
+                            timings[name] = round(timings.get(name, 0.0) + value, 4)
+                        else:
+                            timings.setdefault(name, value)
+            finally:
+                self.progress_callback = callback
+            self._report('done', 1.0)
+        
+        print(f"[Generator] ✅ Batch of {len(results)} stencils created")
+        return results
+    
+    def render(self, mask: np.ndarray) -> bytes:
+        """
+        Turn a finished stencil mask into encoded output bytes.
+        
+        Applies inversion, flips, line color and background, then encodes.
+        This is the only per-request work needed when just those settings
+        change, so the service can re-render cached masks with it.
+        
+        Args:
+            mask: Smoothed binary stencil (255 = lines)
             
-            print(f"[Generator] ✅ Stencil created: {len(result)} bytes")
-            return result
+        Returns:
+            Encoded image bytes
+        """
+        mask = apply_variant(mask, inverted=self.inverted,
+                             flip_h=self.flip_h, flip_v=self.flip_v)
+        
+        if self.output_format == '.png' and self.target_resolution == (0, 0):
+            result = encode_two_tone_png(mask, line_color=self.line_color,
+                                         transparent_bg=self.transparent_bg)
+            if result is not None:
+                return result
+        
+        rgba = binary_to_rgba(mask, line_color=self.line_color,
+                              transparent_bg=self.transparent_bg)
+        
+        # Resize to target resolution if specified
+        if self.target_resolution != (0, 0):
+            rgba = resize_for_output(rgba, self.target_resolution, keep_aspect=True)
+        
+        return image_to_bytes(rgba, format=self.output_format)
     
     def generate_to_file(self,
                          input_path: str,
@@ -179,11 +538,16 @@ class TattooStencilGenerator:
             True if successful
         """
         # Load and process
-        image = load_image(input_path)
+        image = load_image(input_path, grayscale=True)
         image = ensure_minimum_resolution(image, min_size=1024)
         
-        gray = preprocess_pipeline(image, contrast=self.contrast)
-        stencil = generate_stencil(gray, style=style, thickness=self.thickness, **style_kwargs)
+        gray = preprocess_pipeline(image, contrast=self.contrast,
+                                   denoise_tier=self.denoise_tier,
+                                   smoothing=self.smoothing)
+        geometry = extract_geometry(gray, style=style, contrast=self.contrast,
+                                    smoothing=self.smoothing, tiles=self.tiles,
+                                    **style_kwargs)
+        stencil = rasterize_geometry(geometry, self.thickness)
         
         # Vectorize
         return vectorize_to_svg(stencil, output_path, smooth=True)
@@ -194,10 +558,68 @@ class StencilService:
     """
     HTTP service interface for stencil generation.
     Compatible with the existing index.py service.
+    
+    When a worker pool is given, decoded images are processed in the pool's
+    worker processes; otherwise a fresh in-process generator is used per
+    request so concurrent handler threads never share generator state.
+    
+    Every request passes through a bounded admission queue; when it is full
+    process() raises ServiceBusyError instead of waiting. Identical requests
+    (same decoded image and normalized parameters) are answered from an LRU
+    result cache, or coalesced onto a single pipeline run if one is still
+    in progress. Requests that differ only in render parameters (color,
+    transparency, inversion, flips, format) re-render a cached stencil mask.
     """
     
-    def __init__(self):
-        self.generator = TattooStencilGenerator()
+    def __init__(self, pool=None, max_queue: int = 16,
+                 result_cache_bytes: int = 256 * 1024 * 1024,
+                 gray_cache_bytes: int = 256 * 1024 * 1024,
+                 mask_cache_bytes: int = 128 * 1024 * 1024,
+                 geometry_cache_bytes: int = 64 * 1024 * 1024,
+                 working_size: int = 0,
+                 max_pixels: int = MAX_IMAGE_PIXELS,
+                 max_streamed_pixels: int = MAX_STREAMED_PIXELS,
+                 smoothing: str = DEFAULT_SMOOTHING,
+                 tile_workers: int = 1):
+        """
+        Args:
+            pool: Optional StencilWorkerPool for multi-process serving
+            max_queue: Requests allowed to wait for a free worker
+            result_cache_bytes: Byte budget for cached encoded stencils
+            gray_cache_bytes: Byte budget for preprocessed grayscale images
+                (in-process mode; pool workers keep their own caches)
+            mask_cache_bytes: Byte budget for bit-packed final stencil masks
+            geometry_cache_bytes: Byte budget for extracted contour geometry
+                (in-process mode; pool workers keep their own caches)
+            working_size: Longest side the pipeline works at (0 = input
+                resolution); see TattooStencilGenerator. Also lets JPEGs be
+                decoded at reduced scale.
+            max_pixels: Reject uploads whose header declares more pixels
+            max_streamed_pixels: Higher limit for TIFF/PNG uploads that are
+                decoded in bands at reduced size (needs a working size)
+            smoothing: Edge-preserving smoothing method for every request
+                (see TattooStencilGenerator)
+            tile_workers: Threads for tile-parallel styles on large images
+                (in-process mode; pool workers get their own; 1 = off)
+        """
+        self.pool = pool
+        self.working_size = max(0, int(working_size))
+        self.max_pixels = max_pixels
+        self.max_streamed_pixels = max_streamed_pixels
+        self.smoothing = validate_smoothing(smoothing)
+        self.tiles = (TileExecutor(tile_workers)
+                      if pool is None and tile_workers > 1 else None)
+        self.admission = AdmissionController(
+            max_concurrency=pool.size if pool is not None else 1,
+            max_queue=max_queue
+        )
+        self.coalescer = RequestCoalescer()
+        self.result_cache = ByteBudgetLRU(result_cache_bytes, name='results')
+        self.gray_cache = (ByteBudgetLRU(gray_cache_bytes, name='preprocessed')
+                           if pool is None else None)
+        self.mask_cache = ByteBudgetLRU(mask_cache_bytes, name='masks')
+        self.geometry_cache = (ByteBudgetLRU(geometry_cache_bytes, name='geometry')
+                               if pool is None else None)
     
     def process(self, 
                 image_base64: str,
@@ -206,7 +628,11 @@ class StencilService:
                 contrast: int = 50,
                 inverted: bool = False,
                 line_color: str = '#000000',
-                transparent_bg: bool = False) -> str:
+                transparent_bg: bool = False,
+                timings: Optional[dict] = None,
+                flip_h: bool = False,
+                flip_v: bool = False,
+                denoise_tier: Optional[str] = None) -> str:
         """
         Process base64 image and return base64 stencil.
         
@@ -218,32 +644,354 @@ class StencilService:
             inverted: Whether to invert colors
             line_color: Hex color string for lines (e.g., '#000000' for black)
             transparent_bg: Whether background should be transparent
+            timings: Optional dict filled with per-stage timings
+            flip_h: Mirror the stencil horizontally
+            flip_v: Mirror the stencil vertically
+            denoise_tier: 'draft', 'standard' or 'print' (default: print)
             
         Returns:
             Base64 encoded stencil
+            
+        Raises:
+            ServiceBusyError: If the admission queue is full
         """
-        # Parse hex color to BGR
-        def hex_to_bgr(hex_color: str) -> Tuple[int, int, int]:
-            hex_color = hex_color.lstrip('#')
-            r = int(hex_color[0:2], 16)
-            g = int(hex_color[2:4], 16)
-            b = int(hex_color[4:6], 16)
-            return (b, g, r)  # BGR format for OpenCV
-        
-        # Update generator settings
-        self.generator.thickness = validate_thickness(thickness)
-        self.generator.contrast = validate_contrast(contrast)
-        self.generator.line_color = hex_to_bgr(line_color)
-        self.generator.transparent_bg = transparent_bg
-        
         # Decode input
         image_data = base64_to_bytes(image_base64)
         
-        # Generate
-        result = self.generator.generate(image_data, style=style)
+        result = self.process_image(
+            image_data,
+            style=style,
+            thickness=thickness,
+            contrast=contrast,
+            inverted=inverted,
+            line_color=line_color,
+            transparent_bg=transparent_bg,
+            timings=timings,
+            flip_h=flip_h,
+            flip_v=flip_v,
+            denoise_tier=denoise_tier
+        )
         
         # Return base64
         return bytes_to_base64(result)
+    
+    def process_image(self,
+                      image_data: Union[bytes, bytearray, memoryview, np.ndarray],
+                      style: str = 'outline',
+                      thickness: int = 3,
+                      contrast: int = 50,
+                      inverted: bool = False,
+                      line_color: str = '#000000',
+                      transparent_bg: bool = False,
+                      output_format: str = '.png',
+                      progress: Optional[Callable[[str, float], None]] = None,
+                      bounded: bool = True,
+                      timings: Optional[dict] = None,
+                      flip_h: bool = False,
+                      flip_v: bool = False,
+                      denoise_tier: Optional[str] = None,
+                      abort: Optional[Callable[[], None]] = None) -> bytes:
+        """
+        Process raw image bytes and return encoded stencil bytes.
+        
+        Args:
+            image_data: Encoded image buffer (decoded without copying) or
+                decoded BGR array
+            style: Stencil style
+            thickness: Line thickness
+            contrast: Contrast level
+            inverted: Whether to invert colors
+            line_color: Hex color string for lines
+            transparent_bg: Whether background should be transparent
+            output_format: Output format ('.png', '.jpg', '.webp')
+            progress: Optional (stage, fraction) callback; raising from it
+                aborts the run
+            bounded: Reject instead of queueing when the admission queue is full
+            timings: Optional dict filled with per-stage seconds and cache
+                outcomes ('resultCache', 'maskCache', 'preprocessCache',
+                'coalesced')
+            flip_h: Mirror the stencil horizontally
+            flip_v: Mirror the stencil vertically
+            denoise_tier: 'draft', 'standard' or 'print' (default: print);
+                trades denoising quality for latency
+            abort: Optional check run before decoding and while the request
+                waits for an admission slot or an identical in-flight
+                request (again on every wake()); raising from it gives the
+                request up without running it
+            
+        Returns:
+            Encoded stencil bytes
+            
+        Raises:
+            ServiceBusyError: If the admission queue is full
+            ImageTooLargeError: If the image exceeds the pixel limit
+        """
+        if timings is None:
+            timings = {}
+        if abort is not None:
+            abort()
+        
+        source = {}
+        image = self._decode(image_data, source)
+        params = self._normalize_params(style, thickness, contrast, inverted,
+                                        line_color, transparent_bg, output_format,
+                                        flip_h, flip_v, denoise_tier)
+        params['working_size'] = self.working_size
+        params['smoothing'] = self.smoothing
+        params['source_shape'] = source['source_shape']
+        digest = image_digest(image)
+        key = (digest, tuple(sorted(params.items())))
+        mask_key = self._mask_key(digest, params)
+        
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            print(f"[Stencil Service] Result cache hit")
+            timings['resultCache'] = 'hit'
+            if progress is not None:
+                progress('cached', 1.0)
+            return cached
+        timings['resultCache'] = 'miss'
+        
+        # Only color/invert/flip/transparency/format changed: re-render the
+        # cached mask without touching the pipeline or the admission queue
+        packed = self.mask_cache.get(mask_key)
+        timings['maskCache'] = 'hit' if packed is not None else 'miss'
+        if packed is not None:
+            print(f"[Stencil Service] Mask cache hit, re-rendering")
+            generator = TattooStencilGenerator()
+            generator.apply_params(params)
+            with Timer("Render from mask", timings, 'render'):
+                result = generator.render(unpack_mask(packed))
+            self.result_cache.put(key, result)
+            if progress is not None:
+                progress('cached', 1.0)
+            return result
+        
+        def run():
+            stage_timings = {}
+            result, packed = self._generate(image, digest, params, progress,
+                                            bounded, stage_timings, abort)
+            self.mask_cache.put(mask_key, packed)
+            self.result_cache.put(key, result)
+            return result, stage_timings
+        
+        def on_join():
+            print(f"[Stencil Service] Coalesced with identical in-flight request")
+            timings['coalesced'] = True
+            if progress is not None:
+                progress('coalesced', 0.0)
+        
+        result, stage_timings = self.coalescer.run(key, run, on_join=on_join, abort=abort)
+        timings.update(stage_timings)
+        return result
+    
+    def process_batch(self,
+                      image_data: Union[bytes, bytearray, memoryview, np.ndarray],
+                      variants: List[dict],
+                      progress: Optional[Callable[[str, float], None]] = None,
+                      bounded: bool = True,
+                      timings: Optional[dict] = None) -> List[bytes]:
+        """
+        Generate several stencils from one image in a single pipeline run.
+        
+        Variants already in the result or mask cache are answered from
+        there; the rest share one decode and one preprocessing pass (per
+        distinct contrast) in a single admission slot / worker. Batches are
+        not coalesced with single requests.
+        
+        Args:
+            image_data: Encoded image buffer or decoded BGR array
+            variants: process_image keyword dicts (style, thickness, contrast,
+                inverted, line_color, transparent_bg, output_format, flip_h,
+                flip_v, denoise_tier); missing keys take process_image's defaults
+            progress: Optional (stage, fraction) callback
+            bounded: Reject instead of queueing when the admission queue is full
+            timings: Optional dict filled with stage timings summed over the
+                generated variants, plus 'cachedVariants'
+            
+        Returns:
+            Encoded stencils in variant order
+            
+        Raises:
+            ServiceBusyError: If the admission queue is full
+            ImageTooLargeError: If the image exceeds the pixel limit
+        """
+        if timings is None:
+            timings = {}
+        
+        source = {}
+        image = self._decode(image_data, source)
+        digest = image_digest(image)
+        normalized = [
+            dict(self._normalize_params(**{**BATCH_DEFAULTS, **variant}),
+                 working_size=self.working_size, smoothing=self.smoothing,
+                 source_shape=source['source_shape'])
+            for variant in variants
+        ]
+        keys = [(digest, tuple(sorted(params.items()))) for params in normalized]
+        
+        results: List[Optional[bytes]] = [None] * len(normalized)
+        pending = []
+        for index, (params, key) in enumerate(zip(normalized, keys)):
+            results[index] = self.result_cache.get(key)
+            if results[index] is not None:
+                continue
+            packed = self.mask_cache.get(self._mask_key(digest, params))
+            if packed is None:
+                pending.append(index)
+                continue
+            generator = TattooStencilGenerator()
+            generator.apply_params(params)
+            results[index] = generator.render(unpack_mask(packed))
+            self.result_cache.put(key, results[index])
+        timings['cachedVariants'] = len(normalized) - len(pending)
+        
+        if pending:
+            batch = [normalized[index] for index in pending]
+            outputs, masks = self._generate_batch(image, digest, batch, progress,
+                                                  bounded, timings, source['source_shape'])
+            for index, result, packed in zip(pending, outputs, masks):
+                self.result_cache.put(keys[index], result)
+                self.mask_cache.put(self._mask_key(digest, normalized[index]), packed)
+                results[index] = result
+        elif progress is not None:
+            progress('cached', 1.0)
+        
+        return results
+    
+    def _generate_batch(self, image: np.ndarray, digest: str, batch: List[dict],
+                        progress, bounded: bool, timings: dict,
+                        source_shape: Tuple[int, int]):
+        """
+        Run the uncached variants of a batch once admitted.
+        
+        Returns:
+            (encoded stencils, packed masks), both in batch order
+        """
+        with self.admission.admit(bounded=bounded):
+            if progress is not None:
+                progress('admitted', 0.0)
+            
+            if self.pool is not None:
+                return self.pool.generate(
+                    image,
+                    progress=progress,
+                    timings=timings,
+                    return_mask=True,
+                    image_key=digest,
+                    source_shape=source_shape,
+                    variants=batch
+                )
+            
+            generator = TattooStencilGenerator(
+                progress_callback=progress,
+                gray_cache=self.gray_cache,
+                geometry_cache=self.geometry_cache,
+                tiles=self.tiles
+            )
+            try:
+                results = generator.generate_batch(image, batch, image_key=digest,
+                                                   source_shape=source_shape)
+                return results, [pack_mask(mask) for mask in generator.last_masks]
+            finally:
+                timings.update(generator.timings)
+    
+    def _decode(self, image_data, info: Optional[dict] = None) -> np.ndarray:
+        """
+        Decode an upload for the service pipeline: header-checked against
+        the pixel limit, straight to grayscale (no service request needs
+        color), at reduced JPEG scale or band by band for large TIFF/PNG
+        scans when the working size allows. The full-resolution shape goes
+        into info['source_shape'] (see load_image).
+        """
+        return load_image(image_data, max_pixels=self.max_pixels,
+                          max_side=self.working_size, grayscale=True,
+                          max_streamed_pixels=self.max_streamed_pixels,
+                          info=info)
+    
+    @staticmethod
+    def _mask_key(digest: str, params: dict) -> tuple:
+        """Cache key for the stencil mask: everything except render params."""
+        geometry = tuple(sorted(
+            (name, value) for name, value in params.items()
+            if name not in RENDER_PARAMS
+        ))
+        return (digest, geometry, PREPROCESS_SETTINGS)
+    
+    @staticmethod
+    def _normalize_params(style, thickness, contrast, inverted,
+                          line_color, transparent_bg, output_format,
+                          flip_h=False, flip_v=False, denoise_tier=None) -> dict:
+        """
+        Canonical request parameters, as the pipeline will interpret them.
+        
+        Thickness and contrast are rounded and clamped to the values
+        validate_thickness/validate_contrast allow, so requests that render
+        identically share cache and coalescing keys.
+        """
+        return {
+            'style': style if style in STYLE_FUNCTIONS else 'outline',
+            'thickness': validate_thickness(int(round(float(thickness)))),
+            'contrast': validate_contrast(int(round(float(contrast)))),
+            'inverted': bool(inverted),
+            'line_color': hex_to_bgr(line_color),
+            'transparent_bg': bool(transparent_bg),
+            'output_format': validate_output_format(output_format),
+            'flip_h': bool(flip_h),
+            'flip_v': bool(flip_v),
+            'denoise_tier': validate_denoise_tier(denoise_tier),
+        }
+    
+    def _generate(self, image: np.ndarray, digest: str, params: dict,
+                  progress: Optional[Callable[[str, float], None]],
+                  bounded: bool, timings: dict,
+                  abort: Optional[Callable[[], None]] = None) -> Tuple[bytes, tuple]:
+        """
+        Run the pipeline for one (coalesced) request once admitted.
+        
+        Returns:
+            (encoded stencil, packed stencil mask)
+        """
+        with self.admission.admit(bounded=bounded, abort=abort):
+            if progress is not None:
+                progress('admitted', 0.0)
+            
+            if self.pool is not None:
+                return self.pool.generate(
+                    image,
+                    progress=progress,
+                    timings=timings,
+                    return_mask=True,
+                    image_key=digest,
+                    **params
+                )
+            
+            generator = TattooStencilGenerator(
+                progress_callback=progress,
+                gray_cache=self.gray_cache,
+                geometry_cache=self.geometry_cache,
+                tiles=self.tiles
+            )
+            generator.apply_params(params)
+            try:
+                result = generator.generate(image, style=params['style'], image_key=digest,
+                                            source_shape=params['source_shape'])
+                return result, pack_mask(generator.last_mask)
+            finally:
+                timings.update(generator.timings)
+    
+    def wake(self):
+        """
+        Wake requests waiting for admission or for an identical in-flight
+        request, so they re-run their abort checks (e.g. after a cancel).
+        """
+        self.admission.wake()
+        self.coalescer.wake()
+    
+    def close(self):
+        """Shut down the worker pool, if any."""
+        if self.pool is not None:
+            self.pool.close()
 
 
 # Convenience function for direct import
@@ -300,6 +1048,19 @@ Examples:
                         default='none', help='Target resolution')
     parser.add_argument('--remove-bg', action='store_true',
                         help='Remove background')
+    parser.add_argument('--bg-engine', choices=list(BACKGROUND_ENGINES),
+                        default=DEFAULT_BACKGROUND_ENGINE,
+                        help='Background removal engine (local needs no model download)')
+    parser.add_argument('--working-size', type=int, default=0,
+                        help='Process at most at this longest side (0 = full resolution)')
+    parser.add_argument('--denoise', choices=list(DENOISE_TIERS),
+                        default=DEFAULT_DENOISE_TIER,
+                        help='Denoising tier (draft is fastest, print is best)')
+    parser.add_argument('--smoothing', choices=list(SMOOTHING_METHODS),
+                        default=DEFAULT_SMOOTHING,
+                        help='Edge-preserving smoothing (grid is constant-time in the filter size)')
+    parser.add_argument('--tile-workers', type=int, default=0,
+                        help='Threads for tile-parallel styles on large images (0 = CPU count, 1 = off)')
     parser.add_argument('--vector', action='store_true',
                         help='Output as SVG instead of PNG')
     
@@ -320,7 +1081,12 @@ Examples:
         thickness=args.thickness,
         contrast=args.contrast,
         remove_bg=args.remove_bg,
-        upscale=args.upscale
+        upscale=args.upscale,
+        denoise_tier=args.denoise,
+        working_size=args.working_size,
+        smoothing=args.smoothing,
+        background_engine=args.bg_engine,
+        tiles=TileExecutor(args.tile_workers or None)
     )
     
     # Style-specific kwargs
@@ -6,10 +6,18 @@ BOTH Hatching and Solid: INVERTED (white on black) with better Solid algorithm.
 
 import cv2
 import numpy as np
-from typing import List
+from typing import List, NamedTuple, Optional, Tuple
 import warnings
 warnings.filterwarnings('ignore')
 
+from preprocessing import smooth_edges, smoothing_footprint
+from stage_graph import Stage, StageGraph
+from pyramid import ImagePyramid
+from tiles import TileExecutor
+from edges import EdgeMaps
+from posterize import Posterization
+from hatch import HatchLayer, hatch
+
 
 def remove_small_objects(binary: np.ndarray, min_size: int = 10) -> np.ndarray:
     """Remove small disconnected objects."""
@@ -22,166 +30,393 @@ def remove_small_objects(binary: np.ndarray, min_size: int = 10) -> np.ndarray:
 
 
 # =============================================================================
-# STYLE FUNCTIONS
+# CONTOUR GEOMETRY
 # =============================================================================
 
-def generate_outline(gray: np.ndarray, thickness: int = 2, contrast: int = 50) -> np.ndarray:
+class ContourSet(NamedTuple):
+    """
+    Filtered contours of one pass, flattened into compact int32 arrays.
+    
+    Contour i is points[starts[i]:starts[i + 1]]. The set is drawn at the
+    requested thickness plus thickness_offset (never thinner than 1 px).
+    """
+    points: np.ndarray       # (N, 2) int32
+    starts: np.ndarray       # (K + 1,) int32
+    thickness_offset: int = 0
+
+
+class StencilGeometry(NamedTuple):
+    """
+    Thickness-independent result of a style: everything needed to draw the
+    stencil at any line thickness without rerunning filtering and Canny.
+    """
+    shape: Tuple[int, int]
+    base: Optional[np.ndarray]          # pre-drawn pixels (e.g. hatch lines)
+    contour_sets: Tuple[ContourSet, ...]
+
+
+def pack_contours(contours, min_area: float, thickness_offset: int = 0) -> ContourSet:
+    """Keep contours with area >= min_area and pack them into a ContourSet."""
+    kept = [cnt.reshape(-1, 2) for cnt in contours if cv2.contourArea(cnt) >= min_area]
+    lengths = np.fromiter((len(c) for c in kept), dtype=np.int32, count=len(kept))
+    starts = np.zeros(len(kept) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=starts[1:])
+    points = (np.concatenate(kept).astype(np.int32, copy=False) if kept
+              else np.empty((0, 2), dtype=np.int32))
+    return ContourSet(points, starts, thickness_offset)
+
+
+def rasterize_geometry(geometry: StencilGeometry, thickness: int,
+                       shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    Draw a style's geometry at the given line thickness.
+    
+    Args:
+        geometry: Result of extract_geometry()
+        thickness: Line thickness in output pixels
+        shape: Output (height, width); defaults to the geometry's own
+            resolution. Contours are rescaled and drawn directly at this
+            size, so lines stay crisp and thickness is in output pixels.
+    """
+    shape = tuple(shape or geometry.shape)
+    if shape == tuple(geometry.shape):
+        output = (geometry.base.copy() if geometry.base is not None
+                  else np.zeros(shape, dtype=np.uint8))
+        factors = None
+    else:
+        output = (cv2.resize(geometry.base, (shape[1], shape[0]),
+                             interpolation=cv2.INTER_NEAREST)
+                  if geometry.base is not None else np.zeros(shape, dtype=np.uint8))
+        factors = np.array([shape[1] / geometry.shape[1],
+                            shape[0] / geometry.shape[0]], dtype=np.float32)
+    
+    for contour_set in geometry.contour_sets:
+        if len(contour_set.starts) < 2:
+            continue
+        points = contour_set.points
+        if factors is not None:
+            points = np.rint(points * factors).astype(np.int32)
+        contours = np.split(points, contour_set.starts[1:-1])
+        cv2.drawContours(output, contours, -1, 255,
+                         max(1, thickness + contour_set.thickness_offset), cv2.LINE_AA)
+    return output
+
+
+# =============================================================================
+# RESOLUTION SCALING
+# =============================================================================
+
+def resolution_scale(shape: Tuple[int, ...], reference_shape: Tuple[int, ...]) -> float:
+    """
+    Style parameter scale for processing at `shape` an image the styles
+    would otherwise see at `reference_shape` (its size in the unscaled
+    pipeline). Kernels, thresholds, area filters and spacing then keep
+    their size relative to the image; 1.0 if it wasn't downscaled.
+    """
+    return max(shape[:2]) / max(reference_shape[:2])
+
+
+def _ksize(size: int, scale: float) -> int:
+    """Odd kernel size/diameter scaled to the working resolution."""
+    return max(1, int(round(size * scale)) | 1)
+
+
+def _area(area: float, scale: float) -> float:
+    """
+    Contour-area filter scaled to the working resolution. Linearly: most
+    contours are traced around thin Canny chains, whose area grows with
+    their length rather than its square.
+    """
+    return area * scale
+
+
+def _smooth(gray: np.ndarray, size: int, scale: float, method: Optional[str],
+            tiles: Optional[TileExecutor] = None) -> np.ndarray:
+    """
+    Edge-preserving smoothing with a diameter scaled to the working
+    resolution; tile-parallel on large images when given an executor.
+    """
+    d = _ksize(size, scale)
+    if tiles is not None:
+        halo, align = smoothing_footprint(d, 75 * scale, method)
+        return tiles.map(smooth_edges, gray, halo, align, d=d, sigma_color=75,
+                         sigma_space=75 * scale, method=method)
+    return smooth_edges(gray, d, 75, 75 * scale, method=method)
+
+
+def _canny(gradients: EdgeMaps, low: float, high: float, scale: float) -> np.ndarray:
+    """
+    Canny edges of a smoothed image, from its shared gradients. Edges of
+    the same feature are spread over `scale` times more pixels at higher
+    resolution, so gradients (and the thresholds) shrink by the same factor.
+    """
+    return gradients.hysteresis(low / scale, high / scale)
+
+
+# =============================================================================
+# STYLE GEOMETRY EXTRACTION
+# =============================================================================
+# Styles are declared as StageGraph stages: with a graph shared across the
+# styles of a batch, common smoothing, Canny and contour passes run once.
+
+def _find_contours(edges: np.ndarray, mode: int) -> tuple:
+    """Contours of a binary edge map (simple chain approximation)."""
+    return cv2.findContours(edges, mode, cv2.CHAIN_APPROX_SIMPLE)[0]
+
+
+def _union(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pixel-wise OR of two edge maps."""
+    return cv2.bitwise_or(a, b)
+
+
+def _smoothed(graph: StageGraph, gray: np.ndarray, size: int, scale: float,
+              smoothing: Optional[str], tiles: Optional[TileExecutor]) -> Stage:
+    """Stage: edge-preserving smoothing of the preprocessed image."""
+    return graph.add('smooth', _smooth, graph.source('gray', gray),
+                     size=size, scale=scale, method=smoothing, tiles=tiles)
+
+
+def _subject_mask(edges: np.ndarray, pyramid: ImagePyramid, scale: float) -> np.ndarray:
+    """
+    Filled, slightly eroded area enclosed by the dilated edges.
+    
+    Only the rough silhouette matters, so it is built at the coarsest
+    pyramid level the dilation (3 x 15 px at scale 1) resolves.
+    """
+    # Repeated square dilations/erosions equal one with a larger square
+    dilate_size = 3 * (_ksize(15, scale) - 1) + 1
+    erode_size = 2 * (_ksize(7, scale) - 1) + 1
+    level = pyramid.level_for(erode_size / 2)
+    factor = 2 ** level
+    
+    small_edges = pyramid.reduce(edges, level, mode='max')
+    edges_dilated = cv2.dilate(small_edges, np.ones((_ksize(dilate_size, 1 / factor),) * 2, np.uint8))
+    contours_mask, _ = cv2.findContours(edges_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    subject_mask = np.zeros(small_edges.shape, dtype=np.uint8)
+    cv2.drawContours(subject_mask, contours_mask, -1, 255, -1)
+    subject_mask = cv2.erode(subject_mask, np.ones((_ksize(erode_size, 1 / factor),) * 2, np.uint8))
+    return pyramid.expand(subject_mask, level, mode='mask')
+
+
+def _darkness_map(pyramid: ImagePyramid, scale: float) -> np.ndarray:
+    """
+    Blurred darkness (0-1) of the smoothed image.
+    
+    Blurred at a coarse pyramid level and upsampled guided by the smoothed
+    image, so hatching gated by it stops at tonal edges instead of bleeding
+    across them.
+    """
+    sigma = 5 * scale
+    level = pyramid.level_for(sigma, min_radius=1.5)
+    factor = 2 ** level
+    small = pyramid.level(level).astype(np.float32)
+    small = cv2.GaussianBlur(small, (_ksize(15, scale / factor),) * 2, sigma / factor)
+    return 1.0 - pyramid.expand(small, level, mode='guided', eps=200.0) / 255.0
+
+
+def _draw_hatching(subject_mask: np.ndarray, darkness_norm: np.ndarray,
+                   density: int, scale: float,
+                   angles: Optional[Tuple[float, ...]] = None) -> np.ndarray:
+    """
+    Hatch pixels inside the subject (WHITE on a BLACK background).
+    
+    The first angle hatches everything darker than 0.25; further angles
+    cross it, more tightly, where darkness exceeds 0.45. By default that
+    is '\\' alone, with '/' crossing from density 4.
+    """
+    if not angles:
+        angles = (135.0,) if density < 4 else (135.0, 45.0)
+    # Spacing as measured along a row for the original 45-degree lines
+    spacing = max(1, int(round(max(10, 22 - density * 2) * scale))) / np.sqrt(2)
+    width = max(1.0, scale)
+    layers = [HatchLayer(angles[0], spacing, 0.25, width)]
+    layers += [HatchLayer(angle, max(1.0, spacing * 0.65), 0.45, width) for angle in angles[1:]]
+    return hatch(subject_mask.shape, layers, darkness_norm, subject_mask)
+
+
+def _level_contours(posterization: Posterization) -> tuple:
+    """Contours along every posterization level, traced in one pass."""
+    return posterization.contours()
+
+
+def _solid_fill(posterization: Posterization, min_area: float) -> np.ndarray:
+    """Darkest posterization band, filled solid, without specks."""
+    return posterization.region_mask((0,), min_area)
+
+
+def extract_outline(gray: np.ndarray, contrast: int = 50, scale: float = 1.0,
+                    smoothing: Optional[str] = None,
+                    graph: Optional[StageGraph] = None,
+                    tiles: Optional[TileExecutor] = None) -> StencilGeometry:
     """Outline style - Clean edge contours (black on white)."""
-    h, w = gray.shape
-    smooth = cv2.bilateralFilter(gray, 11, 75, 75)
-    edges = cv2.Canny(smooth, 30, 90)
-    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    result = np.zeros((h, w), dtype=np.uint8)
-    for cnt in contours:
-        if cv2.contourArea(cnt) >= 8:
-            cv2.drawContours(result, [cnt], -1, 255, thickness, cv2.LINE_AA)
-    return result
+    graph = graph or StageGraph()
+    smooth = _smoothed(graph, gray, 11, scale, smoothing, tiles)
+    gradients = graph.add('gradients', EdgeMaps, smooth, tiles=tiles)
+    edges = graph.add('canny', _canny, gradients, low=30, high=90, scale=scale)
+    contours = graph.run(graph.add('contours', _find_contours, edges, mode=cv2.RETR_LIST))
+    return StencilGeometry(gray.shape, None, (pack_contours(contours, _area(8, scale)),))
 
 
-def generate_simple(gray: np.ndarray, thickness: int = 2, contrast: int = 50) -> np.ndarray:
+def extract_simple(gray: np.ndarray, contrast: int = 50, scale: float = 1.0,
+                   smoothing: Optional[str] = None,
+                   graph: Optional[StageGraph] = None,
+                   tiles: Optional[TileExecutor] = None) -> StencilGeometry:
     """Simple style - Clear contours only (black on white)."""
-    smooth = cv2.bilateralFilter(gray, 13, 75, 75)
-    blur = cv2.GaussianBlur(smooth, (7, 7), 2)
-    edges = cv2.Canny(blur, 20, 60)
-    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    result = np.zeros(gray.shape, dtype=np.uint8)
-    for cnt in contours:
-        if cv2.contourArea(cnt) >= 20:
-            cv2.drawContours(result, [cnt], -1, 255, thickness, cv2.LINE_AA)
-    return result
+    graph = graph or StageGraph()
+    smooth = _smoothed(graph, gray, 13, scale, smoothing, tiles)
+    blur = graph.add('blur', cv2.GaussianBlur, smooth, ksize=(_ksize(7, scale),) * 2,
+                     sigmaX=2 * scale)
+    gradients = graph.add('gradients', EdgeMaps, blur, tiles=tiles)
+    edges = graph.add('canny', _canny, gradients, low=20, high=60, scale=scale)
+    contours = graph.run(graph.add('contours', _find_contours, edges, mode=cv2.RETR_EXTERNAL))
+    return StencilGeometry(gray.shape, None, (pack_contours(contours, _area(20, scale)),))
 
 
-def generate_detailed(gray: np.ndarray, thickness: int = 1, contrast: int = 50) -> np.ndarray:
+def extract_detailed(gray: np.ndarray, contrast: int = 50, scale: float = 1.0,
+                     smoothing: Optional[str] = None,
+                     graph: Optional[StageGraph] = None,
+                     tiles: Optional[TileExecutor] = None) -> StencilGeometry:
     """Detailed style - Fine edges (black on white)."""
-    smooth = cv2.bilateralFilter(gray, 9, 75, 75)
-    edges1 = cv2.Canny(smooth, 30, 90)
-    edges2 = cv2.Canny(smooth, 50, 150)
-    edges = cv2.bitwise_or(edges1, edges2)
-    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    result = np.zeros(gray.shape, dtype=np.uint8)
-    for cnt in contours:
-        if cv2.contourArea(cnt) >= 5:
-            cv2.drawContours(result, [cnt], -1, 255, thickness, cv2.LINE_AA)
-    return result
+    graph = graph or StageGraph()
+    smooth = _smoothed(graph, gray, 9, scale, smoothing, tiles)
+    gradients = graph.add('gradients', EdgeMaps, smooth, tiles=tiles)
+    edges1 = graph.add('canny', _canny, gradients, low=30, high=90, scale=scale)
+    edges2 = graph.add('canny', _canny, gradients, low=50, high=150, scale=scale)
+    edges = graph.add('union', _union, edges1, edges2)
+    contours = graph.run(graph.add('contours', _find_contours, edges, mode=cv2.RETR_LIST))
+    return StencilGeometry(gray.shape, None, (pack_contours(contours, _area(5, scale)),))
 
 
-def generate_hatching(gray: np.ndarray, thickness: int = 1, contrast: int = 50, density: int = 6) -> np.ndarray:
+def extract_hatching(gray: np.ndarray, contrast: int = 50, density: int = 6,
+                     angles: Optional[Tuple[float, ...]] = None,
+                     scale: float = 1.0, smoothing: Optional[str] = None,
+                     graph: Optional[StageGraph] = None,
+                     tiles: Optional[TileExecutor] = None) -> StencilGeometry:
     """
     Hatching style - INVERTED (white lines on black background).
     Quality: 7/10
-    """
-    h, w = gray.shape
-    output = np.zeros((h, w), dtype=np.uint8)  # BLACK background
     
-    smooth = cv2.bilateralFilter(gray, 11, 75, 75)
+    angles: Hatch directions in degrees, counter-clockwise from horizontal
+    (default: 135, crossed at 45 from density 4).
+    """
+    graph = graph or StageGraph()
+    smooth = _smoothed(graph, gray, 11, scale, smoothing, tiles)
+    gradients = graph.add('gradients', EdgeMaps, smooth, tiles=tiles)
     
     # Get edges
-    edges_fine = cv2.Canny(smooth, 25, 75)
-    edges_detail = cv2.Canny(smooth, 40, 120)
-    edges = cv2.bitwise_or(edges_fine, edges_detail)
+    edges_fine = graph.add('canny', _canny, gradients, low=25, high=75, scale=scale)
+    edges_detail = graph.add('canny', _canny, gradients, low=40, high=120, scale=scale)
+    edges = graph.add('union', _union, edges_fine, edges_detail)
     
-    # Subject mask
-    edges_dilated = cv2.dilate(edges, np.ones((15, 15), np.uint8), iterations=3)
-    contours_mask, _ = cv2.findContours(edges_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    subject_mask = np.zeros((h, w), dtype=np.uint8)
-    cv2.drawContours(subject_mask, contours_mask, -1, 255, -1)
-    subject_mask = cv2.erode(subject_mask, np.ones((7, 7), np.uint8), iterations=2)
-    
-    # Darkness map
-    darkness = 255.0 - smooth.astype(np.float64)
-    darkness = cv2.GaussianBlur(darkness, (15, 15), 5)
-    darkness_norm = darkness / 255.0
-    
-    # Diagonal hatching (WHITE)
-    spacing = max(10, 22 - density * 2)
-    
-    for offset in range(-max(h, w), max(h, w), spacing):
-        for t in np.linspace(0, 1, 120):
-            x = int(offset + t * h)
-            y = int(t * h)
-            if 0 <= x < w and 0 <= y < h and subject_mask[y, x] > 0:
-                if darkness_norm[y, x] > 0.25:
-                    output[y, x] = 255
-    
-    # Cross-hatching
-    if density >= 4:
-        spacing2 = int(spacing * 0.65)
-        for offset in range(-max(h, w), max(h, w), spacing2):
-            for t in np.linspace(0, 1, 120):
-                x = int(w - offset + t * h)
-                y = int(t * h)
-                if 0 <= x < w and 0 <= y < h and subject_mask[y, x] > 0:
-                    if darkness_norm[y, x] > 0.45:
-                        output[y, x] = 255
-    
-    # Edge contours (WHITE)
-    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    for cnt in contours:
-        if cv2.contourArea(cnt) >= 5:
-            cv2.drawContours(output, [cnt], -1, 255, max(1, thickness), cv2.LINE_AA)
-    
-    # Main contours
-    main_edges = cv2.Canny(smooth, 20, 60)
-    main_contours, _ = cv2.findContours(main_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    for cnt in main_contours:
-        if cv2.contourArea(cnt) >= 30:
-            cv2.drawContours(output, [cnt], -1, 255, max(1, thickness + 1), cv2.LINE_AA)
+    # Subject mask and darkness gate the hatch lines; both are coarse, so
+    # they are computed on the smoothed image's pyramid
+    pyramid = graph.add('pyramid', ImagePyramid, smooth)
+    subject_mask = graph.add('subjectMask', _subject_mask, edges, pyramid, scale=scale)
+    darkness = graph.add('darkness', _darkness_map, pyramid, scale=scale)
+    hatching = graph.add('hatch', _draw_hatching, subject_mask, darkness,
+                         density=density, scale=scale,
+                         angles=tuple(angles) if angles else None)
     
-    return output
+    # Edge contours (WHITE), main contours drawn one pixel heavier
+    contours = graph.add('contours', _find_contours, edges, mode=cv2.RETR_LIST)
+    main_edges = graph.add('canny', _canny, gradients, low=20, high=60, scale=scale)
+    main_contours = graph.add('contours', _find_contours, main_edges, mode=cv2.RETR_EXTERNAL)
+    
+    output, contours, main_contours = graph.run(hatching, contours, main_contours)
+    return StencilGeometry(gray.shape, output, (
+        pack_contours(contours, _area(5, scale)),
+        pack_contours(main_contours, _area(30, scale), thickness_offset=1),
+    ))
 
 
-def generate_solid(gray: np.ndarray, thickness: int = 1, contrast: int = 50, levels: int = 4, fill_areas: bool = True) -> np.ndarray:
+def extract_solid(gray: np.ndarray, contrast: int = 50, levels: int = 4, fill_areas: bool = False,
+                  scale: float = 1.0, smoothing: Optional[str] = None,
+                  graph: Optional[StageGraph] = None,
+                  tiles: Optional[TileExecutor] = None) -> StencilGeometry:
     """
     Solid style - INVERTED (white on black).
     
     Better approach: Use clean contour lines instead of fills for better subject preservation.
+    With fill_areas, the darkest posterization band is also filled solid.
     """
-    h, w = gray.shape
-    # BLACK background (inverted)
-    output = np.zeros((h, w), dtype=np.uint8)
-    
-    smooth = cv2.bilateralFilter(gray, 11, 75, 75)
+    graph = graph or StageGraph()
+    smooth = _smoothed(graph, gray, 11, scale, smoothing, tiles)
+    gradients = graph.add('gradients', EdgeMaps, smooth, tiles=tiles)
     
-    # Step 1: Get main subject contours
-    main_edges = cv2.Canny(smooth, 20, 60)
-    main_contours, _ = cv2.findContours(main_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # Draw main contours (WHITE)
-    for cnt in main_contours:
-        if cv2.contourArea(cnt) >= 20:
-            cv2.drawContours(output, [cnt], -1, 255, thickness + 1, cv2.LINE_AA)
+    # Step 1: Get main subject contours (drawn one pixel heavier)
+    main_edges = graph.add('canny', _canny, gradients, low=20, high=60, scale=scale)
+    main_contours = graph.add('contours', _find_contours, main_edges, mode=cv2.RETR_EXTERNAL)
     
     # Step 2: Get detailed edges
-    edges_detail = cv2.Canny(smooth, 30, 90)
-    contours_detail, _ = cv2.findContours(edges_detail, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # Draw detailed contours (WHITE)
-    for cnt in contours_detail:
-        if cv2.contourArea(cnt) >= 8:
-            cv2.drawContours(output, [cnt], -1, 255, thickness, cv2.LINE_AA)
+    edges_detail = graph.add('canny', _canny, gradients, low=30, high=90, scale=scale)
+    contours_detail = graph.add('contours', _find_contours, edges_detail, mode=cv2.RETR_LIST)
     
-    # Step 3: Add posterization-based contour lines (not fills)
-    blur = cv2.GaussianBlur(smooth, (7, 7), 2)
+    # Step 3: Add posterization-based contour lines (not fills), one pixel
+    # lighter; all levels come from one quantization pass
+    blur = graph.add('blur', cv2.GaussianBlur, smooth, ksize=(_ksize(7, scale),) * 2,
+                     sigmaX=2 * scale)
     step = 256.0 / levels
+    # Level k is the region brighter than int(k * step)
+    thresholds = tuple(int(level * step) + 1 for level in range(1, levels))
+    posterization = graph.add('posterize', Posterization, blur, thresholds=thresholds)
+    level_contours = graph.add('levelContours', _level_contours, posterization)
     
-    for level in range(1, levels):
-        threshold = int(level * step)
-        # Get edges at this threshold level
-        _, level_binary = cv2.threshold(blur, threshold, 255, cv2.THRESH_BINARY)
-        level_edges = cv2.Canny(level_binary, 50, 150)
-        level_contours, _ = cv2.findContours(level_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        for cnt in level_contours:
-            if cv2.contourArea(cnt) >= 15:
-                cv2.drawContours(output, [cnt], -1, 255, max(1, thickness - 1), cv2.LINE_AA)
+    main_contours, contours_detail, level_contours = graph.run(
+        main_contours, contours_detail, level_contours)
+    fill = (graph.run(graph.add('solidFill', _solid_fill, posterization,
+                                min_area=_area(15, scale)))
+            if fill_areas else None)
+    contour_sets = (pack_contours(main_contours, _area(20, scale), thickness_offset=1),
+                    pack_contours(contours_detail, _area(8, scale)),
+                    pack_contours(level_contours, _area(15, scale), thickness_offset=-1))
     
-    return output
+    return StencilGeometry(gray.shape, fill, contour_sets)
+
+
+# =============================================================================
+# STYLE FUNCTIONS
+# =============================================================================
+
+def generate_outline(gray: np.ndarray, thickness: int = 2, contrast: int = 50) -> np.ndarray:
+    """Outline style - Clean edge contours (black on white)."""
+    return rasterize_geometry(extract_outline(gray, contrast), thickness)
+
+
+def generate_simple(gray: np.ndarray, thickness: int = 2, contrast: int = 50) -> np.ndarray:
+    """Simple style - Clear contours only (black on white)."""
+    return rasterize_geometry(extract_simple(gray, contrast), thickness)
+
+
+def generate_detailed(gray: np.ndarray, thickness: int = 1, contrast: int = 50) -> np.ndarray:
+    """Detailed style - Fine edges (black on white)."""
+    return rasterize_geometry(extract_detailed(gray, contrast), thickness)
+
+
+def generate_hatching(gray: np.ndarray, thickness: int = 1, contrast: int = 50, density: int = 6,
+                      angles: Optional[Tuple[float, ...]] = None) -> np.ndarray:
+    """Hatching style - INVERTED (white lines on black background)."""
+    return rasterize_geometry(extract_hatching(gray, contrast, density=density, angles=angles), thickness)
+
+
+def generate_solid(gray: np.ndarray, thickness: int = 1, contrast: int = 50, levels: int = 4, fill_areas: bool = False) -> np.ndarray:
+    """Solid style - INVERTED (white on black)."""
+    return rasterize_geometry(
+        extract_solid(gray, contrast, levels=levels, fill_areas=fill_areas), thickness
+    )
 
 
 # =============================================================================
 # STYLE DISPATCHER
 # =============================================================================
 
+STYLE_EXTRACTORS = {
+    'outline': extract_outline,
+    'simple': extract_simple,
+    'detailed': extract_detailed,
+    'hatching': extract_hatching,
+    'solid': extract_solid,
+}
+
 STYLE_FUNCTIONS = {
     'outline': generate_outline,
     'simple': generate_simple,
@@ -195,3 +430,30 @@ def generate_stencil(gray: np.ndarray, style: str = 'outline', thickness: int =
     """Generate stencil in specified style."""
     func = STYLE_FUNCTIONS.get(style, generate_outline)
     return func(gray, thickness=thickness, contrast=contrast, **kwargs)
+
+
+def extract_geometry(gray: np.ndarray, style: str = 'outline', contrast: int = 50,
+                     scale: float = 1.0, smoothing: Optional[str] = None,
+                     graph: Optional[StageGraph] = None, **kwargs) -> StencilGeometry:
+    """
+    Run a style up to (not including) drawing its contours.
+    
+    The result can be rasterized at any thickness (and output size) with
+    rasterize_geometry, which is what a thickness-only change needs.
+    
+    Args:
+        gray: Preprocessed grayscale image
+        style: Style name (see STYLE_EXTRACTORS)
+        contrast: Contrast level
+        scale: Scale of kernels, thresholds, area filters and spacing
+            (see resolution_scale); 1.0 keeps the tuned pixel values
+        smoothing: Edge-preserving smoothing method (see
+            preprocessing.SMOOTHING_METHODS)
+        graph: StageGraph to declare the style's stages on; sharing one
+            graph across styles of the same image runs common stages once,
+            and its timings receive per-stage seconds
+        **kwargs: Style-specific parameters
+    """
+    func = STYLE_EXTRACTORS.get(style, extract_outline)
+    return func(gray, contrast=contrast, scale=scale, smoothing=smoothing,
+                graph=graph, **kwargs)
@@ -7,31 +7,245 @@ Handles image I/O, parameter validation, and helper functions.
 import cv2
 import numpy as np
 from typing import Tuple, Optional, Union
+import mmap
 import os
 
+from ingest import STREAMED_FORMATS, STREAM_MIN_PIXELS, MAX_STREAMED_PIXELS, read_reduced
 
-def load_image(path_or_bytes: Union[str, bytes]) -> np.ndarray:
+
+# Decompression-bomb guard: inputs whose header declares more pixels than
+# this are rejected before decoding
+MAX_IMAGE_PIXELS = 100_000_000
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                     0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image exceeds the configured pixel limit."""
+    pass
+
+
+def probe_image_size(data: Union[bytes, bytearray, memoryview]) -> Optional[Tuple[str, int, int]]:
+    """
+    Read format and dimensions from an encoded image's header, without
+    decoding any pixels.
+    
+    Parses PNG, JPEG, WebP, GIF and BMP headers directly and falls back to
+    Pillow's lazy open for other formats.
+    
+    Returns:
+        (format, width, height), or None if the header can't be read
+    """
+    view = memoryview(data).cast('B')
+    head = bytes(view[:32])
+    
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and len(head) >= 24:
+        return 'png', int.from_bytes(head[16:20], 'big'), int.from_bytes(head[20:24], 'big')
+    
+    if head.startswith(b'\xff\xd8'):
+        pos = 2
+        size = len(view)
+        while pos + 9 < size:
+            if view[pos] != 0xFF:
+                return None
+            marker = view[pos + 1]
+            if marker == 0xFF:            # fill byte
+                pos += 1
+                continue
+            if marker in _JPEG_SOF_MARKERS:
+                height = (view[pos + 5] << 8) | view[pos + 6]
+                width = (view[pos + 7] << 8) | view[pos + 8]
+                return 'jpeg', width, height
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                pos += 2                  # markers without a length
+                continue
+            pos += 2 + ((view[pos + 2] << 8) | view[pos + 3])
+        return None
+    
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b'VP8 ':
+            return ('webp', int.from_bytes(head[26:28], 'little') & 0x3FFF,
+                    int.from_bytes(head[28:30], 'little') & 0x3FFF)
+        if chunk == b'VP8L':
+            bits = int.from_bytes(head[21:25], 'little')
+            return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return ('webp', int.from_bytes(head[24:27], 'little') + 1,
+                    int.from_bytes(head[27:30], 'little') + 1)
+    
+    if head[:4] == b'GIF8' and len(head) >= 10:
+        return 'gif', int.from_bytes(head[6:8], 'little'), int.from_bytes(head[8:10], 'little')
+    
+    if head[:2] == b'BM' and len(head) >= 26:
+        return ('bmp', int.from_bytes(head[18:22], 'little', signed=True),
+                abs(int.from_bytes(head[22:26], 'little', signed=True)))
+    
+    if head[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+        size = _tiff_size(view)
+        if size is not None:
+            return ('tiff',) + size
+    
+    try:
+        import io
+        from PIL import Image
+        with Image.open(io.BytesIO(view)) as img:
+            return (img.format or 'unknown').lower(), img.size[0], img.size[1]
+    except Exception:
+        return None
+
+
+def _tiff_size(view: memoryview) -> Optional[Tuple[int, int]]:
+    """(width, height) from the first IFD of a classic or Big TIFF."""
+    import struct
+    try:
+        order = '<' if bytes(view[:2]) == b'II' else '>'
+        big = struct.unpack(order + 'H', view[2:4])[0] == 43
+        if big:
+            offset = struct.unpack(order + 'Q', view[8:16])[0]
+            count = struct.unpack(order + 'Q', view[offset:offset + 8])[0]
+            entry, start, head = 20, offset + 8, order + 'HHQ'
+        else:
+            offset = struct.unpack(order + 'I', view[4:8])[0]
+            count = struct.unpack(order + 'H', view[offset:offset + 2])[0]
+            entry, start, head = 12, offset + 2, order + 'HHI'
+        size = {}
+        for i in range(count):
+            pos = start + i * entry
+            tag, kind, _ = struct.unpack(head, view[pos:pos + struct.calcsize(head)])
+            if tag in (256, 257):
+                value_pos = pos + struct.calcsize(head)
+                fmt = {3: 'H', 4: 'I', 16: 'Q'}.get(kind)
+                if fmt is None:
+                    return None
+                size[tag] = struct.unpack(order + fmt, view[value_pos:value_pos + struct.calcsize(fmt)])[0]
+        return (size[256], size[257]) if len(size) == 2 else None
+    except (struct.error, KeyError, ValueError):
+        return None
+
+
+def _reduced_decode_factor(width: int, height: int, max_side: int) -> int:
+    """Largest JPEG DCT scaling factor (1, 2, 4, 8) keeping max_side pixels."""
+    factor = 1
+    for candidate in (2, 4, 8):
+        if max(width, height) // candidate >= max_side:
+            factor = candidate
+    return factor
+
+
+def load_image(path_or_bytes: Union[str, bytes, bytearray, memoryview, np.ndarray],
+               max_pixels: int = MAX_IMAGE_PIXELS,
+               max_side: int = 0,
+               grayscale: bool = False,
+               max_streamed_pixels: int = MAX_STREAMED_PIXELS,
+               info: Optional[dict] = None) -> np.ndarray:
     """
     Load an image from file path or bytes.
     
+    The header is probed first: images over max_pixels are rejected before
+    any pixels are decoded. JPEGs larger than needed are decoded at 1/2,
+    1/4 or 1/8 scale in the DCT domain (never below max_side). Large TIFFs
+    and PNGs are decoded in bands and reduced by an integer factor on the
+    fly (never below max_side), so their full-resolution pixels are never
+    in memory at once (see ingest.py).
+    
     Args:
-        path_or_bytes: File path (str) or image bytes
+        path_or_bytes: File path (str; memory-mapped, not read), encoded
+            image bytes (any buffer; decoded in place without copying), or
+            an already decoded BGR array (returned as-is)
+        max_pixels: Pixel limit (width * height); 0 disables the check
+        max_side: Longest side the caller will work at (0 = full size);
+            enables reduced-scale JPEG decoding and band-streamed TIFF/PNG
+            decoding
+        grayscale: Decode straight to a single channel (for pipelines with
+            no color stage such as background removal)
+        max_streamed_pixels: Pixel limit replacing max_pixels for images
+            that are band-streamed; 0 disables the check
+        info: Optional dict receiving 'source_shape', the (height, width)
+            of the image at full resolution: from its header, since reduced
+            decoding shrinks the returned array
         
     Returns:
-        numpy array (BGR format)
+        numpy array (BGR format, or single-channel with grayscale=True)
+        
+    Raises:
+        ImageTooLargeError: If the image exceeds the pixel limit
+        ValueError: If the image can't be decoded
     """
-    if isinstance(path_or_bytes, bytes):
-        nparr = np.frombuffer(path_or_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if isinstance(path_or_bytes, np.ndarray):
+        if info is not None:
+            info['source_shape'] = path_or_bytes.shape[:2]
+        return path_or_bytes
+    
+    if isinstance(path_or_bytes, (bytes, bytearray, memoryview)):
+        data = path_or_bytes
     else:
-        img = cv2.imread(path_or_bytes, cv2.IMREAD_COLOR)
+        with open(path_or_bytes, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:          # empty file
+                raise ValueError("Could not load image. Check format and path.")
+    
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    probe = probe_image_size(data)
+    if probe is not None:
+        fmt, width, height = probe
+        streamed = (fmt in STREAMED_FORMATS and max_side and width * height >= STREAM_MIN_PIXELS
+                    and max(width, height) >= 2 * max_side)
+        limit = max_streamed_pixels if streamed else max_pixels
+        if limit and width * height > limit:
+            raise ImageTooLargeError(
+                f"Image is {width}x{height} ({width * height / 1e6:.0f} MP), "
+                f"limit is {limit / 1e6:.0f} MP"
+            )
+        if streamed:
+            img = read_reduced(data, fmt, max_side, grayscale)
+            if img is not None:
+                if info is not None:
+                    info['source_shape'] = _source_shape(probe, img)
+                return img
+            if max_pixels and width * height > max_pixels:
+                raise ImageTooLargeError(
+                    f"Image is {width}x{height} ({width * height / 1e6:.0f} MP), "
+                    f"limit is {max_pixels / 1e6:.0f} MP for this {fmt.upper()} layout"
+                )
+        if fmt == 'jpeg' and max_side:
+            factor = _reduced_decode_factor(width, height, max_side)
+            if factor > 1:
+                flags = {
+                    (2, False): cv2.IMREAD_REDUCED_COLOR_2, (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                    (4, False): cv2.IMREAD_REDUCED_COLOR_4, (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                    (8, False): cv2.IMREAD_REDUCED_COLOR_8, (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+                }[(factor, grayscale)]
+    
+    nparr = np.frombuffer(data, np.uint8)
+    img = cv2.imdecode(nparr, flags)
     
     if img is None:
         raise ValueError("Could not load image. Check format and path.")
     
+    if max_pixels and probe is None and img.shape[0] * img.shape[1] > max_pixels:
+        raise ImageTooLargeError(
+            f"Image is {img.shape[1]}x{img.shape[0]}, limit is {max_pixels / 1e6:.0f} MP"
+        )
+    
+    if info is not None:
+        info['source_shape'] = _source_shape(probe, img)
     return img
 
 
+def _source_shape(probe: Optional[Tuple[str, int, int]], img: np.ndarray) -> Tuple[int, int]:
+    """Full-resolution (height, width) of a decoded image, from its probed header."""
+    if probe is None:
+        return img.shape[:2]
+    _, width, height = probe
+    if (height - width) * (img.shape[0] - img.shape[1]) < 0:
+        # Decoding applied an EXIF rotation
+        width, height = height, width
+    return height, width
+
+
 def save_image(image: np.ndarray, path: str, quality: int = 95) -> bool:
     """
     Save image to file.
@@ -60,19 +274,62 @@ def save_image(image: np.ndarray, path: str, quality: int = 95) -> bool:
     return cv2.imwrite(path, image, params)
 
 
+# Supported output formats: name -> (OpenCV extension, MIME type)
+OUTPUT_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'jpg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+}
+
+
+def validate_output_format(fmt: Optional[str]) -> str:
+    """
+    Normalize an output format name, extension or MIME type to an extension.
+    
+    Args:
+        fmt: 'png', '.jpg', 'image/webp', ... (None = PNG)
+        
+    Returns:
+        OpenCV extension ('.png', '.jpg' or '.webp')
+    """
+    if not fmt:
+        return '.png'
+    key = fmt.lower().strip().lstrip('.')
+    if key.startswith('image/'):
+        key = key[len('image/'):]
+    if key not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    return OUTPUT_FORMATS[key][0]
+
+
+def mime_type_for(format: str) -> str:
+    """MIME type for an OpenCV extension returned by validate_output_format."""
+    return OUTPUT_FORMATS[format.lstrip('.')][1]
+
+
 def image_to_bytes(image: np.ndarray, format: str = '.png') -> bytes:
     """
     Convert image to bytes.
     
     Args:
         image: numpy array
-        format: Image format ('.png', '.jpg')
+        format: Image format ('.png', '.jpg', '.webp')
         
     Returns:
         Image as bytes
     """
     if format == '.png':
         params = [cv2.IMWRITE_PNG_COMPRESSION, 9]
+    elif format in ['.jpg', '.jpeg']:
+        params = [cv2.IMWRITE_JPEG_QUALITY, 95]
+        # JPEG has no alpha: composite transparent stencils onto white
+        if len(image.shape) == 3 and image.shape[2] == 4:
+            alpha = image[:, :, 3:4].astype(np.float32) / 255.0
+            bgr = image[:, :, :3].astype(np.float32) * alpha + 255.0 * (1.0 - alpha)
+            image = bgr.astype(np.uint8)
+    elif format == '.webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, 101]  # >100 = lossless
     else:
         params = []
     
@@ -102,6 +359,47 @@ def base64_to_bytes(data_url: str) -> bytes:
     return base64.b64decode(data_url)
 
 
+def validate_color(color: Optional[str]) -> str:
+    """
+    Validate a hex color ('#ff0000', 'ff0000' or '#f00').
+    
+    Returns:
+        Normalized '#rrggbb' string
+        
+    Raises:
+        ValueError: If the color isn't a 3- or 6-digit hex color
+    """
+    key = color.strip().lstrip('#').lower() if isinstance(color, str) else ''
+    if len(key) == 3:
+        key = ''.join(c * 2 for c in key)
+    if len(key) != 6 or any(c not in '0123456789abcdef' for c in key):
+        raise ValueError(f"Invalid color: {color} (use a hex color such as #000000)")
+    return '#' + key
+
+
+def hex_to_bgr(hex_color: str) -> Tuple[int, int, int]:
+    """Convert hex color string (e.g. '#ff0000') to BGR tuple."""
+    hex_color = validate_color(hex_color).lstrip('#')
+    r = int(hex_color[0:2], 16)
+    g = int(hex_color[2:4], 16)
+    b = int(hex_color[4:6], 16)
+    return (b, g, r)  # BGR format for OpenCV
+
+
+def image_digest(image: np.ndarray) -> str:
+    """
+    Content hash of a decoded image (pixels, shape and dtype).
+    
+    Identical pictures hash the same regardless of how they were encoded
+    or transported.
+    """
+    import hashlib
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.shape}|{image.dtype.str}".encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
 def validate_thickness(thickness: int) -> int:
     """Validate and normalize line thickness (1-10 pixels)."""
     return max(1, min(10, thickness))
@@ -112,6 +410,38 @@ def validate_contrast(contrast: int) -> int:
     return max(0, min(100, contrast))
 
 
+def validate_denoise_tier(tier: Optional[str]) -> str:
+    """
+    Validate a denoise tier name ('draft', 'standard', 'print').
+    
+    Raises:
+        ValueError: If the tier is unknown (None = default tier)
+    """
+    from preprocessing import DENOISE_TIERS, DEFAULT_DENOISE_TIER
+    if not tier:
+        return DEFAULT_DENOISE_TIER
+    key = tier.lower().strip()
+    if key not in DENOISE_TIERS:
+        raise ValueError(f"Unsupported denoise tier: {tier} (use {', '.join(DENOISE_TIERS)})")
+    return key
+
+
+def validate_smoothing(method: Optional[str]) -> str:
+    """
+    Validate an edge-preserving smoothing method ('bilateral', 'grid', 'auto').
+    
+    Raises:
+        ValueError: If the method is unknown (None = default method)
+    """
+    from preprocessing import SMOOTHING_METHODS, DEFAULT_SMOOTHING
+    if not method:
+        return DEFAULT_SMOOTHING
+    key = method.lower().strip()
+    if key not in SMOOTHING_METHODS:
+        raise ValueError(f"Unsupported smoothing method: {method} (use {', '.join(SMOOTHING_METHODS)})")
+    return key
+
+
 def validate_resolution(resolution: str) -> Tuple[int, int]:
     """
     Parse resolution string to (width, height).
@@ -241,10 +571,18 @@ def warn_if_low_resolution(image: np.ndarray, min_recommended: int = 1000) -> bo
 
 
 class Timer:
-    """Simple timer context manager for performance measurement."""
+    """
+    Simple timer context manager for performance measurement.
+    
+    If a `record` dict is given, the elapsed seconds are also stored in it
+    under the timer's name (or `key`).
+    """
     
-    def __init__(self, name: str = "Operation"):
+    def __init__(self, name: str = "Operation", record: Optional[dict] = None,
+                 key: Optional[str] = None):
         self.name = name
+        self.record = record
+        self.key = key or name
         self.start_time = None
         self.elapsed = 0
         
@@ -256,4 +594,6 @@ class Timer:
     def __exit__(self, *args):
         import time
         self.elapsed = time.time() - self.start_time
+        if self.record is not None:
+            self.record[self.key] = round(self.elapsed, 4)
         print(f"[Timer] {self.name}: {self.elapsed:.2f}s")
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Process pool for the Stencil Processing Service.
+
+Runs a fixed number of pre-warmed worker processes, each owning its own
+TattooStencilGenerator. Decoded images are handed to the workers through
+shared memory so multi-megabyte arrays are never pickled; only the small
+parameter dict and the encoded PNG travel over the pipe.
+
+Crashed workers are detected by a supervisor thread (and on dispatch) and
+replaced transparently.
+
+Each worker keeps its own cache of preprocessed grayscale images; requests
+for an image a worker has already seen are routed to that worker when it
+is idle, so style/thickness changes skip denoising (and thickness changes
+skip contour extraction) in pool mode too.
+"""
+
+import os
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait as wait_for_sentinels
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, List, Hashable
+
+import numpy as np
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised when a worker process dies while handling a request."""
+    pass
+
+
+def _worker_main(conn, worker_id: int, gray_cache_bytes: int,
+                 geometry_cache_bytes: int, tile_workers: int = 1) -> None:
+    """
+    Worker process entry point.
+
+    Receives (shm_name, shape, dtype, params) messages, runs the generator
+    on the shared image and sends back ('ok', png_bytes, timings, packed_mask)
+    or ('error', message),
+    preceded by ('progress', stage, fraction) updates when params has
+    'progress' set. A None message shuts the worker down.
+    """
+    import cv2
+    # One OpenCV thread per worker: parallelism comes from the pool
+    cv2.setNumThreads(1)
+
+    from stencil_generator import TattooStencilGenerator
+    from cache import ByteBudgetLRU
+    from tiles import TileExecutor
+
+    gray_cache = ByteBudgetLRU(gray_cache_bytes, name='preprocessed')
+    geometry_cache = ByteBudgetLRU(geometry_cache_bytes, name='geometry')
+    # Large single requests spread their smoothing/Canny tiles over
+    # threads of their own
+    tiles = TileExecutor(tile_workers) if tile_workers > 1 else None
+    generator = TattooStencilGenerator(gray_cache=gray_cache,
+                                       geometry_cache=geometry_cache,
+                                       tiles=tiles)
+
+    # Warm up OpenCV kernels and allocators before taking real work
+    warmup = np.full((64, 64, 3), 255, dtype=np.uint8)
+    cv2.circle(warmup, (32, 32), 16, (0, 0, 0), -1)
+    try:
+        generator.generate(warmup, style='outline')
+    except Exception:
+        pass
+    gray_cache.clear()
+    geometry_cache.clear()
+
+    segments: Dict[str, shared_memory.SharedMemory] = {}
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+
+        shm_name, shape, dtype, params = message
+        try:
+            shm = segments.get(shm_name)
+            if shm is None:
+                # Segment changed (grown by the parent) - drop stale handles
+                for old in segments.values():
+                    old.close()
+                segments.clear()
+                shm = shared_memory.SharedMemory(name=shm_name)
+                segments[shm_name] = shm
+
+            image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            result = _run_generator(generator, image, params, conn)
+            del image
+            mask = None
+            if params.get('return_mask'):
+                from postprocessing import pack_mask
+                if 'variants' in params:
+                    mask = [pack_mask(m) for m in generator.last_masks]
+                else:
+                    mask = pack_mask(generator.last_mask)
+            conn.send(('ok', result, generator.timings, mask))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+    for shm in segments.values():
+        shm.close()
+
+
+def _run_generator(generator, image: np.ndarray, params: Dict[str, Any], conn) -> bytes:
+    """
+    Apply request parameters to the worker's generator and run it.
+    
+    With a 'variants' list the whole batch runs here, sharing one
+    preprocessing pass, and a list of encoded stencils is returned.
+    """
+    generator.progress_callback = (
+        (lambda stage, fraction: conn.send(('progress', stage, fraction)))
+        if params.get('progress') else None
+    )
+    if 'variants' in params:
+        return generator.generate_batch(image, params['variants'],
+                                        image_key=params.get('image_key'),
+                                        source_shape=params.get('source_shape'))
+    
+    generator.apply_params(params)
+
+    return generator.generate(
+        image,
+        style=params.get('style', 'outline'),
+        image_key=params.get('image_key'),
+        source_shape=params.get('source_shape'),
+        **params.get('style_kwargs', {})
+    )
+
+
+class _WorkerSlot:
+    """Parent-side handle for one worker process and its shared buffer."""
+
+    def __init__(self, ctx, worker_id: int, gray_cache_bytes: int,
+                 geometry_cache_bytes: int, tile_workers: int = 1):
+        self.ctx = ctx
+        self.worker_id = worker_id
+        self.gray_cache_bytes = gray_cache_bytes
+        self.geometry_cache_bytes = geometry_cache_bytes
+        self.tile_workers = tile_workers
+        self.process = None
+        self.conn = None
+        self.shm: Optional[shared_memory.SharedMemory] = None
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self) -> None:
+        parent_conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.worker_id, self.gray_cache_bytes,
+                  self.geometry_cache_bytes, self.tile_workers),
+            name=f"stencil-worker-{self.worker_id}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def restart(self) -> None:
+        """Kill (if needed) and respawn the worker process."""
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.start()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def buffer_for(self, nbytes: int) -> shared_memory.SharedMemory:
+        """Return a shared segment of at least nbytes, growing it if needed."""
+        if self.shm is None or self.shm.size < nbytes:
+            self.release_buffer()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        return self.shm
+
+    def release_buffer(self) -> None:
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.release_buffer()
+
+
+class StencilWorkerPool:
+    """
+    Fixed-size pool of pre-warmed stencil worker processes.
+
+    Each call to generate() blocks the calling thread until a worker is
+    free, so the pool is meant to be driven by a threading HTTP server.
+    """
+
+    # Remembered image -> worker assignments for cache affinity
+    AFFINITY_ENTRIES = 4096
+
+    def __init__(self, size: Optional[int] = None,
+                 gray_cache_bytes: int = 128 * 1024 * 1024,
+                 geometry_cache_bytes: int = 32 * 1024 * 1024,
+                 tile_workers: int = 1):
+        """
+        Start the pool.
+
+        Args:
+            size: Number of worker processes (default: CPU count)
+            gray_cache_bytes: Per-worker byte budget for preprocessed images
+            geometry_cache_bytes: Per-worker byte budget for contour geometry
+            tile_workers: Per-worker threads for tile-parallel styles on
+                large images (1 = off)
+        """
+        self.size = max(1, size or os.cpu_count() or 1)
+
+        # forkserver avoids forking a parent that already runs server threads
+        method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+        self._ctx = mp.get_context(method)
+
+        self._slots = [_WorkerSlot(self._ctx, i, gray_cache_bytes, geometry_cache_bytes,
+                                   tile_workers)
+                       for i in range(self.size)]
+        self._idle: List[_WorkerSlot] = list(self._slots)
+        self._idle_cond = threading.Condition()
+        self._affinity: "OrderedDict[Hashable, int]" = OrderedDict()
+        self.affinity_hits = 0
+
+        self._lock = threading.Lock()
+        self.restarts = 0
+        self._closed = False
+
+        self._supervisor = threading.Thread(
+            target=self._supervise, name="stencil-pool-supervisor", daemon=True
+        )
+        self._supervisor.start()
+
+        print(f"[Pool] Started {self.size} worker processes ({method})")
+
+    def generate(self,
+                 image: np.ndarray,
+                 progress: Optional[Callable[[str, float], None]] = None,
+                 timings: Optional[dict] = None,
+                 return_mask: bool = False,
+                 **params):
+        """
+        Run the stencil pipeline on a decoded image in a worker process.
+
+        Args:
+            image: Decoded BGR (or grayscale) image
+            progress: Optional (stage, fraction) callback. If it raises, the
+                worker is replaced (aborting its run) and the error propagates.
+            timings: Optional dict updated with the worker's stage timings
+            return_mask: Also return the bit-packed stencil mask
+            **params: style, style_kwargs, image_key (also used for routing
+                to the worker that cached this image), source_shape (see
+                TattooStencilGenerator.generate) and the normalized
+                parameters accepted by TattooStencilGenerator.apply_params,
+                or 'variants': a list of such dicts to run as one batch
+
+        Returns:
+            Encoded image bytes, or (bytes, packed mask) with return_mask;
+            lists of both for a batch
+        """
+        if self._closed:
+            raise RuntimeError("Worker pool is closed")
+
+        image = np.ascontiguousarray(image)
+        slot = self._acquire(params.get('image_key'))
+        try:
+            if not slot.is_alive():
+                self._replace(slot, slot.process)
+
+            shm = slot.buffer_for(image.nbytes)
+            shared = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+            shared[...] = image
+            del shared
+
+            params['progress'] = progress is not None
+            params['return_mask'] = return_mask
+            process = slot.process
+            try:
+                slot.conn.send((shm.name, image.shape, image.dtype.str, params))
+                while True:
+                    status, *payload = slot.conn.recv()
+                    if status != 'progress':
+                        break
+                    try:
+                        progress(*payload)
+                    except BaseException:
+                        # Abort the run by recycling the worker
+                        self._replace(slot, process)
+                        raise
+            except (EOFError, BrokenPipeError, ConnectionResetError, OSError):
+                self._replace(slot, process)
+                raise WorkerCrashedError(
+                    f"Worker {slot.worker_id} crashed while processing request"
+                )
+
+            if status != 'ok':
+                raise ValueError(payload[0])
+            result, stage_timings, mask = payload
+            if timings is not None:
+                timings.update(stage_timings)
+            return (result, mask) if return_mask else result
+        finally:
+            self._release(slot)
+
+    def _acquire(self, affinity_key: Optional[Hashable]) -> _WorkerSlot:
+        """
+        Take an idle worker, preferring the one that last handled this image.
+        """
+        with self._idle_cond:
+            while not self._idle:
+                self._idle_cond.wait()
+
+            slot = None
+            preferred = self._affinity.get(affinity_key) if affinity_key else None
+            if preferred is not None:
+                slot = next((s for s in self._idle if s.worker_id == preferred), None)
+                if slot is not None:
+                    self.affinity_hits += 1
+            if slot is None:
+                slot = self._idle[0]
+            self._idle.remove(slot)
+
+            if affinity_key:
+                self._affinity[affinity_key] = slot.worker_id
+                self._affinity.move_to_end(affinity_key)
+                while len(self._affinity) > self.AFFINITY_ENTRIES:
+                    self._affinity.popitem(last=False)
+            return slot
+
+    def _release(self, slot: _WorkerSlot) -> None:
+        with self._idle_cond:
+            self._idle.append(slot)
+            self._idle_cond.notify()
+
+    def _replace(self, slot: _WorkerSlot, process) -> None:
+        """
+        Respawn a dead or broken worker.
+        
+        Only restarts if the slot still runs the given process, so the
+        supervisor and a request thread never both replace the same worker.
+        """
+        with slot.lock:
+            if self._closed or slot.process is not process:
+                return
+            with self._lock:
+                self.restarts += 1
+            print(f"[Pool] Replacing worker {slot.worker_id}")
+            slot.restart()
+
+    def _supervise(self) -> None:
+        """Watch worker sentinels and replace processes that exit."""
+        while not self._closed:
+            processes = {s.process.sentinel: (s, s.process) for s in self._slots}
+            ready = wait_for_sentinels(list(processes), timeout=1.0)
+            for sentinel in ready:
+                slot, process = processes[sentinel]
+                if not self._closed:
+                    self._replace(slot, process)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool status for the health endpoint."""
+        return {
+            'workers': self.size,
+            'idle': len(self._idle),
+            'alive': sum(1 for s in self._slots if s.is_alive()),
+            'restarts': self.restarts,
+            'affinityHits': self.affinity_hits,
+        }
+
+    def close(self) -> None:
+        """Stop all workers and release shared memory."""
+        if self._closed:
+            return
+        self._closed = True
+        for slot in self._slots:
+            with slot.lock:
+                slot.stop()